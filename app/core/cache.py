@@ -0,0 +1,239 @@
+import asyncio
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Dict, Hashable, Iterable, List, Optional, Tuple
+
+_MISSING = object()
+
+_registry: Dict[str, Any] = {}
+
+
+class TTLCache:
+    """
+    A bounded in-process cache with LRU eviction and a per-entry time-to-live.
+
+    It is meant to be used from the event loop thread only, so it takes no locks.
+    Every instance registers itself by name so `get_cache_stats` can report
+    hit/miss counters for all caches at once.
+    """
+
+    def __init__(self, name: str, max_size: int, ttl_seconds: float):
+        self.name = name
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self._data: "OrderedDict[Hashable, Tuple[float, Any]]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        _registry[name] = self
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def __contains__(self, key: Hashable) -> bool:
+        entry = self._data.get(key)
+        return entry is not None and entry[0] > time.monotonic()
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        entry = self._data.get(key, _MISSING)
+        if entry is _MISSING:
+            self.misses += 1
+            return default
+        expires_at, value = entry
+        if expires_at <= time.monotonic():
+            del self._data[key]
+            self.misses += 1
+            return default
+        self._data.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def get_many(self, keys: Iterable[Hashable]) -> Tuple[Dict[Hashable, Any], List[Hashable]]:
+        """Returns the cached values for `keys` and the list of keys that were not cached."""
+        found, missing = {}, []
+        for key in keys:
+            value = self.get(key, _MISSING)
+            if value is _MISSING:
+                missing.append(key)
+            else:
+                found[key] = value
+        return found, missing
+
+    def set(self, key: Hashable, value: Any, ttl_seconds: Optional[float] = None):
+        ttl = self.ttl_seconds if ttl_seconds is None else ttl_seconds
+        self._data[key] = (time.monotonic() + ttl, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.max_size:
+            self._data.popitem(last=False)
+            self.evictions += 1
+
+    def invalidate(self, key: Hashable):
+        if self._data.pop(key, _MISSING) is not _MISSING:
+            self.invalidations += 1
+
+    def invalidate_many(self, keys: Iterable[Hashable]):
+        for key in keys:
+            self.invalidate(key)
+
+    def clear(self):
+        self.invalidations += len(self._data)
+        self._data.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._data),
+            "max_size": self.max_size,
+            "ttl_seconds": self.ttl_seconds,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 3) if lookups else None,
+            "evictions": self.evictions,
+            "invalidations": self.invalidations,
+        }
+
+
+class PersistentCache:
+    """
+    A string-keyed cache of JSON values stored in SQLite, with a `TTLCache` in front.
+
+    Entries survive restarts, expire after `ttl_seconds` and, once there are
+    more than `max_entries`, the least recently read ones are evicted. The
+    async methods run the SQLite work in a thread so the event loop is never
+    blocked on disk; the in-memory layer answers repeated keys without it.
+    The in-memory layer is a `TTLCache`, so the async methods only touch it
+    on the event loop thread, before and after the thread call.
+    """
+
+    def __init__(self, name: str, path: str, ttl_seconds: float, max_entries: int, memory_size: int):
+        self.name = name
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.memory = TTLCache(f"{name}_memory", max_size=memory_size, ttl_seconds=ttl_seconds)
+        self.disk_hits = 0
+        self.disk_misses = 0
+        self._lock = threading.Lock()
+        self._conn: Optional[sqlite3.Connection] = None
+        self._writes_since_eviction = 0
+        _registry[name] = self
+
+    def _connection(self) -> sqlite3.Connection:
+        if self._conn is None:
+            if self.path != ":memory:":
+                Path(self.path).parent.mkdir(parents=True, exist_ok=True)
+            self._conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS entries ("
+                "key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL, accessed_at REAL NOT NULL)"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS ix_entries_accessed_at ON entries (accessed_at)")
+        return self._conn
+
+    def _disk_get(self, key: str) -> Optional[Tuple[Any, float]]:
+        """(value, seconds left) of a stored entry, or None; touches only SQLite, so it can run in a thread."""
+        now = time.time()
+        with self._lock:
+            conn = self._connection()
+            row = conn.execute("SELECT value, expires_at FROM entries WHERE key = ?", (key,)).fetchone()
+            if row is None or row[1] <= now:
+                self.disk_misses += 1
+                return None
+            conn.execute("UPDATE entries SET accessed_at = ? WHERE key = ?", (now, key))
+            self.disk_hits += 1
+        return json.loads(row[0]), row[1] - now
+
+    def _disk_set(self, key: str, value: Any):
+        now = time.time()
+        with self._lock:
+            conn = self._connection()
+            conn.execute(
+                "INSERT OR REPLACE INTO entries (key, value, expires_at, accessed_at) VALUES (?, ?, ?, ?)",
+                (key, json.dumps(value, ensure_ascii=False), now + self.ttl_seconds, now),
+            )
+            self._writes_since_eviction += 1
+            if self._writes_since_eviction >= max(1, self.max_entries // 10):
+                self._evict(conn, now)
+
+    def _disk_size(self) -> int:
+        with self._lock:
+            return self._connection().execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+
+    def _remember(self, key: str, stored: Optional[Tuple[Any, float]]) -> Any:
+        if stored is None:
+            return None
+        value, ttl_seconds = stored
+        self.memory.set(key, value, ttl_seconds=ttl_seconds)
+        return value
+
+    def get(self, key: str) -> Any:
+        value = self.memory.get(key, _MISSING)
+        if value is not _MISSING:
+            return value
+        return self._remember(key, self._disk_get(key))
+
+    def set(self, key: str, value: Any):
+        self.memory.set(key, value)
+        self._disk_set(key, value)
+
+    def _evict(self, conn: sqlite3.Connection, now: float):
+        conn.execute("DELETE FROM entries WHERE expires_at <= ?", (now,))
+        conn.execute(
+            "DELETE FROM entries WHERE key IN ("
+            "SELECT key FROM entries ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)",
+            (self.max_entries,),
+        )
+        self._writes_since_eviction = 0
+
+    async def aget(self, key: str) -> Any:
+        value = self.memory.get(key, _MISSING)
+        if value is not _MISSING:
+            return value
+        return self._remember(key, await asyncio.to_thread(self._disk_get, key))
+
+    async def aset(self, key: str, value: Any):
+        self.memory.set(key, value)
+        await asyncio.to_thread(self._disk_set, key, value)
+
+    def clear(self):
+        self.memory.clear()
+        with self._lock:
+            self._connection().execute("DELETE FROM entries")
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+    def stats(self, size: Optional[int] = None) -> Dict[str, Any]:
+        return {
+            "size": self._disk_size() if size is None else size,
+            "max_size": self.max_entries,
+            "ttl_seconds": self.ttl_seconds,
+            "disk_hits": self.disk_hits,
+            "disk_misses": self.disk_misses,
+        }
+
+
+    async def astats(self) -> Dict[str, Any]:
+        return self.stats(size=await asyncio.to_thread(self._disk_size))
+
+
+def get_cache_stats() -> Dict[str, Dict[str, Any]]:
+    """Returns the counters of every registered cache, keyed by cache name."""
+    return {name: cache.stats() for name, cache in _registry.items()}
+
+
+async def aget_cache_stats() -> Dict[str, Dict[str, Any]]:
+    """`get_cache_stats` for the event loop: the SQLite entry counts are read in a thread."""
+    return {
+        name: await cache.astats() if isinstance(cache, PersistentCache) else cache.stats()
+        for name, cache in _registry.items()
+    }
@@ -1,3 +1,4 @@
+from typing import List, Optional
 from pydantic_settings import BaseSettings
 
 class Settings(BaseSettings):
@@ -7,6 +8,120 @@ class Settings(BaseSettings):
     # PINECONE_API_KEY: str
     # PINECONE_ENVIRONMENT: str
 
+    # Async SQLAlchemy engine / connection pool
+    DB_ECHO: bool = False
+    DB_POOL_SIZE: int = 10
+    DB_MAX_OVERFLOW: int = 20
+    DB_POOL_TIMEOUT: float = 10.0
+    DB_POOL_RECYCLE: int = 1800
+    DB_POOL_PRE_PING: bool = True
+    DB_STATEMENT_CACHE_SIZE: int = 500
+
+    # In-process catalog cache (products, members, shops)
+    CATALOG_CACHE_TTL_SECONDS: int = 600
+    CATALOG_CACHE_MAX_PRODUCTS: int = 10000
+    CATALOG_CACHE_MAX_MEMBERS: int = 50000
+    CATALOG_CACHE_MAX_SHOPS: int = 10000
+    # Endpoint the data loader calls after a reload, e.g. http://app:8000/cache/invalidate
+    CACHE_INVALIDATION_URL: Optional[str] = None
+    # Shared secret for /cache/invalidate (X-Cache-Token header); unset, only loopback clients may call it
+    CACHE_INVALIDATION_TOKEN: Optional[str] = None
+
+    # Data loader (COPY-based parquet import)
+    LOADER_WORKERS: int = 4
+    LOADER_BATCH_ROWS: int = 50000
+    # Incremental refresh (scripts/data_loader.py --refresh)
+    CATALOG_CHANGE_FEED_FILE: str = "logs/catalog_changes.jsonl"
+    CATALOG_REFRESH_MAX_INVALIDATION_KEYS: int = 10000
+
+    # Product vector index (built by scripts/data_loader.py)
+    PRODUCT_INDEX_DIR: str = "data/product_index"
+    PRODUCT_INDEX_EMBEDDING_MODEL: str = "text-embedding-3-small"
+    PRODUCT_INDEX_DIMENSIONS: int = 512
+    PRODUCT_INDEX_CANDIDATES: int = 20
+    PRODUCT_INDEX_VECTOR_WEIGHT: float = 0.6
+    PRODUCT_SEARCH_MAX_TOOL_ROUNDS: int = 5
+    PRODUCT_SEARCH_MAX_TOOL_ROUNDS_WITH_INDEX: int = 2
+
+    # Deterministic product resolution before the select-best-match LLM call
+    PRODUCT_RESOLVER_ENABLED: bool = True
+    PRODUCT_RESOLVER_CANDIDATES: int = 10
+    PRODUCT_RESOLVER_MIN_SIMILARITY: float = 0.8
+    PRODUCT_RESOLVER_MIN_GAP: float = 0.15
+    PRODUCT_RESOLVER_MODEL_CODE_MIN_SIMILARITY: float = 0.4
+
+    # Combined first stage: classification, product name and product pick in one structured-output call
+    FIRST_STAGE_COMBINED: bool = True
+    FIRST_STAGE_CANDIDATES: int = 10
+
+    # Speculative prefetches started while the scenario is being classified
+    SPECULATION_ENABLED: bool = True
+    SPECULATION_MAX_TASKS: int = 3  # per request
+    SPECULATION_MAX_IN_FLIGHT: int = 64  # across requests; more are skipped
+    SPECULATION_TIMEOUT_SECONDS: float = 2.0
+    SPECULATION_MAX_POOL_SATURATION: float = 0.75  # no DB prefetches while the pool is busier than this
+
+    # Scenario classification cache (SQLite on disk, LRU in memory)
+    CLASSIFICATION_CACHE_ENABLED: bool = True
+    CLASSIFICATION_CACHE_PATH: str = "data/classification_cache.sqlite3"
+    CLASSIFICATION_CACHE_TTL_SECONDS: int = 7 * 24 * 3600
+    CLASSIFICATION_CACHE_MAX_ENTRIES: int = 100000
+    CLASSIFICATION_CACHE_MEMORY_SIZE: int = 5000
+
+    # Seller aggregation specs (scenarios 3 and 5), cached per question template
+    AGGREGATION_SPEC_CACHE_SIZE: int = 2000
+    AGGREGATION_SPEC_CACHE_TTL_SECONDS: int = 24 * 3600
+
+    # Scenario 4 conversation sessions ("memory" or "redis"; redis needs the redis package)
+    SESSION_STORE_BACKEND: str = "memory"
+    SESSION_STORE_REDIS_URL: str = "redis://localhost:6379/0"
+    SESSION_TTL_SECONDS: int = 3600
+    SESSION_STORE_MAX_SESSIONS: int = 10000
+
+    # Scenario 4 prompt payloads
+    LLM_PAYLOAD_MAX_SELLERS: int = 8
+    LLM_PAYLOAD_MAX_FEATURES: int = 15
+    LLM_PAYLOAD_TOKEN_BUDGET: int = 3000
+
+    # Category shortlist for the scenario 4 extract_category prompt
+    CATEGORY_SHORTLIST_SIZE: int = 15
+    CATEGORY_SHORTLIST_FEATURE_WEIGHT: float = 0.2
+    CATEGORY_SKIP_LLM_MIN_SCORE: float = 0.75
+    CATEGORY_SKIP_LLM_MIN_MARGIN: float = 0.25
+
+    # Request/response log (append-only JSONL)
+    REQUEST_LOG_FILE: str = "logs/request_logs.jsonl"
+    REQUEST_LOG_MAX_BYTES: int = 50 * 1024 * 1024
+    REQUEST_LOG_MAX_AGE_SECONDS: int = 24 * 60 * 60
+    REQUEST_LOG_FLUSH_INTERVAL: float = 1.0
+    REQUEST_LOG_MAX_BODY_BYTES: int = 64 * 1024
+
+    # Stage-level tracing: spans go to a JSONL file or an OTLP/HTTP collector; /metrics serves histograms
+    TRACING_ENABLED: bool = True
+    TRACING_EXPORTER: str = "json"  # "json", "otlp" or "none"
+    TRACING_JSON_FILE: str = "logs/traces.jsonl"
+    TRACING_OTLP_ENDPOINT: str = "http://localhost:4318/v1/traces"
+    TRACING_SERVICE_NAME: str = "chat-assistant"
+    TRACING_HISTOGRAM_BUCKETS: List[float] = [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30]
+
+    # LLM record/replay: "off", "record" (call the API and store every exchange),
+    # "replay" (serve only stored exchanges) or "auto" (replay, record on a miss)
+    LLM_CASSETTE_MODE: str = "off"
+    LLM_CASSETTE_DIR: str = "data/llm_cassettes"
+    LLM_CASSETTE_LATENCY: Optional[float] = None  # fixed replay delay in seconds; None replays the recorded latency
+    LLM_CASSETTE_LATENCY_SCALE: float = 1.0
+
+    # Shared outgoing HTTP client (image-embedding / vector-search servers)
+    HTTP_POOL_LIMIT: int = 100
+    HTTP_POOL_LIMIT_PER_HOST: int = 20
+    HTTP_DNS_CACHE_TTL: int = 300
+    HTTP_KEEPALIVE_TIMEOUT: float = 30.0
+    HTTP_CONNECT_TIMEOUT: float = 3.0
+    HTTP_TOTAL_TIMEOUT: float = 10.0
+    HTTP_MAX_RETRIES: int = 2
+    HTTP_RETRY_BACKOFF: float = 0.2
+    HTTP_RETRY_DEADLINE: float = 15.0  # all attempts of one call; must stay below the 30s /chat budget
+
     class Config:
         env_file = ".env"
         env_file_encoding = "utf-8"
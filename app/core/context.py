@@ -1,5 +1,12 @@
+import asyncio
 from contextvars import ContextVar
-from typing import Optional
+from typing import Any, Optional
 
 # A context variable to store the scenario for the current request
-scenario_context: ContextVar[Optional[str]] = ContextVar("scenario_context", default=None)
\ No newline at end of file
+scenario_context: ContextVar[Optional[str]] = ContextVar("scenario_context", default=None)
+
+# Set by the streaming chat endpoint: user-facing LLM text is pushed here token by token.
+token_sink: ContextVar[Optional[asyncio.Queue]] = ContextVar("token_sink", default=None)
+
+# The speculative prefetches of the current chat request (app.core.speculation.Speculation).
+current_speculation: ContextVar[Optional[Any]] = ContextVar("current_speculation", default=None)
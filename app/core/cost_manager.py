@@ -1,5 +1,102 @@
-from contextvars import ContextVar
+from contextvars import ContextVar, Token
+from typing import Any, Dict, Optional
 
-total_cost_per_session: float = 0.0
 
-current_request_cost_var: ContextVar[float] = ContextVar("current_request_cost", default=0.0)
\ No newline at end of file
+class ModelUsage:
+    """Accumulated tokens, cost, latency and call count for a single model."""
+
+    __slots__ = ("calls", "input_tokens", "output_tokens", "cost", "latency")
+
+    def __init__(self):
+        self.calls = 0
+        self.input_tokens = 0
+        self.output_tokens = 0
+        self.cost = 0.0
+        self.latency = 0.0
+
+    def add(self, input_tokens: int, output_tokens: int, cost: float, latency: float):
+        self.calls += 1
+        self.input_tokens += input_tokens
+        self.output_tokens += output_tokens
+        self.cost += cost
+        self.latency += latency
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {
+            "calls": self.calls,
+            "input_tokens": self.input_tokens,
+            "output_tokens": self.output_tokens,
+            "cost": self.cost,
+            "latency": round(self.latency, 4),
+        }
+
+
+class RequestCost:
+    """
+    LLM usage of one HTTP request, broken down by model.
+
+    An instance is placed in `current_request_cost_var` by the logging middleware.
+    Tasks spawned while handling the request (e.g. the scenario 5 TaskGroup) copy
+    the context and therefore record into the same object.
+    """
+
+    def __init__(self):
+        self.by_model: Dict[str, ModelUsage] = {}
+
+    def record(self, model: str, input_tokens: int, output_tokens: int, cost: float, latency: float):
+        usage = self.by_model.get(model)
+        if usage is None:
+            usage = self.by_model[model] = ModelUsage()
+        usage.add(input_tokens, output_tokens, cost, latency)
+
+    @property
+    def total_cost(self) -> float:
+        return sum(usage.cost for usage in self.by_model.values())
+
+    @property
+    def total_calls(self) -> int:
+        return sum(usage.calls for usage in self.by_model.values())
+
+    def as_dict(self) -> Dict[str, Dict[str, Any]]:
+        return {model: usage.as_dict() for model, usage in self.by_model.items()}
+
+
+current_request_cost_var: ContextVar[Optional[RequestCost]] = ContextVar("current_request_cost", default=None)
+
+# Process-wide totals. They are only touched from the event loop thread and no
+# update awaits in between, so the aggregation needs no lock.
+_session_usage: Dict[str, ModelUsage] = {}
+
+
+def start_request() -> Token:
+    """Starts cost accounting for the current request context."""
+    return current_request_cost_var.set(RequestCost())
+
+
+def end_request(token: Token) -> Optional[RequestCost]:
+    """Stops cost accounting for the current request and returns what was recorded."""
+    request_cost = current_request_cost_var.get()
+    current_request_cost_var.reset(token)
+    return request_cost
+
+
+def record_usage(model: str, input_tokens: int, output_tokens: int, cost: float, latency: float = 0.0):
+    """Adds one LLM call to the current request (if any) and to the process totals."""
+    request_cost = current_request_cost_var.get()
+    if request_cost is not None:
+        request_cost.record(model, input_tokens, output_tokens, cost, latency)
+
+    usage = _session_usage.get(model)
+    if usage is None:
+        usage = _session_usage[model] = ModelUsage()
+    usage.add(input_tokens, output_tokens, cost, latency)
+
+
+def get_session_usage() -> Dict[str, Any]:
+    """Returns the accumulated usage of all requests served by this process."""
+    by_model = {model: usage.as_dict() for model, usage in list(_session_usage.items())}
+    return {
+        "total_cost": sum(usage["cost"] for usage in by_model.values()),
+        "total_calls": sum(usage["calls"] for usage in by_model.values()),
+        "by_model": by_model,
+    }
@@ -0,0 +1,180 @@
+import asyncio
+import functools
+import time
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Sequence, TypeVar
+
+from app.core.logger import logger
+
+
+@dataclass
+class StepTiming:
+    name: str
+    start: float
+    end: float
+    deps: Sequence[str] = ()
+
+    @property
+    def duration(self) -> float:
+        return self.end - self.start
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {
+            "start_ms": round(self.start * 1000, 1),
+            "end_ms": round(self.end * 1000, 1),
+            "duration_ms": round(self.duration * 1000, 1),
+        }
+
+
+@dataclass
+class _Step:
+    name: str
+    func: Callable[..., Awaitable[Any]]
+    deps: Sequence[str] = field(default_factory=tuple)
+
+
+class StepTimings:
+    """Start/end offsets of the steps of one handler run, its critical path and the log line for both."""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.timings: Dict[str, StepTiming] = {}
+
+    def critical_path(self) -> List[str]:
+        """The chain of steps, ending at the last one to finish, that determined the total time."""
+        if not self.timings:
+            return []
+        current: Optional[StepTiming] = max(self.timings.values(), key=lambda t: t.end)
+        path = []
+        while current is not None:
+            path.append(current.name)
+            deps = [self.timings[d] for d in current.deps if d in self.timings]
+            current = max(deps, key=lambda t: t.end) if deps else None
+        return list(reversed(path))
+
+    def summary(self) -> Dict[str, Any]:
+        return {
+            "steps": {name: timing.as_dict() for name, timing in self.timings.items()},
+            "critical_path": self.critical_path(),
+        }
+
+    def log_timings(self, total: float):
+        steps = ", ".join(
+            f"{name}={timing.duration * 1000:.0f}ms@{timing.start * 1000:.0f}" for name, timing in self.timings.items()
+        )
+        logger.info(
+            f"⏱️ {self.name} finished in {total * 1000:.0f}ms [{steps}] critical path: {' -> '.join(self.critical_path())}"
+        )
+
+
+class TaskGraph(StepTimings):
+    """
+    Runs async steps as soon as the steps they depend on have finished.
+
+    Each step is an async callable that receives the results of its
+    dependencies as keyword arguments named after them. All steps run in one
+    TaskGroup, so the first failure cancels everything still running and is
+    re-raised as-is. Start/end offsets of every step are kept in `timings`
+    and the chain of steps that decided the total time in `critical_path()`.
+
+    Steps that share an AsyncSession must be chained with dependencies, since
+    a session cannot run two queries at once.
+    """
+
+    def __init__(self, name: str):
+        super().__init__(name)
+        self._steps: Dict[str, _Step] = {}
+
+    def add(self, name: str, func: Callable[..., Awaitable[Any]], deps: Sequence[str] = ()) -> "TaskGraph":
+        if name in self._steps:
+            raise ValueError(f"Step {name!r} is already defined.")
+        missing = [dep for dep in deps if dep not in self._steps]
+        if missing:
+            raise ValueError(f"Step {name!r} depends on undefined steps {missing}.")
+        self._steps[name] = _Step(name, func, tuple(deps))
+        return self
+
+    async def run(self) -> Dict[str, Any]:
+        started = time.perf_counter()
+        tasks: Dict[str, asyncio.Task] = {}
+
+        async def run_step(step: _Step):
+            kwargs = {dep: await tasks[dep] for dep in step.deps}
+            step_start = time.perf_counter() - started
+            try:
+                return await step.func(**kwargs)
+            finally:
+                self.timings[step.name] = StepTiming(step.name, step_start, time.perf_counter() - started, step.deps)
+
+        try:
+            async with asyncio.TaskGroup() as tg:
+                # Steps can only depend on earlier ones, so insertion order is a topological order.
+                for step in self._steps.values():
+                    tasks[step.name] = tg.create_task(run_step(step), name=f"{self.name}:{step.name}")
+        except BaseExceptionGroup as group:
+            errors = [e for e in group.exceptions if not isinstance(e, asyncio.CancelledError)]
+            raise (errors[0] if errors else group) from None
+        finally:
+            self.log_timings(time.perf_counter() - started)
+
+        return {name: task.result() for name, task in tasks.items()}
+
+
+class SequentialSteps(StepTimings):
+    """
+    Timings of a handler whose steps run one after another, with branches
+    in between that a TaskGraph cannot express. Each step counts as
+    depending on the one before it, so the summary, critical path and log
+    line have the same shape as a graph's.
+    """
+
+    def __init__(self, name: str):
+        super().__init__(name)
+        self._started = time.perf_counter()
+        self._last: Optional[str] = None
+
+    async def run_step(self, name: str, awaitable: Awaitable[Any]) -> Any:
+        if name in self.timings:
+            name = f"{name}#{len(self.timings) + 1}"
+        step_start = time.perf_counter() - self._started
+        try:
+            return await awaitable
+        finally:
+            deps = (self._last,) if self._last else ()
+            self.timings[name] = StepTiming(name, step_start, time.perf_counter() - self._started, deps)
+            self._last = name
+
+    def finish(self):
+        self.log_timings(time.perf_counter() - self._started)
+
+
+_current_steps: ContextVar[Optional[SequentialSteps]] = ContextVar("current_steps", default=None)
+T = TypeVar("T")
+
+
+def timed_steps(name: str):
+    """Records the `timed_step` calls of the decorated coroutine function as one `SequentialSteps` run and logs it."""
+
+    def decorator(func):
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            steps = SequentialSteps(name)
+            token = _current_steps.set(steps)
+            try:
+                return await func(*args, **kwargs)
+            finally:
+                _current_steps.reset(token)
+                steps.finish()
+
+        return wrapper
+
+    return decorator
+
+
+async def timed_step(name: str, awaitable: Awaitable[T]) -> T:
+    """Awaits `awaitable` as step `name` of the current `timed_steps` handler; outside one it is just awaited."""
+    steps = _current_steps.get()
+    if steps is None:
+        return await awaitable
+    return await steps.run_step(name, awaitable)
@@ -1,8 +1,103 @@
+import asyncio
 import aiohttp
 import json
 from typing import Dict, Any, Optional
+from app.core.config import settings
 from app.core.logger import logger
 
+RETRYABLE_STATUSES = {429, 500, 502, 503, 504}
+
+
+class HttpClientPool:
+    """
+    A process-wide aiohttp session shared by every outgoing HTTP call.
+
+    The session keeps connections alive between requests, caps connections per
+    host, caches DNS lookups and applies connect/total timeouts. It is opened
+    in the app lifespan and closed on shutdown. If it is used from another
+    event loop (e.g. TestClient without a lifespan), a new session is created
+    for that loop.
+    """
+
+    def __init__(self):
+        self._session: Optional[aiohttp.ClientSession] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    def _create_session(self) -> aiohttp.ClientSession:
+        connector = aiohttp.TCPConnector(
+            limit=settings.HTTP_POOL_LIMIT,
+            limit_per_host=settings.HTTP_POOL_LIMIT_PER_HOST,
+            ttl_dns_cache=settings.HTTP_DNS_CACHE_TTL,
+            keepalive_timeout=settings.HTTP_KEEPALIVE_TIMEOUT,
+        )
+        timeout = aiohttp.ClientTimeout(
+            total=settings.HTTP_TOTAL_TIMEOUT,
+            connect=settings.HTTP_CONNECT_TIMEOUT,
+        )
+        return aiohttp.ClientSession(
+            connector=connector,
+            timeout=timeout,
+            headers={"Content-Type": "application/json"},
+        )
+
+    def get_session(self) -> aiohttp.ClientSession:
+        loop = asyncio.get_running_loop()
+        if self._session is None or self._session.closed or self._loop is not loop:
+            self._session = self._create_session()
+            self._loop = loop
+        return self._session
+
+    async def start(self):
+        self.get_session()
+        logger.info("✅ Shared HTTP client pool started.")
+
+    async def close(self):
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+        self._loop = None
+
+    async def post_json(self, url: str, payload: Dict[str, Any]) -> Any:
+        """
+        POSTs `payload` as JSON and returns the decoded JSON response.
+
+        Connection errors, timeouts and 429/5xx responses are retried with
+        exponential backoff up to HTTP_MAX_RETRIES times, as long as the
+        attempts fit in HTTP_RETRY_DEADLINE: each attempt's timeout is cut to
+        the time left, and no retry is made that could not start before it.
+        Other errors, and the last failed attempt, are raised to the caller.
+        """
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + settings.HTTP_RETRY_DEADLINE
+        attempts = settings.HTTP_MAX_RETRIES + 1
+        for attempt in range(attempts):
+            backoff = settings.HTTP_RETRY_BACKOFF * (2 ** attempt)
+            timeout = aiohttp.ClientTimeout(
+                total=min(settings.HTTP_TOTAL_TIMEOUT, deadline - loop.time()),
+                connect=settings.HTTP_CONNECT_TIMEOUT,
+            )
+            try:
+                async with self.get_session().post(url, json=payload, timeout=timeout) as response:
+                    can_retry = attempt < attempts - 1 and deadline - loop.time() > backoff
+                    if response.status in RETRYABLE_STATUSES and can_retry:
+                        logger.warning(f"⏳ {url} returned {response.status}, retrying (attempt {attempt + 1}/{attempts}).")
+                    else:
+                        if response.status >= 400:
+                            error_body = await response.text()
+                            logger.error(f"Server response: {error_body}")
+                        response.raise_for_status()
+                        return await response.json()
+            except (aiohttp.ClientConnectionError, asyncio.TimeoutError) as err:
+                if attempt == attempts - 1 or deadline - loop.time() <= backoff:
+                    raise
+                logger.warning(f"⏳ Request to {url} failed ({err!r}), retrying (attempt {attempt + 1}/{attempts}).")
+
+            await asyncio.sleep(backoff)
+
+
+http_client_pool = HttpClientPool()
+
+
 async def post_async_request(url: str, payload: Dict[str, Any]) -> Optional[Dict[str, Any]]:
     """
     Sends an asynchronous POST request to a specified URL with a JSON payload.
@@ -12,30 +107,22 @@ async def post_async_request(url: str, payload: Dict[str, Any]) -> Optional[Dict
         payload (Dict[str, Any]): The dictionary to be sent as the JSON body.
 
     Returns:
-        Optional[Dict[str, Any]]: The JSON response from the server as a dictionary, 
+        Optional[Dict[str, Any]]: The JSON response from the server as a dictionary,
                                    or None if an error occurs.
     """
     logger.info(f"Sending async POST request to: {url}")
-    headers = {"Content-Type": "application/json"}
-
-    async with aiohttp.ClientSession() as session:
-        try:
-            async with session.post(url, json=payload, headers=headers) as response:
-
-                response.raise_for_status()
-                
-                result = await response.json()
-                logger.info("✅ Async request successful, response received.")
-                return result
-
-        except aiohttp.ClientResponseError as http_err:
-            error_body = await response.text()
-            logger.error(f"❌ HTTP error occurred: {http_err.status} {http_err.message}")
-            logger.error(f"Server response: {error_body}")
-            return None
-        except aiohttp.ClientError as err:
-            logger.error(f"❌ An error occurred during the async request: {err}")
-            return None
-        except json.JSONDecodeError:
-            logger.error("❌ Failed to decode JSON from response.")
-            return None
\ No newline at end of file
+
+    try:
+        result = await http_client_pool.post_json(url, payload)
+        logger.info("✅ Async request successful, response received.")
+        return result
+
+    except aiohttp.ClientResponseError as http_err:
+        logger.error(f"❌ HTTP error occurred: {http_err.status} {http_err.message}")
+        return None
+    except (aiohttp.ClientError, asyncio.TimeoutError) as err:
+        logger.error(f"❌ An error occurred during the async request: {err!r}")
+        return None
+    except json.JSONDecodeError:
+        logger.error("❌ Failed to decode JSON from response.")
+        return None
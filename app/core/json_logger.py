@@ -1,45 +1,262 @@
 import json
-import asyncio
+import atexit
+import itertools
+import queue
+import re
+import threading
+import time
+from datetime import datetime
 from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional
 
+from app.core.config import settings
 
-log_lock = asyncio.Lock()
-LOG_FILE = Path("logs/request_logs.json")
 
-async def log_request_response(log_data: dict):
-    
-    async with log_lock:
+LOG_FILE = Path(settings.REQUEST_LOG_FILE)
+LEGACY_LOG_FILE = Path("logs/request_logs.json")
+
+_TAIL_READ_BYTES = 64 * 1024
+_MAX_BATCH_SIZE = 500
+_STOP = object()
+
+
+def _read_last_id(path: Path) -> int:
+    """
+    Returns the id of the last complete record in a JSONL file, or 0.
+
+    Only the tail of the file is read, so startup cost does not grow with the log size.
+    """
+    if not path.exists() or path.stat().st_size == 0:
+        return 0
+
+    with open(path, "rb") as f:
+        f.seek(0, 2)
+        size = f.tell()
+        f.seek(max(0, size - _TAIL_READ_BYTES))
+        tail = f.read()
+
+    for line in reversed(tail.splitlines()):
         try:
-            logs = []
-            
-            if LOG_FILE.exists() and LOG_FILE.stat().st_size > 0:
-                with open(LOG_FILE, "r", encoding="utf-8") as f:
-                    try:
-                        logs = json.load(f)
-                        
-                        if not isinstance(logs, list):
-                            logs = []
-                    except json.JSONDecodeError:
-                        
-                        logs = []
-
-            
-            if not logs:
-                next_id = 1
-            else:
-                
-                max_id = max(log.get("id", 0) for log in logs)
-                next_id = max_id + 1
-
-            
-            log_data["id"] = next_id
-
-            
-            logs.append(log_data)
-
-            
-            with open(LOG_FILE, "w", encoding="utf-8") as f:
-                json.dump(logs, f, ensure_ascii=False, indent=4)
-
-        except Exception as e:
-            print(f"Error writing to JSON log file: {e}")
\ No newline at end of file
+            record = json.loads(line)
+        except (json.JSONDecodeError, UnicodeDecodeError):
+            # The first line of the tail or a line cut by a crash may be partial.
+            continue
+        if isinstance(record, dict) and isinstance(record.get("id"), int):
+            return record["id"]
+    return 0
+
+
+def _read_legacy_last_id(path: Path) -> int:
+    """Returns the highest id stored in the old JSON array log, or 0."""
+    if not path.exists() or path.stat().st_size == 0:
+        return 0
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            logs = json.load(f)
+    except json.JSONDecodeError:
+        return 0
+    if not isinstance(logs, list):
+        return 0
+    return max((log.get("id", 0) for log in logs if isinstance(log, dict)), default=0)
+
+
+def _rotated_files(path: Path) -> List[Path]:
+    """
+    Rotated siblings of `path` (e.g. request_logs.20250101-120000.jsonl), oldest first.
+
+    Files rotated within the same second get a counter (…-120000-1.jsonl), which
+    plain name order would put before the first one, so names are parsed.
+    """
+    pattern = re.compile(rf"{re.escape(path.stem)}\.(\d{{8}}-\d{{6}})(?:-(\d+))?{re.escape(path.suffix)}")
+
+    def rotation_order(rotated: Path):
+        match = pattern.fullmatch(rotated.name)
+        if match is None:
+            return "", 0, rotated.name
+        return match.group(1), int(match.group(2) or 0), rotated.name
+
+    return sorted(path.parent.glob(f"{path.stem}.*{path.suffix}"), key=rotation_order)
+
+
+class RequestLogWriter:
+    """
+    Append-only JSONL sink for request/response records.
+
+    Ids come from an in-memory monotonic counter that is recovered from the tail
+    of the newest log file at startup. Records are handed to a background thread
+    through a queue and appended in batches, so callers never block on file I/O.
+    The active file is rotated once it exceeds `max_bytes` or `max_age_seconds`.
+    """
+
+    def __init__(
+        self,
+        path: Path,
+        max_bytes: int,
+        max_age_seconds: int,
+        flush_interval: float,
+        legacy_path: Optional[Path] = None,
+    ):
+        self.path = path
+        self.legacy_path = legacy_path
+        self.max_bytes = max_bytes
+        self.max_age_seconds = max_age_seconds
+        self.flush_interval = flush_interval
+
+        self._queue: "queue.SimpleQueue[Any]" = queue.SimpleQueue()
+        self._id_lock = threading.Lock()
+        self._ids: Optional[Iterator[int]] = None
+        self._thread: Optional[threading.Thread] = None
+        self._start_lock = threading.Lock()
+        self._opened_at = time.time()
+
+    def _recover_last_id(self) -> int:
+        last_id = _read_last_id(self.path)
+        if last_id:
+            return last_id
+        for rotated in reversed(_rotated_files(self.path)):
+            last_id = _read_last_id(rotated)
+            if last_id:
+                return last_id
+        return _read_legacy_last_id(self.legacy_path) if self.legacy_path else 0
+
+    def _next_id(self) -> int:
+        with self._id_lock:
+            if self._ids is None:
+                self._ids = itertools.count(self._recover_last_id() + 1)
+            return next(self._ids)
+
+    def _ensure_started(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._start_lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            self._thread = threading.Thread(target=self._run, name="request-log-writer", daemon=True)
+            self._thread.start()
+
+    def log(self, record: Dict[str, Any]) -> int:
+        """Assigns the next id to `record`, queues it for writing and returns the id."""
+        record["id"] = self._next_id()
+        self._ensure_started()
+        self._queue.put(record)
+        return record["id"]
+
+    def close(self, timeout: float = 5.0):
+        """Flushes all queued records and stops the writer thread."""
+        if self._thread is None or not self._thread.is_alive():
+            return
+        self._queue.put(_STOP)
+        self._thread.join(timeout)
+
+    def _should_rotate(self) -> bool:
+        if not self.path.exists():
+            return False
+        if self.max_bytes and self.path.stat().st_size >= self.max_bytes:
+            return True
+        return bool(self.max_age_seconds) and time.time() - self._opened_at >= self.max_age_seconds
+
+    def _rotate(self):
+        suffix = datetime.now().strftime("%Y%m%d-%H%M%S")
+        target = self.path.with_name(f"{self.path.stem}.{suffix}{self.path.suffix}")
+        counter = 1
+        while target.exists():
+            target = self.path.with_name(f"{self.path.stem}.{suffix}-{counter}{self.path.suffix}")
+            counter += 1
+        self.path.rename(target)
+        self._opened_at = time.time()
+
+    def _write_batch(self, batch: List[Dict[str, Any]]):
+        lines = []
+        for record in batch:
+            try:
+                lines.append(json.dumps(record, ensure_ascii=False, default=str))
+            except (TypeError, ValueError) as e:
+                print(f"Error serializing request log record {record.get('id')}: {e}")
+        if not lines:
+            return
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write("\n".join(lines) + "\n")
+        if self._should_rotate():
+            self._rotate()
+
+    def _run(self):
+        stop = False
+        while not stop:
+            batch = []
+            try:
+                item = self._queue.get(timeout=self.flush_interval)
+            except queue.Empty:
+                continue
+            while True:
+                if item is _STOP:
+                    stop = True
+                    break
+                batch.append(item)
+                if len(batch) >= _MAX_BATCH_SIZE:
+                    break
+                try:
+                    item = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+            try:
+                self._write_batch(batch)
+            except Exception as e:
+                print(f"Error writing to JSONL log file: {e}")
+
+
+request_log_writer = RequestLogWriter(
+    path=LOG_FILE,
+    max_bytes=settings.REQUEST_LOG_MAX_BYTES,
+    max_age_seconds=settings.REQUEST_LOG_MAX_AGE_SECONDS,
+    flush_interval=settings.REQUEST_LOG_FLUSH_INTERVAL,
+    legacy_path=LEGACY_LOG_FILE,
+)
+atexit.register(request_log_writer.close)
+
+
+async def log_request_response(log_data: dict):
+    """Queues a request/response record for the background writer. Never blocks on disk."""
+    try:
+        request_log_writer.log(log_data)
+    except Exception as e:
+        print(f"Error queueing request log record: {e}")
+
+
+def read_log_records(path: Optional[Path] = None) -> Iterator[Dict[str, Any]]:
+    """
+    Yields request log records in write order.
+
+    Accepts both the JSONL logs (rotated files first, then the active one) and
+    JSON array files such as `my_tests.json` or the legacy `request_logs.json`.
+    """
+    if path is None:
+        paths = _rotated_files(LOG_FILE) + [LOG_FILE]
+    else:
+        paths = [Path(path)]
+
+    for file_path in paths:
+        if not file_path.exists():
+            continue
+        if file_path.suffix == ".json":
+            with open(file_path, "r", encoding="utf-8") as f:
+                records = json.load(f)
+            yield from (r for r in records if isinstance(r, dict))
+            continue
+        with open(file_path, "r", encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    yield json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+
+
+def export_json_array(destination: Path, source: Optional[Path] = None) -> int:
+    """Writes the request log as a `my_tests.json`-style JSON array and returns the record count."""
+    records = list(read_log_records(source))
+    with open(destination, "w", encoding="utf-8") as f:
+        json.dump(records, f, ensure_ascii=False, indent=4)
+    return len(records)
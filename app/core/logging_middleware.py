@@ -0,0 +1,93 @@
+import json
+from typing import Any, Optional
+
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from app.core import cost_manager
+from app.core.config import settings
+from app.core.json_logger import log_request_response
+
+
+class _BoundedBuffer:
+    """Keeps at most `limit` bytes of a stream and remembers whether anything was dropped."""
+
+    def __init__(self, limit: int):
+        self.limit = limit
+        self.chunks = []
+        self.size = 0
+        self.truncated = False
+
+    def write(self, chunk: bytes):
+        if not chunk or self.truncated:
+            return
+        if self.size + len(chunk) > self.limit:
+            self.truncated = True
+            self.chunks = []
+            return
+        self.chunks.append(chunk)
+        self.size += len(chunk)
+
+    def as_json(self, what: str) -> Optional[Any]:
+        if self.truncated:
+            return {"error": f"{what} body larger than {self.limit} bytes was not logged"}
+        if not self.size:
+            return None
+        try:
+            return json.loads(b"".join(self.chunks))
+        except Exception:
+            return {"error": f"Could not parse {what} body as JSON"}
+
+
+class JSONLoggingMiddleware:
+    """
+    Pure ASGI middleware that logs each HTTP request/response pair to the request log.
+
+    Response messages are forwarded to the client as soon as they are produced.
+    When a handler leaves its response model on `request.state.chat_response`
+    (and its request model on `request.state.chat_request`), those objects are
+    logged directly, so the serialized body is never buffered or parsed again.
+    Other bodies are teed into a buffer capped at REQUEST_LOG_MAX_BODY_BYTES,
+    which keeps the per-request overhead constant regardless of payload size.
+    """
+
+    def __init__(self, app: ASGIApp, max_body_bytes: int = settings.REQUEST_LOG_MAX_BODY_BYTES):
+        self.app = app
+        self.max_body_bytes = max_body_bytes
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        cost_token = cost_manager.start_request()
+        state = scope.setdefault("state", {})
+        request_body = _BoundedBuffer(self.max_body_bytes)
+        response_body = _BoundedBuffer(self.max_body_bytes)
+
+        async def receive_and_tee() -> Message:
+            message = await receive()
+            if message["type"] == "http.request":
+                request_body.write(message.get("body", b""))
+            return message
+
+        async def send_and_tee(message: Message):
+            if message["type"] == "http.response.body" and "chat_response" not in state:
+                response_body.write(message.get("body", b""))
+            await send(message)
+
+        try:
+            await self.app(scope, receive_and_tee, send_and_tee)
+        finally:
+            request_cost = cost_manager.end_request(cost_token)
+            chat_request = state.get("chat_request")
+            chat_response = state.get("chat_response")
+            log_data = {
+                "request": chat_request.model_dump() if chat_request is not None else request_body.as_json("request"),
+                "response": chat_response.model_dump() if chat_response is not None else response_body.as_json("response"),
+                "openai_cost": request_cost.total_cost,
+                "openai_usage": request_cost.as_dict(),
+                "scenario": state.get("scenario"),
+                # DB queries, LLM calls and tokens counted by the request's trace.
+                "trace": state.get("trace_stats"),
+            }
+            await log_request_response(log_data)
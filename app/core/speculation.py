@@ -0,0 +1,246 @@
+import asyncio
+import time
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Collection, Dict, FrozenSet, NamedTuple, Optional
+
+from app.core.config import settings
+from app.core.context import current_speculation
+from app.core.logger import logger
+from app.core.tracing import current_span
+
+# Every started task ends in exactly one of these; "skipped" tasks were never started.
+OUTCOMES = ("hit", "wasted", "cancelled", "error", "skipped")
+ANY_KEY = object()
+
+
+class Keyed(NamedTuple):
+    """A speculative result whose key is only known once the task has run (e.g. the top product candidate)."""
+
+    key: Any
+    value: Any
+
+
+class SpeculationStats:
+    """Process-wide outcome counters per speculative task, and the seconds spent on unused ones."""
+
+    def __init__(self):
+        self._counts: Dict[str, Dict[str, int]] = {}
+        self._wasted_seconds: Dict[str, float] = {}
+        self.in_flight = 0
+
+    def record(self, task: str, outcome: str, seconds: float = 0.0):
+        counts = self._counts.setdefault(task, {name: 0 for name in OUTCOMES})
+        counts[outcome] += 1
+        if outcome != "hit":
+            self._wasted_seconds[task] = self._wasted_seconds.get(task, 0.0) + seconds
+
+    def as_dict(self) -> Dict[str, Dict[str, Any]]:
+        stats = {}
+        for task, counts in sorted(self._counts.items()):
+            started = sum(counts.values()) - counts["skipped"]
+            stats[task] = {
+                **counts,
+                "started": started,
+                "hit_rate": round(counts["hit"] / started, 3) if started else None,
+                "wasted_seconds": round(self._wasted_seconds.get(task, 0.0), 3),
+            }
+        return stats
+
+    def render(self, prefix: str = "speculation") -> str:
+        lines = [
+            f"# HELP {prefix}_tasks_total Speculative prefetches by outcome (hit = its result was used).",
+            f"# TYPE {prefix}_tasks_total counter",
+        ]
+        for task, counts in sorted(self._counts.items()):
+            lines += [f'{prefix}_tasks_total{{task="{task}",outcome="{outcome}"}} {counts[outcome]}' for outcome in OUTCOMES]
+        lines += [
+            f"# HELP {prefix}_wasted_seconds_total Run time of speculative prefetches whose result was not used.",
+            f"# TYPE {prefix}_wasted_seconds_total counter",
+        ]
+        lines += [f'{prefix}_wasted_seconds_total{{task="{task}"}} {seconds:.6f}' for task, seconds in sorted(self._wasted_seconds.items())]
+        return "\n".join(lines) + "\n"
+
+
+stats = SpeculationStats()
+
+
+@dataclass
+class _Speculative:
+    name: str
+    key: Any
+    scenarios: Optional[FrozenSet[str]]
+    task: Optional[asyncio.Task]
+    started: float
+    finished: Optional[float] = None
+    taken: bool = False
+
+
+class Speculation:
+    """
+    Scenario-independent work started for one request before its scenario is
+    known, so it overlaps the classification call.
+
+    `start()` schedules a prefetch (within a per-request task budget, a
+    global cap on prefetches in flight and a per-task timeout). Once the
+    scenario is classified, `settle()` cancels the prefetches no handler of
+    that scenario can use; handlers claim results with `take()`, which waits
+    for a prefetch still running. `close()` cancels whatever is left and
+    records each task's outcome, so the hit rate and the time spent on
+    unused work show up in the metrics. Used as an async context manager it
+    is also the request's `current_speculation`, which the module-level
+    helpers use.
+    """
+
+    def __init__(self, max_tasks: Optional[int] = None, timeout: Optional[float] = None):
+        self.max_tasks = settings.SPECULATION_MAX_TASKS if max_tasks is None else max_tasks
+        self.timeout = settings.SPECULATION_TIMEOUT_SECONDS if timeout is None else timeout
+        self._tasks: Dict[str, _Speculative] = {}
+        self._token = None
+
+    def start(
+        self,
+        name: str,
+        factory: Callable[[], Awaitable[Any]],
+        key: Any = ANY_KEY,
+        scenarios: Optional[Collection[str]] = None,
+    ) -> bool:
+        """
+        Starts `factory()` in the background unless a budget is used up.
+        `key` is what the result was computed for (a `Keyed` result sets it
+        when the task ends); `scenarios` limits the scenarios that may use it.
+        """
+        if name in self._tasks:
+            raise ValueError(f"Speculative task {name!r} is already started.")
+        if len(self._tasks) >= self.max_tasks or stats.in_flight >= settings.SPECULATION_MAX_IN_FLIGHT:
+            stats.record(name, "skipped")
+            return False
+
+        entry = _Speculative(name, key, frozenset(scenarios) if scenarios is not None else None, None, time.perf_counter())
+
+        async def run():
+            return await asyncio.wait_for(factory(), timeout=self.timeout)
+
+        def finished(task: asyncio.Task):
+            # A callback rather than a `finally`, which a task cancelled before its first step never runs.
+            entry.finished = time.perf_counter()
+            stats.in_flight -= 1
+
+        stats.in_flight += 1
+        entry.task = asyncio.create_task(run(), name=f"speculation.{name}")
+        entry.task.add_done_callback(finished)
+        self._tasks[name] = entry
+        return True
+
+    async def _result(self, entry: _Speculative) -> Any:
+        try:
+            return await entry.task
+        except asyncio.CancelledError:
+            if not entry.task.cancelled():
+                raise  # the caller itself was cancelled
+            return None
+        except Exception as e:
+            logger.warning(f"⚠️ Speculative task '{entry.name}' failed: {e}")
+            return None
+
+    async def peek(self, name: str) -> Any:
+        """The result of a prefetch (None if it did not run or failed) without claiming it; for prefetches that build on each other."""
+        entry = self._tasks.get(name)
+        if entry is None:
+            return None
+        result = await self._result(entry)
+        return result.value if isinstance(result, Keyed) else result
+
+    async def take(self, name: str, key: Any = ANY_KEY) -> Any:
+        """
+        Claims the result of a prefetch made for `key`; several consumers may
+        claim the same result. Returns None if it was not started, was
+        cancelled, failed or was made for another key, so the caller does the
+        work itself.
+        """
+        entry = self._tasks.get(name)
+        if entry is None or (key is not ANY_KEY and entry.key is not ANY_KEY and entry.key != key):
+            return None
+        result = await self._result(entry)
+        if isinstance(result, Keyed):
+            if key is not ANY_KEY and result.key != key:
+                return None
+            result = result.value
+        if result is None:
+            return None
+        entry.taken = True
+        return result
+
+    def settle(self, scenario: str):
+        """Cancels the prefetches the classified scenario has no use for."""
+        for entry in self._tasks.values():
+            if entry.scenarios is not None and scenario not in entry.scenarios and not entry.task.done():
+                entry.task.cancel()
+
+    async def close(self) -> Dict[str, str]:
+        """Cancels unclaimed prefetches still running and records every task's outcome; returns them by task."""
+        pending = [entry.task for entry in self._tasks.values() if not entry.taken and not entry.task.done()]
+        for task in pending:
+            task.cancel()
+        if pending:
+            await asyncio.gather(*pending, return_exceptions=True)
+
+        outcomes = {}
+        for entry in self._tasks.values():
+            if entry.taken:
+                outcome = "hit"
+            elif entry.task.cancelled():
+                outcome = "cancelled"
+            elif entry.task.exception() is not None:
+                outcome = "error"
+            else:
+                outcome = "wasted"
+            stats.record(entry.name, outcome, (entry.finished or time.perf_counter()) - entry.started)
+            outcomes[entry.name] = outcome
+        self._tasks.clear()
+
+        span = current_span.get()
+        if span is not None and outcomes:
+            span.root.count("speculation_hits", sum(outcome == "hit" for outcome in outcomes.values()))
+            span.root.count("speculation_unused", sum(outcome != "hit" for outcome in outcomes.values()))
+        if outcomes:
+            logger.info(f"🔮 Speculation: {outcomes}")
+        return outcomes
+
+    async def __aenter__(self) -> "Speculation":
+        self._token = current_speculation.set(self)
+        return self
+
+    async def __aexit__(self, *exc_info):
+        current_speculation.reset(self._token)
+        await self.close()
+
+
+def active() -> bool:
+    return settings.SPECULATION_ENABLED and current_speculation.get() is not None
+
+
+def start(name: str, factory: Callable[[], Awaitable[Any]], key: Any = ANY_KEY, scenarios: Optional[Collection[str]] = None) -> bool:
+    """`Speculation.start` on the current request's speculation; False if there is none or speculation is off."""
+    if not active():
+        return False
+    return current_speculation.get().start(name, factory, key=key, scenarios=scenarios)
+
+
+async def peek(name: str) -> Any:
+    speculation = current_speculation.get()
+    return await speculation.peek(name) if speculation is not None else None
+
+
+async def take(name: str, key: Any = ANY_KEY) -> Any:
+    speculation = current_speculation.get()
+    return await speculation.take(name, key) if speculation is not None else None
+
+
+def settle(scenario: str):
+    speculation = current_speculation.get()
+    if speculation is not None:
+        speculation.settle(scenario)
+
+
+def render_metrics() -> str:
+    return stats.render()
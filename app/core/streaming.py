@@ -0,0 +1,83 @@
+import asyncio
+import json
+from typing import AsyncIterator, Awaitable, Callable, Optional
+
+from app.core.context import token_sink
+from app.core.logger import logger
+
+# Maps each streamed delta to the part of it the user should see.
+StreamFilter = Callable[[str], str]
+
+
+def emit_token(text: str):
+    """Forwards text to the current streaming response, if there is one."""
+    sink = token_sink.get()
+    if sink is not None and text:
+        sink.put_nowait(text)
+
+
+def streaming_enabled() -> bool:
+    return token_sink.get() is not None
+
+
+def after_code_block() -> StreamFilter:
+    """
+    A filter for answers that start with a fenced JSON block followed by prose:
+    nothing is passed on until the block is closed, then everything is.
+    """
+    seen = []
+    fences = 0
+
+    def accept(delta: str) -> str:
+        nonlocal fences
+        if fences >= 2:
+            return delta
+        seen.append(delta)
+        text = "".join(seen)
+        fences = text.count("```")
+        if fences < 2:
+            return ""
+        return text.split("```", 2)[2].lstrip("\n")
+
+    return accept
+
+
+def ndjson(event: dict) -> bytes:
+    return (json.dumps(event, ensure_ascii=False) + "\n").encode("utf-8")
+
+
+async def stream_events(run: Callable[[], Awaitable], timeout: Optional[float] = None) -> AsyncIterator[bytes]:
+    """
+    Runs `run()` with a token sink installed and yields NDJSON events:
+    {"type": "token", "text": ...} for every streamed piece of user-facing
+    text, then one terminal {"type": "final", "response": ...} with the
+    structured result (or {"type": "error", "detail": ...}). The final
+    message is authoritative; tokens are a preview of it.
+    """
+    queue: asyncio.Queue = asyncio.Queue()
+    reset = token_sink.set(queue)
+
+    async def produce():
+        try:
+            return await asyncio.wait_for(run(), timeout=timeout)
+        finally:
+            queue.put_nowait(None)
+
+    # The task copies the current context, so it sees the sink.
+    task = asyncio.create_task(produce())
+    token_sink.reset(reset)
+    try:
+        while (text := await queue.get()) is not None:
+            yield ndjson({"type": "token", "text": text})
+        try:
+            response = await task
+        except Exception as e:
+            logger.error(f"❌ Streaming chat request failed: {e}", exc_info=True)
+            detail = getattr(e, "detail", None) or str(e) or type(e).__name__
+            yield ndjson({"type": "error", "detail": detail})
+            return
+        yield ndjson({"type": "final", "response": response.model_dump() if response is not None else None})
+    finally:
+        # The client went away before the answer was complete.
+        if not task.done():
+            task.cancel()
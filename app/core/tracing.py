@@ -0,0 +1,299 @@
+import functools
+import inspect
+import os
+import queue
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+from app.core.config import settings
+from app.core.json_logger import RequestLogWriter
+
+_STOP = object()
+
+
+class Span:
+    """One timed stage of a request; nested spans share the trace id of the outermost one."""
+
+    __slots__ = ("trace_id", "span_id", "parent_id", "name", "start_ns", "end_ns", "attributes", "error", "root", "counters")
+
+    def __init__(self, name: str, parent: Optional["Span"], attributes: Dict[str, Any]):
+        # Totals of the whole trace (DB queries, LLM calls and tokens) are kept on the root span.
+        self.root: "Span" = parent.root if parent else self
+        self.counters: Dict[str, int] = {}
+        self.trace_id = parent.trace_id if parent else os.urandom(16).hex()
+        self.span_id = os.urandom(8).hex()
+        self.parent_id = parent.span_id if parent else None
+        self.name = name
+        self.start_ns = time.time_ns()
+        self.end_ns: Optional[int] = None
+        self.attributes = {key: value for key, value in attributes.items() if value is not None}
+        self.error: Optional[str] = None
+
+    def set(self, **attributes: Any):
+        self.attributes.update({key: value for key, value in attributes.items() if value is not None})
+
+    def count(self, name: str, amount: int = 1):
+        self.counters[name] = self.counters.get(name, 0) + amount
+
+    def finish(self):
+        self.end_ns = time.time_ns()
+        totals = self.root
+        if self.name.startswith("db."):
+            totals.count("db_queries")
+        elif self.name.startswith("llm."):
+            totals.count("llm_calls")
+            totals.count("prompt_tokens", int(self.attributes.get("input_tokens") or 0))
+            totals.count("completion_tokens", int(self.attributes.get("output_tokens") or 0))
+
+    @property
+    def duration(self) -> float:
+        return ((self.end_ns or time.time_ns()) - self.start_ns) / 1e9
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "name": self.name,
+            "start_ns": self.start_ns,
+            "duration_ms": round(self.duration * 1000, 2),
+            "attributes": self.attributes,
+            "error": self.error,
+        }
+
+
+class LatencyHistograms:
+    """Per-stage latency histograms rendered in the Prometheus text format."""
+
+    def __init__(self, buckets: Sequence[float]):
+        self.buckets = sorted(buckets)
+        self._lock = threading.Lock()
+        # stage -> (bucket counts, sum, count)
+        self._stages: Dict[str, Tuple[List[int], float, int]] = {}
+
+    def observe(self, stage: str, seconds: float):
+        with self._lock:
+            counts, total, count = self._stages.get(stage) or ([0] * len(self.buckets), 0.0, 0)
+            index = bisect_left(self.buckets, seconds)
+            if index < len(counts):
+                counts[index] += 1
+            self._stages[stage] = (counts, total + seconds, count + 1)
+
+    def render(self, metric: str = "chat_stage_duration_seconds") -> str:
+        lines = [
+            f"# HELP {metric} Latency of chat pipeline stages (LLM calls, DB queries, scenario handlers).",
+            f"# TYPE {metric} histogram",
+        ]
+        with self._lock:
+            stages = {stage: (list(counts), total, count) for stage, (counts, total, count) in self._stages.items()}
+        for stage in sorted(stages):
+            counts, total, count = stages[stage]
+            label = stage.replace("\\", "\\\\").replace('"', '\\"')
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                lines.append(f'{metric}_bucket{{stage="{label}",le="{bound:g}"}} {cumulative}')
+            lines.append(f'{metric}_bucket{{stage="{label}",le="+Inf"}} {count}')
+            lines.append(f'{metric}_sum{{stage="{label}"}} {total:.6f}')
+            lines.append(f'{metric}_count{{stage="{label}"}} {count}')
+        return "\n".join(lines) + "\n"
+
+
+def _otlp_value(value: Any) -> Dict[str, Any]:
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+def to_otlp(spans: List[Span], service_name: str) -> Dict[str, Any]:
+    """An OTLP/HTTP JSON ExportTraceServiceRequest for `spans`."""
+    return {
+        "resourceSpans": [{
+            "resource": {"attributes": [{"key": "service.name", "value": {"stringValue": service_name}}]},
+            "scopeSpans": [{
+                "scope": {"name": "app.core.tracing"},
+                "spans": [
+                    {
+                        "traceId": span.trace_id,
+                        "spanId": span.span_id,
+                        **({"parentSpanId": span.parent_id} if span.parent_id else {}),
+                        "name": span.name,
+                        "kind": 1,
+                        "startTimeUnixNano": str(span.start_ns),
+                        "endTimeUnixNano": str(span.end_ns),
+                        "attributes": [{"key": key, "value": _otlp_value(value)} for key, value in span.attributes.items()],
+                        "status": {"code": 2, "message": span.error} if span.error else {"code": 1},
+                    }
+                    for span in spans
+                ],
+            }],
+        }]
+    }
+
+
+class JsonFileSpanExporter:
+    """Appends finished spans as JSON lines, written by a background thread."""
+
+    def __init__(self, path: str):
+        self.writer = RequestLogWriter(
+            path=Path(path),
+            max_bytes=settings.REQUEST_LOG_MAX_BYTES,
+            max_age_seconds=settings.REQUEST_LOG_MAX_AGE_SECONDS,
+            flush_interval=settings.REQUEST_LOG_FLUSH_INTERVAL,
+        )
+
+    def export(self, span: Span):
+        self.writer.log(span.as_dict())
+
+    def close(self):
+        self.writer.close()
+
+
+class OtlpHttpSpanExporter:
+    """Posts batches of finished spans to an OTLP/HTTP collector (JSON encoding) from a background thread."""
+
+    def __init__(self, endpoint: str, service_name: str, flush_interval: float = 1.0, max_batch: int = 512):
+        self.endpoint = endpoint
+        self.service_name = service_name
+        self.flush_interval = flush_interval
+        self.max_batch = max_batch
+        self._queue: "queue.SimpleQueue[Any]" = queue.SimpleQueue()
+        self._thread = threading.Thread(target=self._run, name="otlp-span-exporter", daemon=True)
+        self._thread.start()
+
+    def export(self, span: Span):
+        self._queue.put(span)
+
+    def close(self, timeout: float = 5.0):
+        self._queue.put(_STOP)
+        self._thread.join(timeout)
+
+    def _post(self, batch: List[Span]):
+        import requests
+
+        try:
+            requests.post(self.endpoint, json=to_otlp(batch, self.service_name), timeout=5).raise_for_status()
+        except Exception as e:
+            print(f"Error exporting {len(batch)} spans to {self.endpoint}: {e}")
+
+    def _run(self):
+        stop = False
+        while not stop:
+            try:
+                item = self._queue.get(timeout=self.flush_interval)
+            except queue.Empty:
+                continue
+            batch = []
+            while True:
+                if item is _STOP:
+                    stop = True
+                    break
+                batch.append(item)
+                if len(batch) >= self.max_batch:
+                    break
+                try:
+                    item = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+            if batch:
+                self._post(batch)
+
+
+def create_exporter():
+    if not settings.TRACING_ENABLED or settings.TRACING_EXPORTER == "none":
+        return None
+    if settings.TRACING_EXPORTER == "otlp":
+        return OtlpHttpSpanExporter(settings.TRACING_OTLP_ENDPOINT, settings.TRACING_SERVICE_NAME)
+    return JsonFileSpanExporter(settings.TRACING_JSON_FILE)
+
+
+current_span: ContextVar[Optional[Span]] = ContextVar("current_span", default=None)
+stage_latency = LatencyHistograms(settings.TRACING_HISTOGRAM_BUCKETS)
+exporter = create_exporter()
+
+
+@contextmanager
+def span(name: str, **attributes: Any) -> Iterator[Span]:
+    """
+    Times the enclosed block as a child of the current span. The duration
+    feeds the `name` latency histogram and the finished span is exported.
+    Works in sync and async code, since the parent travels in a ContextVar.
+    """
+    current = Span(name, current_span.get(), attributes)
+    token = current_span.set(current)
+    try:
+        yield current
+    except BaseException as e:
+        current.error = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        current_span.reset(token)
+        current.finish()
+        stage_latency.observe(name, current.duration)
+        if exporter is not None:
+            exporter.export(current)
+
+
+def set_attributes(**attributes: Any):
+    """Adds attributes to the innermost open span, if any."""
+    active = current_span.get()
+    if active is not None:
+        active.set(**attributes)
+
+
+def _result_rows(result: Any) -> Optional[int]:
+    if isinstance(result, (list, tuple, set, dict)):
+        return len(result)
+    return None
+
+
+def traced(name: Optional[str] = None, **attributes: Any) -> Callable:
+    """Decorator running a (sync or async) function inside a span; collections returned set `rows`."""
+
+    def decorate(func: Callable) -> Callable:
+        span_name = name or func.__qualname__
+
+        if inspect.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                with span(span_name, **attributes) as current:
+                    result = await func(*args, **kwargs)
+                    current.set(rows=_result_rows(result))
+                    return result
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(span_name, **attributes) as current:
+                result = func(*args, **kwargs)
+                current.set(rows=_result_rows(result))
+                return result
+        return wrapper
+
+    return decorate
+
+
+def trace_module_functions(namespace: Dict[str, Any], prefix: str):
+    """Wraps every async function defined in a module (given its globals()) in a `<prefix>.<name>` span."""
+    module = namespace["__name__"]
+    for attr, value in list(namespace.items()):
+        if inspect.iscoroutinefunction(value) and value.__module__ == module and not attr.startswith("_"):
+            namespace[attr] = traced(f"{prefix}.{attr}")(value)
+
+
+def render_metrics() -> str:
+    return stage_latency.render()
+
+
+def close():
+    if exporter is not None:
+        exporter.close()
@@ -20,4 +20,31 @@ def parse_llm_response_to_number(response: str) -> str:
         else:
             return str(float_val)
     except ValueError:
-        return cleaned_response 
\ No newline at end of file
+        return cleaned_response 
+
+
+_PERSIAN_CHAR_MAP = str.maketrans({
+    "ي": "ی", "ى": "ی", "ئ": "ی",
+    "ك": "ک",
+    "ة": "ه", "ۀ": "ه",
+    "أ": "ا", "إ": "ا", "ٱ": "ا",
+    "ؤ": "و",
+    **{chr(0x06F0 + i): str(i) for i in range(10)},  # Persian digits
+    **{chr(0x0660 + i): str(i) for i in range(10)},  # Arabic-Indic digits
+    "٫": ".", "٬": ",", "،": ",", "؛": ";", "؟": "?",
+    "\u200c": " ", "\u200d": "", "\u200e": "", "\u200f": "", "\u0640": "",  # ZWNJ, ZWJ, LRM, RLM, tatweel
+})
+_DIACRITICS_RE = re.compile("[\u064b-\u065f\u0670]")
+_WHITESPACE_RE = re.compile(r"\s+")
+
+
+def normalize_persian_text(text: str) -> str:
+    """
+    Canonical form of a Persian message for cache keys and exact matching:
+    Arabic letter variants map to their Persian forms, Persian/Arabic digits
+    become ASCII, diacritics and tatweel are removed, ZWNJ becomes a space,
+    Latin text is lower-cased and whitespace is collapsed. Trailing punctuation is dropped.
+    """
+    text = _DIACRITICS_RE.sub("", text.translate(_PERSIAN_CHAR_MAP))
+    text = _WHITESPACE_RE.sub(" ", text).strip().lower()
+    return text.rstrip(" ?!.,;")
@@ -6,7 +6,8 @@ from sqlalchemy import (
     Boolean,
     DateTime,
     ForeignKey,
-    Index
+    Index,
+    Computed
 )
 from sqlalchemy.dialects.postgresql import JSONB, TSVECTOR 
 from sqlalchemy.orm import declarative_base, relationship
@@ -75,7 +76,11 @@ class BaseProduct(Base):
     extra_features = Column(JSONB)
     members = Column(JSONB)
 
-    persian_name_tsv = Column(TSVECTOR)
+    # Maintained by Postgres from persian_name; never written by the app or the loader.
+    persian_name_tsv = Column(
+        TSVECTOR,
+        Computed("to_tsvector('simple', coalesce(persian_name, ''))", persisted=True)
+    )
 
     __table_args__ = (
         Index(
@@ -83,6 +88,13 @@ class BaseProduct(Base):
             persian_name_tsv,
             postgresql_using='gin'
         ),
+        # Serves similarity(), the % operator and ILIKE '%...%' on persian_name (needs pg_trgm).
+        Index(
+            'ix_base_products_persian_name_trgm',
+            persian_name,
+            postgresql_using='gin',
+            postgresql_ops={'persian_name': 'gin_trgm_ops'}
+        ),
     )
 
 
@@ -98,6 +110,23 @@ class Member(Base):
     price = Column(BigInteger)
     base_random_key = Column(String, ForeignKey("base_products.random_key"), index=True)
 
+class ProductSeller(Base):
+    """
+    Read-only model for the 'product_sellers' materialized view.
+    One row per member (listing) with its shop and city details already joined,
+    built and refreshed by scripts/data_loader.py.
+    """
+    __tablename__ = "product_sellers"
+    __table_args__ = {"info": {"is_view": True}}
+
+    member_key = Column(String, primary_key=True)
+    base_random_key = Column(String)
+    price = Column(BigInteger)
+    shop_id = Column(BigInteger)
+    shop_score = Column(Float)
+    has_warranty = Column(Boolean)
+    city = Column(String)
+
 class Shop(Base):
     """
     Model for the 'shops' table.
@@ -7,7 +7,62 @@ from sqlalchemy.dialects.postgresql import JSONB
 from sqlalchemy.orm import joinedload
 from sqlalchemy.dialects.postgresql import to_tsquery
 from sqlalchemy.types import Float
+from app.core.cache import TTLCache
+from app.core.config import settings
+from app.core.tracing import trace_module_functions
+
+
+# In-process catalog caches. Cached ORM objects are expunged from their session,
+# so they only carry already-loaded attributes and can be shared across requests.
+product_cache = TTLCache("products", settings.CATALOG_CACHE_MAX_PRODUCTS, settings.CATALOG_CACHE_TTL_SECONDS)
+member_cache = TTLCache("members", settings.CATALOG_CACHE_MAX_MEMBERS, settings.CATALOG_CACHE_TTL_SECONDS)
+shop_cache = TTLCache("shops", settings.CATALOG_CACHE_MAX_SHOPS, settings.CATALOG_CACHE_TTL_SECONDS)
+# Keyed by base product random_key; holds the rows of the product_sellers view.
+seller_context_cache = TTLCache("seller_contexts", settings.CATALOG_CACHE_MAX_PRODUCTS, settings.CATALOG_CACHE_TTL_SECONDS)
+
+# Caches keyed by the table's primary key, so single rows can be invalidated.
+_KEYED_CACHES = {
+    "base_products": product_cache,
+    "members": member_cache,
+    "shops": shop_cache,
+    "product_sellers": seller_context_cache,
+}
+# Caches built from a table under a different key; cleared whenever that table changes.
+_DERIVED_CACHES = {
+    "members": [seller_context_cache],
+    "shops": [seller_context_cache],
+    "cities": [shop_cache, seller_context_cache],
+}
+
+
+def invalidate_catalog_cache(tables: Optional[List[str]] = None, keys: Optional[Dict[str, List[Any]]] = None):
+    """
+    Drops cached catalog entries after the data changed.
 
+    Args:
+        tables: Table names whose caches are cleared completely. `None` together
+                with no `keys` clears every catalog cache.
+        keys: Table name -> primary keys to drop, for precise invalidation.
+              Seller contexts are keyed by base product under "product_sellers";
+              when those keys are sent, member/shop keys do not clear them all.
+    """
+    if tables is None and not keys:
+        tables = list(_KEYED_CACHES) + list(_DERIVED_CACHES)
+    for table in tables or []:
+        if table in _KEYED_CACHES:
+            _KEYED_CACHES[table].clear()
+        for cache in _DERIVED_CACHES.get(table, []):
+            cache.clear()
+    # A derived cache whose own keys were sent is invalidated precisely instead of cleared.
+    precise = {id(_KEYED_CACHES[table]) for table, table_keys in (keys or {}).items() if table_keys and table in _KEYED_CACHES}
+    for table, table_keys in (keys or {}).items():
+        if not table_keys:
+            continue
+        if table in _KEYED_CACHES:
+            _KEYED_CACHES[table].invalidate_many(table_keys)
+        for cache in _DERIVED_CACHES.get(table, []):
+            if id(cache) not in precise:
+                cache.clear()
 
 
 async def get_all_sellers_info(db: AsyncSession) -> List[models.Member]:
@@ -24,6 +79,21 @@ async def get_all_categories(db: AsyncSession) -> List[models.Category]:
     titles = result.scalars().all()
     return "\n".join(titles)
 
+async def get_category_rows(db: AsyncSession) -> List[Any]:
+    """
+    Fetches (id, title, parent_id, features_example) for every category.
+    Used to build the in-memory category index.
+    """
+    result = await db.execute(
+        select(
+            models.Category.id,
+            models.Category.title,
+            models.Category.parent_id,
+            models.Category.features_example,
+        )
+    )
+    return [tuple(row) for row in result.all()]
+
 async def get_category_features_example(db: AsyncSession, category_title: str) -> Optional[dict]:
     """
     Fetches the features_example JSON for a given category title.
@@ -272,29 +342,52 @@ async def find_similar_products(db: AsyncSession, product_name: str) -> List[Dic
         'product_name' (persian_name) of a matching product, or an empty
         list if no matches are found.
     """
+    products_found = await find_similar_products_with_scores(db, product_name)
+    return [{'id': row['id'], 'product_name': row['product_name']} for row in products_found]
+
+
+async def find_similar_products_with_scores(db: AsyncSession, product_name: str, limit: int = 10) -> List[Dict[str, Any]]:
+    """
+    Same search as `find_similar_products`, but each result also carries its
+    trigram similarity as 'score' and the number of results is configurable.
+    """
     similarity_score = func.similarity(models.BaseProduct.persian_name, product_name)
 
     query = (
         select(
             models.BaseProduct.random_key,
-            models.BaseProduct.persian_name
+            models.BaseProduct.persian_name,
+            similarity_score.label("score")
         )
         .where(
             models.BaseProduct.persian_name.op("%")(product_name),
             similarity_score > 0.1
         )
         .order_by(similarity_score.desc())
-        .limit(10)
+        .limit(limit)
     )
 
     result = await db.execute(query)
-    
-    products_found = [
-        {'id': row.random_key, 'product_name': row.persian_name}
+
+    return [
+        {'id': row.random_key, 'product_name': row.persian_name, 'score': float(row.score)}
         for row in result.all()
     ]
-    
-    return products_found
+
+
+async def get_name_similarities(db: AsyncSession, product_name: str, random_keys: List[str]) -> Dict[str, float]:
+    """Returns the trigram similarity of `product_name` to each of the given products."""
+    if not random_keys:
+        return {}
+    query = (
+        select(
+            models.BaseProduct.random_key,
+            func.similarity(models.BaseProduct.persian_name, product_name).label("score")
+        )
+        .where(models.BaseProduct.random_key.in_(random_keys))
+    )
+    result = await db.execute(query)
+    return {row.random_key: float(row.score) for row in result.all()}
 
 async def search_products_by_keywords(
     db: AsyncSession, 
@@ -397,6 +490,10 @@ async def get_product_by_name_like(db: AsyncSession, product_name: str) -> Optio
 
 async def get_product_by_random_key(db: AsyncSession, random_key: str) -> Optional[models.BaseProduct]:
     
+    cached = product_cache.get(random_key)
+    if cached is not None:
+        return cached
+
     query = select(models.BaseProduct).where(
         models.BaseProduct.random_key == random_key
     )
@@ -405,6 +502,9 @@ async def get_product_by_random_key(db: AsyncSession, random_key: str) -> Option
     
     product = result.scalar_one_or_none()
     
+    if product is not None:
+        db.expunge(product)
+        product_cache.set(random_key, product)
     return product
 
 
@@ -436,9 +536,16 @@ async def get_members_by_keys(db: AsyncSession, member_keys: list[str]):
     if not member_keys:
         return []
     
-    query = select(models.Member).where(models.Member.random_key.in_(member_keys))
-    result = await db.execute(query)
-    return result.scalars().all()
+    cached, missing_keys = member_cache.get_many(member_keys)
+    members = list(cached.values())
+    if missing_keys:
+        query = select(models.Member).where(models.Member.random_key.in_(missing_keys))
+        result = await db.execute(query)
+        for member in result.scalars().all():
+            db.expunge(member)
+            member_cache.set(member.random_key, member)
+            members.append(member)
+    return members
 
 # This function is also still needed
 async def get_shops_with_details_by_ids(db: AsyncSession, shop_ids: list[int]):
@@ -448,13 +555,53 @@ async def get_shops_with_details_by_ids(db: AsyncSession, shop_ids: list[int]):
     if not shop_ids:
         return []
         
-    query = (
-        select(models.Shop)
-        .where(models.Shop.id.in_(shop_ids))
-        .options(joinedload(models.Shop.city))
-    )
-    result = await db.execute(query)
-    return result.scalars().all()
+    cached, missing_ids = shop_cache.get_many(shop_ids)
+    shops = list(cached.values())
+    if missing_ids:
+        query = (
+            select(models.Shop)
+            .where(models.Shop.id.in_(missing_ids))
+            .options(joinedload(models.Shop.city))
+        )
+        result = await db.execute(query)
+        for shop in result.scalars().all():
+            db.expunge(shop)
+            shop_cache.set(shop.id, shop)
+            shops.append(shop)
+    return shops
+
+async def get_sellers_context(db: AsyncSession, base_random_key: str) -> List[Dict[str, Any]]:
+    """
+    Returns price, city, shop score and warranty of every seller of a product.
+
+    Reads the precomputed 'product_sellers' materialized view, so the whole
+    context is a single indexed lookup on base_random_key.
+    """
+    cached = seller_context_cache.get(base_random_key)
+    if cached is not None:
+        return cached
+
+    stmt = select(
+        models.ProductSeller.price,
+        models.ProductSeller.city,
+        models.ProductSeller.shop_score,
+        models.ProductSeller.has_warranty,
+    ).where(models.ProductSeller.base_random_key == base_random_key)
+
+    result = await db.execute(stmt)
+    sellers_context = [
+        {
+            "price": row.price,
+            "city": row.city,
+            "shop_score": row.shop_score,
+            "has_warranty": row.has_warranty
+        }
+        for row in result.all()
+    ]
+
+    if sellers_context:
+        seller_context_cache.set(base_random_key, sellers_context)
+    return sellers_context
 
 async def get_members_with_details_by_base_random_key(db: AsyncSession, base_random_key: str):
     stmt = (
@@ -530,4 +677,8 @@ async def get_product_with_sellers_by_base_random_key(db: AsyncSession, base_ran
             "has_warranty": row.has_warranty
         })
         
-    return final_response
\ No newline at end of file
+    return final_response
+
+
+# Every public query above runs in a "db.<function>" span (with the row count when it returns a collection).
+trace_module_functions(globals(), "db")
@@ -1,16 +1,85 @@
+from sqlalchemy import event
 from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
 from sqlalchemy.orm import sessionmaker
 from app.core.config import settings
 
-engine = create_async_engine(settings.DATABASE_URL, echo=True, future=True)
+
+def _connect_args() -> dict:
+    """Driver arguments; asyncpg keeps a per-connection prepared statement cache."""
+    if settings.DATABASE_URL.startswith("postgresql+asyncpg"):
+        return {"prepared_statement_cache_size": settings.DB_STATEMENT_CACHE_SIZE}
+    return {}
+
+
+engine = create_async_engine(
+    settings.DATABASE_URL,
+    echo=settings.DB_ECHO,
+    future=True,
+    pool_size=settings.DB_POOL_SIZE,
+    max_overflow=settings.DB_MAX_OVERFLOW,
+    pool_timeout=settings.DB_POOL_TIMEOUT,
+    pool_recycle=settings.DB_POOL_RECYCLE,
+    pool_pre_ping=settings.DB_POOL_PRE_PING,
+    connect_args=_connect_args(),
+)
 
 AsyncSessionLocal = sessionmaker(
-    autocommit=False, 
-    autoflush=False, 
-    bind=engine, 
+    autocommit=False,
+    autoflush=False,
+    bind=engine,
     class_=AsyncSession
 )
 
+
+class PoolStats:
+    """Counters fed by pool events, used to size the pool against real concurrency."""
+
+    def __init__(self):
+        self.connections_opened = 0
+        self.checkouts = 0
+        self.checked_out = 0
+        self.peak_checked_out = 0
+
+    def on_connect(self, dbapi_connection, connection_record):
+        self.connections_opened += 1
+
+    def on_checkout(self, dbapi_connection, connection_record, connection_proxy):
+        self.checkouts += 1
+        self.checked_out += 1
+        self.peak_checked_out = max(self.peak_checked_out, self.checked_out)
+
+    def on_checkin(self, dbapi_connection, connection_record):
+        self.checked_out = max(0, self.checked_out - 1)
+
+
+pool_stats = PoolStats()
+event.listen(engine.sync_engine.pool, "connect", pool_stats.on_connect)
+event.listen(engine.sync_engine.pool, "checkout", pool_stats.on_checkout)
+event.listen(engine.sync_engine.pool, "checkin", pool_stats.on_checkin)
+
+
+def get_pool_stats() -> dict:
+    """
+    Returns the current pool state. `saturation` is the share of the maximum
+    number of connections (pool_size + max_overflow) that is checked out now;
+    `peak_saturation` is the same for the highest value seen since startup.
+    """
+    pool = engine.sync_engine.pool
+    capacity = settings.DB_POOL_SIZE + settings.DB_MAX_OVERFLOW
+    return {
+        "pool_size": settings.DB_POOL_SIZE,
+        "max_overflow": settings.DB_MAX_OVERFLOW,
+        "idle": pool.checkedin(),
+        "checked_out": pool.checkedout(),
+        "overflow": pool.overflow(),
+        "peak_checked_out": pool_stats.peak_checked_out,
+        "total_checkouts": pool_stats.checkouts,
+        "connections_opened": pool_stats.connections_opened,
+        "saturation": round(pool.checkedout() / capacity, 3) if capacity else None,
+        "peak_saturation": round(pool_stats.peak_checked_out / capacity, 3) if capacity else None,
+    }
+
+
 async def get_db() -> AsyncSession:
     async with AsyncSessionLocal() as session:
         yield session
\ No newline at end of file
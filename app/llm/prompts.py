@@ -586,76 +586,46 @@ Analyze the user's question and the data to provide a direct numerical answer.
 - If the answer is a calculation that can have decimals (e.g., average price, score), the result MUST be a float.
 - Your final output MUST ONLY BE the number itself. Do not add any extra text, units, or explanations.
 """,
-    "calculate_prompt": """### ROLE & OBJECTIVE ###
-You are an expert Data Analyst and Python Coder. Your task is to analyze the user's question and the provided JSON data. Based on the question, you MUST write a single Python function called `calculate` that takes the data as input and returns the correct numerical answer.
+    "aggregation_spec_prompt": """### ROLE & OBJECTIVE ###
+You translate a user's question about the sellers of one product into an aggregation spec. The spec is executed over the seller list, where every seller has "price" (int), "city" (str), "shop_score" (float) and "has_warranty" (bool).
 
 ### RULES ###
-1.  Your output MUST be ONLY the Python code block for the `calculate(data)` function.
-2.  Do NOT write any explanations or text before or after the code.
-3.  Do NOT call the function yourself.
-4.  Analyze the user's question to understand the required calculation (e.g., average, count, min, max, etc.).
-5.  The `data` parameter of your function will be a list of dictionaries, as shown in the "Available Data" section.
-6.  **The function's return type MUST match the user's question.**
-    - If the question implies a count or a specific price (which are integers), return an `int`.
-    - If the question is about an average or a score, return a `float`.
-    - **All float results MUST be rounded to a maximum of 2 decimal places.**
-
-### DATA STRUCTURE ###
-The data is a list of sellers, where each seller is a dictionary with the following keys: "price", "city", "shop_score", "has_warranty".
+1.  Your output MUST be ONLY one JSON object in the format below. No explanations.
+2.  Pick the metric that answers the question: cheapest price -> "min", most expensive -> "max", average -> "avg", number of sellers/shops -> "count".
 
-### EXAMPLES ###
+### SPEC FORMAT ###
+```json
+{{
+  "filters": {{
+    "city": "string or null",
+    "has_warranty": "true, false or null",
+    "min_shop_score": "number or null",
+    "max_shop_score": "number or null",
+    "min_price": "number or null",
+    "max_price": "number or null"
+  }},
+  "metric": "count | min | max | avg | median | sum",
+  "field": "price | shop_score"
+}}
+```
+- All filters are combined with AND. Leave a filter null when the question does not mention it.
+- "count" counts the matching sellers and ignores "field".
+- Write prices as plain numbers (convert words like "میلیون" to digits).
+- Write city names in Persian exactly as the user wrote them.
 
+### EXAMPLES ###
 **User Question:** "متوسط قیمت این محصول چقدر است؟"
-**Your Output (Python Code):**
-```python
-def calculate(data):
-    prices = [item['price'] for item in data]
-    if not prices:
-        return 0.0
-    average_price = sum(prices) / len(prices)
-    return round(average_price, 2)
-User Question: "چند فروشنده در تهران برای این محصول وجود دارد؟"
-Your Output (Python Code):
-
-Python
-
-def calculate(data):
-    count = 0
-    for item in data:
-        if item['city'] == 'تهران':
-            count += 1
-    return count
-    
-User Question: "چند عضو در تهران برای این محصول وجود دارد؟"
-Your Output (Python Code):
-
-Python
-
-def calculate(data):
-    count = 0
-    for item in data:
-        if item['city'] == 'تهران':
-            count += 1
-    return count
-    
-User Question: "ارزان‌ترین قیمت چنده؟"
-Your Output (Python Code):
-
-Python
+{{"filters": {{}}, "metric": "avg", "field": "price"}}
 
-def calculate(data):
-    prices = [item['price'] for item in data]
-    if not prices:
-        return 0
-    return min(prices)
-YOUR TASK
-Now, based on the following user question and data, generate the Python code.
+**User Question:** "چند فروشنده در تهران برای این محصول وجود دارد؟"
+{{"filters": {{"city": "تهران"}}, "metric": "count", "field": "price"}}
 
-User Question: "{user_message}"
+**User Question:** "ارزان‌ترین قیمت با گارانتی چنده؟"
+{{"filters": {{"has_warranty": true}}, "metric": "min", "field": "price"}}
 
-Available Data (List of sellers):
-{context_str}
-"""
+### YOUR TASK ###
+**User Question:** "{user_query}"
+""",
 }
 
 
@@ -752,52 +722,46 @@ You are a highly intelligent AI shopping assistant. Your goal is to compare two
 
 Now, generate the response in the specified format.
 """,
-    "calculate_prompt": """### ROLE & OBJECTIVE ###
-You are an expert Data Analyst and Python Coder. Your task is to analyze the user's question and write a single Python function called `calculate` that computes the metric the user is asking about. You only have access to the user's question and the data structure.
+    "aggregation_spec_prompt": """### ROLE & OBJECTIVE ###
+You translate a user's question that compares two products into an aggregation spec. The same spec is executed over the seller list of each product, where every seller has "price" (int), "city" (str), "shop_score" (float) and "has_warranty" (bool).
 
 ### RULES ###
-1.  Your output MUST be ONLY the Python code block for the `calculate(data)` function.
-2.  Do NOT write any explanations or text before or after the code.
-3.  The `calculate` function takes a list of seller dictionaries (`data`) and MUST return a **descriptive string** containing the result.
-4.  **IMPORTANT**: If the user's question is about product features (e.g., "which is heavier?", "which one is more beautiful?") and has NO RELATION to seller data (price, city, count, etc.), you MUST generate a function that simply returns `None`.
+1.  Your output MUST be ONLY one JSON object in the format below. No explanations.
+2.  "label" is a short Persian description of the computed value, e.g. "ارزان‌ترین قیمت در اهواز".
+3.  **IMPORTANT**: If the question is about product features (e.g., "which is heavier?") and has NO RELATION to seller data (price, city, count, warranty, score), use "metric": "none".
 
-### DATA STRUCTURE ###
-The function will receive data with this structure: `[{{"price": int, "city": str, "shop_score": float, "has_warranty": bool}}, ...]`.
+### SPEC FORMAT ###
+```json
+{{
+  "filters": {{
+    "city": "string or null",
+    "has_warranty": "true, false or null",
+    "min_shop_score": "number or null",
+    "max_shop_score": "number or null",
+    "min_price": "number or null",
+    "max_price": "number or null"
+  }},
+  "metric": "count | min | max | avg | median | sum | none",
+  "field": "price | shop_score",
+  "label": "string"
+}}
+```
+- All filters are combined with AND. Leave a filter null when the question does not mention it.
+- "count" counts the matching sellers and ignores "field".
+- Write prices as plain numbers (convert words like "میلیون" to digits).
+- Write city names in Persian exactly as the user wrote them.
 
 ### EXAMPLES ###
-
 **User Question:** "کدامیک از این دو در فروشگاه‌های بیشتری موجود است؟"
-**Your Output (Python Code):**
-```python
-def calculate(data):
-    count = len(data)
-    return f"تعداد فروشندگان: {{count}}"
-````
+{{"filters": {{}}, "metric": "count", "field": "price", "label": "تعداد فروشندگان"}}
 
 **User Question:** "کدام محصول سنگین تر است؟"
-**Your Output (Python Code):**
-
-```python
-def calculate(data):
-    return None
-```
+{{"filters": {{}}, "metric": "none", "field": "price", "label": ""}}
 
 **User Question:** "کدام محصول فروشنده با قیمت کمتری در اهواز دارد؟"
-**Your Output (Python Code):**
-
-```python
-def calculate(data):
-    ahvaz_prices = [item['price'] for item in data if item['city'] == 'اهواز']
-    if not ahvaz_prices:
-        return "فروشنده‌ای در اهواز ندارد"
-    min_price = min(ahvaz_prices)
-    return f"ارزان‌ترین قیمت در اهواز: {{min_price}}"
-```
-
-### YOUR TASK
-
-Now, based on the following user question, generate the Python code.
+{{"filters": {{"city": "اهواز"}}, "metric": "min", "field": "price", "label": "ارزان‌ترین قیمت در اهواز"}}
 
+### YOUR TASK ###
 **User Question:** "{user_query}"
 """,
     "find_random_keys":"""You are an intelligent text-processing assistant. Your task is to analyze a user's query that compares two products and extract their unique identifiers (IDs).
@@ -1059,17 +1023,19 @@ You have identified the product the user wants. Now, you need to present the lis
 
 # CONTEXT
 - **Product Name:** `{product_name}`
-- **Sellers List (JSON):** `{sellers_list}`
+- **Sellers Table (JSON):** `{sellers_list}`
+
+The sellers table has a `columns` list naming the fields (member_key, price, city, shop_score, has_warranty) and a `rows` list with one row per seller, its values in the order of `columns`. If `total_sellers` is present, only the best sellers are listed out of that many.
 
 # INSTRUCTIONS
 1.  Start with a confirmation message like: "بسیار عالی! برای محصول «{product_name}» این فروشندگان در دسترس هستند:"
-2.  List each seller with key information: Price, City, and Shop Score.
+2.  List each row (seller) with key information: Price, City, Shop Score and Warranty.
 3.  After listing the sellers, ask the user to make a choice. For example: "کدام یک از این فروشندگان را انتخاب می‌کنید؟"
 
 # EXAMPLE OUTPUT
 بسیار عالی! برای محصول «میز بیلیارد مدل g173» این فروشندگان در دسترس هستند:
-- فروشنده shop_id 1313: قیمت ۱۳,۷۱۴,۰۰۰ تومان، شهر: تهران، امتیاز: ۵.۰
-- فروشنده shop_id 1314: قیمت ۱۳,۷۱۴,۱۰۰ تومان، شهر: تهران، امتیاز: ۵.۰
+- فروشنده ۱: قیمت ۱۳,۷۱۴,۰۰۰ تومان، شهر: تهران، امتیاز: ۵.۰، گارانتی: دارد
+- فروشنده ۲: قیمت ۱۳,۷۱۴,۱۰۰ تومان، شهر: تهران، امتیاز: ۵.۰، گارانتی: ندارد
 - و...
 
 کدام یک از این فروشندگان را برای شما انتخاب کنم؟
@@ -1083,9 +1049,9 @@ Analyze the user's response and the provided list of seller options. Your goal i
 
 # INSTRUCTIONS
 - Read the user's response to understand their choice. They might refer to the seller by price, city, score, or their order in the list.
-- Compare the user's choice against the `seller_options` list.
-- Find the seller that uniquely matches the user's description.
-- Extract the `member_key` of that specific seller.
+- Compare the user's choice against the `seller_options` table: `columns` names the fields and each entry of `rows` is one seller, its values in the order of `columns`.
+- Find the row (seller) that uniquely matches the user's description.
+- Extract the `member_key` value of that row.
 - If the choice is ambiguous or no seller matches, the value must be `null`.
 
 # CONTEXT
@@ -1094,7 +1060,7 @@ Analyze the user's response and the provided list of seller options. Your goal i
 
 # EXAMPLE
 - **User Response:** "همون که ارزون‌تره و توی تهرانه رو می‌خوام."
-- **Seller Options:** `[{{"member_key": "seller-abc-123", "price": 2100000, "city": "تهران"}}, {{"member_key": "seller-def-456", "price": 2200000, "city": "تهران"}}]`
+- **Seller Options:** `{{"columns":["member_key","price","city","shop_score","has_warranty"],"rows":[["seller-abc-123",2100000,"تهران",4.5,true],["seller-def-456",2200000,"تهران",4.0,false]]}}`
 - **Correct Output:**
     ```json
     {{
@@ -1117,11 +1083,11 @@ You will be given a list of potential sellers and a set of desired criteria that
 
 # INPUT
 
-You will receive a JSON object containing two keys:
+You will receive a JSON object containing these keys:
 
-- `criteria`: An object specifying the desired attributes (e.g., `{{"city": "تهران", "price": "cheapest"}}`).
+- `user_response` and `chat_history`: what the user asked for; take the desired attributes (the criteria, e.g. city, warranty, "cheapest") from them.
 
-- `seller_options`: A list of available seller objects.
+- `product_options`: A list of candidate products. Each has `product_name`, `base_product_key`, `product_features`, `seller_count`, `min_price` and a `sellers` table: `columns` names the fields (`member_key`, `price`, `city`, `shop_score`, `has_warranty`) and each entry of `rows` is one seller, its values in the order of `columns`. The seller options are the rows of all these tables.
 
 
 
@@ -1131,7 +1097,7 @@ Execute the following steps in order:
 
 
 
-1.  **Filter:** Create a sub-list of sellers from `seller_options` that strictly match all explicit criteria provided in the `criteria` object (e.g., if `city` is specified, only include sellers from that city).
+1.  **Filter:** Create a sub-list of seller rows that strictly match all explicit criteria the user gave (e.g., if a city is specified, only include sellers from that city).
 
     - If the `price` criterion is "cheapest", do not filter by it yet; it will be used in the tie-breaking step.
 
@@ -1147,7 +1113,7 @@ Execute the following steps in order:
 
         - **Rule 2 (Warranty):** If prices are identical, select the seller where `has_warranty` is `true`.
 
-        - **Rule 3 (Position):** If there is still a tie, select the seller that appears first in the original `seller_options` list.
+        - **Rule 3 (Position):** If there is still a tie, select the seller that appears first in `product_options` (products in order, rows in order).
 
     - **If the filtered list is EMPTY:** There is no match.
 
@@ -1171,23 +1137,43 @@ Your output MUST be a single JSON object with one key, `selected_member_key`.
 
 {{
 
-  "criteria": {{
+  "user_response": "ارزون‌ترین فروشنده تو تهران",
 
-    "city": "تهران",
+  "product_options": [
 
-    "price": "cheapest"
+    {{
 
-  }},
+      "product_name": "میز تحریر مدل A1",
+
+      "base_product_key": "prod-1",
+
+      "product_features": {{}},
+
+      "seller_count": 3,
 
-  "seller_options": [
+      "min_price": 2000000,
 
-    {{ "member_key": "seller-xyz-789", "city": "اصفهان", "price": 2000000, "has_warranty": true }},
+      "sellers": {{
 
-    {{ "member_key": "seller-abc-123", "city": "تهران", "price": 2100000, "has_warranty": true }},
+        "columns": ["member_key", "price", "city", "shop_score", "has_warranty"],
 
-    {{ "member_key": "seller-def-456", "city": "تهران", "price": 2100000, "has_warranty": false }}
+        "rows": [
 
-  ]
+          ["seller-xyz-789", 2000000, "اصفهان", 4.0, true],
+
+          ["seller-abc-123", 2100000, "تهران", 4.5, true],
+
+          ["seller-def-456", 2100000, "تهران", 5.0, false]
+
+        ]
+
+      }}
+
+    }}
+
+  ],
+
+  "chat_history": "..."
 
 }}
 
@@ -1459,4 +1445,20 @@ Your Output: name
 
 NEW_SCENARIO_4_PROMPTS={
     "main_prompt": """"""
-}
\ No newline at end of file
+}
+# Appended to FIRST_AGENT_PROMPT["main_prompt"] for the combined first-stage call:
+# classification, product name extraction and candidate selection in one structured response.
+FIRST_STAGE_PROMPT = {
+    "selection_template": """
+
+### STRUCTURED OUTPUT (overrides the tool instructions above) ###
+Do not call tools. Reply only with the JSON object described by the response schema:
+- `scenario`: the scenario you would pass to `classify_user_request`.
+- `product_name`: the product name you would pass to `extract_search`.
+- `product_id`: if the scenario is SCENARIO_1_DIRECT_SEARCH, SCENARIO_2_FEATURE_EXTRACTION or SCENARIO_3_SELLER_INFO
+  and one item of PRELIMINARY_RESULTS is clearly the product the user specified, its `id`; otherwise null.
+  Never guess: a partial or doubtful match is null.
+
+## PRELIMINARY_RESULTS:
+{search_results_str}"""
+}
@@ -1,71 +1,107 @@
-from fastapi import FastAPI, Depends, Request, Response
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, Depends, Header, HTTPException, Request
+from fastapi.responses import PlainTextResponse, StreamingResponse
 from sqlalchemy.ext.asyncio import AsyncSession
-from starlette.background import BackgroundTask
-import json
 import asyncio
+import hmac
+from typing import Optional
 
 from .schemas.chat import ChatRequest, ChatResponse
+from .schemas.cache import CacheInvalidationRequest
 from .core.logger import logger
-from app.core.json_logger import log_request_response
+from app.core.config import settings
+from app.core.json_logger import request_log_writer
+from app.core.logging_middleware import JSONLoggingMiddleware
 from .services.scenario_service import check_scenario_one
-from .db.session import get_db 
-from .services import openai_service
+from .db.session import get_db, get_pool_stats
+from app.core import cost_manager
+from app.core.http_client import http_client_pool
+from app.core.cache import aget_cache_stats
+from app.db import repository
 from app.core.context import scenario_context
+from app.services import product_index, product_resolver
+from app.services.classification_cache import classification_cache
+from app.services.llm_payload import get_prompt_token_stats
+from app.services import category_index
+from app.core.streaming import stream_events
+from app.core import speculation, tracing
 
-app = FastAPI()
-
-@app.middleware("http")
-async def json_logging_middleware(request: Request, call_next):
-    openai_service.current_request_cost = 0.0
-    request_body_json = None
-    try:
-        request_body_bytes = await request.body()
-        if request_body_bytes:
-            request_body_json = json.loads(request_body_bytes)
-        
-        async def receive():
-            return {"type": "http.request", "body": request_body_bytes}
-        request = Request(request.scope, receive)
-
-    except Exception:
-        request_body_json = {"error": "Could not parse request body as JSON"}
-
-    response = await call_next(request)
-
-    response_body_json = None
-    response_body_bytes = b""
-    async for chunk in response.body_iterator:
-        response_body_bytes += chunk
-    
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await http_client_pool.start()
+    product_index.load_product_index()
     try:
-        if response_body_bytes:
-            response_body_json = json.loads(response_body_bytes)
-    except Exception:
-        response_body_json = {"error": "Could not parse response body as JSON"}
-
-    scenario = getattr(request.state, "scenario", None)
-
-    log_data = {
-        "request": request_body_json,
-        "response": response_body_json,
-        "openai_cost": openai_service.current_request_cost,
-        "scenario": scenario
-    }
-
-    task = BackgroundTask(log_request_response, log_data=log_data)
-
-    return Response(
-        content=response_body_bytes,
-        status_code=response.status_code,
-        headers=dict(response.headers),
-        media_type=response.media_type,
-        background=task,
-    )
+        await category_index.load_category_index()
+    except Exception as e:
+        logger.error(f"❌ Failed to load the category index at startup, it will load on first use: {e}")
+    yield
+    await http_client_pool.close()
+    classification_cache.close()
+    tracing.close()
+    # Flush queued request logs before the process exits.
+    request_log_writer.close()
+
+app = FastAPI(lifespan=lifespan)
+
+app.add_middleware(JSONLoggingMiddleware)
 
 @app.get("/total-cost")
 async def get_total_cost():
-    """Returns the total accumulated cost of all OpenAI API calls."""
-    return {"total_cost": openai_service.total_cost_per_session}
+    """Returns the total accumulated cost of all OpenAI API calls, with a per-model breakdown."""
+    return cost_manager.get_session_usage()
+
+@app.get("/prompt-token-stats")
+async def prompt_token_stats():
+    """Returns estimated prompt sizes per scenario 4 state (calls, average and max tokens)."""
+    return get_prompt_token_stats()
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    """Per-stage latency histograms (LLM calls, DB queries, scenario handlers), product resolver and speculation counters in Prometheus text format."""
+    body = tracing.render_metrics() + product_resolver.render_metrics() + speculation.render_metrics()
+    return PlainTextResponse(body, media_type="text/plain; version=0.0.4")
+
+@app.get("/speculation-stats")
+async def speculation_stats():
+    """Returns outcomes of the speculative prefetches per task: hit rate, cancelled/wasted runs and the seconds they cost."""
+    return speculation.stats.as_dict()
+
+@app.get("/db-pool-stats")
+async def db_pool_stats():
+    """Returns database connection pool usage and saturation."""
+    return get_pool_stats()
+
+@app.get("/cache-stats")
+async def cache_stats():
+    """Returns hit/miss counters of the in-process caches."""
+    return await aget_cache_stats()
+
+LOOPBACK_HOSTS = {"127.0.0.1", "::1", "localhost"}
+
+def require_cache_admin(http_request: Request, x_cache_token: Optional[str] = Header(None)):
+    """
+    Guards /cache/invalidate, which also rebuilds the product and category
+    indexes: callers need CACHE_INVALIDATION_TOKEN in X-Cache-Token, or to
+    be on loopback if no token is configured.
+    """
+    if settings.CACHE_INVALIDATION_TOKEN:
+        if not x_cache_token or not hmac.compare_digest(x_cache_token, settings.CACHE_INVALIDATION_TOKEN):
+            raise HTTPException(status_code=403, detail="Invalid cache invalidation token.")
+    elif not http_request.client or http_request.client.host not in LOOPBACK_HOSTS:
+        raise HTTPException(status_code=403, detail="Cache invalidation is only allowed from localhost.")
+
+@app.post("/cache/invalidate", dependencies=[Depends(require_cache_admin)])
+async def invalidate_cache(request: CacheInvalidationRequest):
+    """Drops cached catalog entries; called by scripts/data_loader.py after a reload."""
+    repository.invalidate_catalog_cache(tables=request.tables, keys=request.keys)
+    reload_all = request.tables is None and not request.keys
+    changed = set(request.tables or []) | {table for table, keys in (request.keys or {}).items() if keys}
+    if reload_all or "base_products" in changed:
+        product_index.load_product_index()
+    if reload_all or "categories" in changed:
+        await category_index.load_category_index()
+    logger.info(f"Catalog cache invalidated: tables={request.tables}, keys={ {t: len(k) for t, k in (request.keys or {}).items()} }")
+    return await aget_cache_stats()
 
 @app.get("/")
 def read_root():
@@ -85,9 +121,46 @@ async def chat_handler(
     logger.info("------------------------------------------------------------------------------------")
     logger.info(f"Received chat request with chat_id: {request.chat_id}")
     logger.info(f"--> INCOMING Request Body: {request.model_dump()}")
+    http_request.state.chat_request = request
 
-    response = await asyncio.wait_for(check_scenario_one(request, db=db, http_request=http_request), timeout=30.0)        
+    with tracing.span("chat", chat_id=request.chat_id) as root:
+        http_request.state.trace_stats = root.counters
+        async with speculation.Speculation():
+            response = await asyncio.wait_for(check_scenario_one(request, db=db, http_request=http_request), timeout=30.0)
+        root.set(scenario=getattr(http_request.state, "scenario", None))
     logger.info(f"Sending response for chat_id: {request.chat_id}")
-    logger.info(f"Response body: {response.model_dump()}")
+    logger.info(f"Response body: {response.model_dump() if response else None}")
+    # Picked up by JSONLoggingMiddleware so the serialized body is not parsed again.
+    http_request.state.chat_response = response
     
-    return response
\ No newline at end of file
+    return response
+
+
+@app.post("/chat/stream")
+async def chat_stream_handler(
+    request: ChatRequest,
+    http_request: Request,
+    db: AsyncSession = Depends(get_db)
+):
+    """
+    Streaming variant of /chat. Returns NDJSON: {"type": "token", "text": ...}
+    events while user-facing answers are generated, then one
+    {"type": "final", "response": <ChatResponse>} (or {"type": "error"}) event.
+    """
+    logger.info("------------------------------------------------------------------------------------")
+    logger.info(f"Received streaming chat request with chat_id: {request.chat_id}")
+    logger.info(f"--> INCOMING Request Body: {request.model_dump()}")
+    http_request.state.chat_request = request
+
+    async def run():
+        with tracing.span("chat", chat_id=request.chat_id, stream=True) as root:
+            http_request.state.trace_stats = root.counters
+            async with speculation.Speculation():
+                response = await check_scenario_one(request, db=db, http_request=http_request)
+            root.set(scenario=getattr(http_request.state, "scenario", None))
+        logger.info(f"Sending response for chat_id: {request.chat_id}")
+        logger.info(f"Response body: {response.model_dump() if response else None}")
+        http_request.state.chat_response = response
+        return response
+
+    return StreamingResponse(stream_events(run, timeout=30.0), media_type="application/x-ndjson")
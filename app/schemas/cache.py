@@ -0,0 +1,10 @@
+from pydantic import BaseModel
+from typing import Any, Dict, List, Optional
+
+class CacheInvalidationRequest(BaseModel):
+    """
+    Sent by the data loader after the catalog changed.
+    `tables` are cleared completely, `keys` maps a table name to the primary keys to drop.
+    """
+    tables: Optional[List[str]] = None
+    keys: Optional[Dict[str, List[Any]]] = None
@@ -1,4 +1,4 @@
-from pydantic import BaseModel
+from pydantic import BaseModel, PrivateAttr
 from typing import List, Dict, Any, Optional
 
 class Scenario4State(BaseModel):
@@ -9,5 +9,9 @@ class Scenario4State(BaseModel):
     chat_history: List[Dict[str, Any]] = []
     filters_json: Optional[Dict[str, Any]] = None
     products_with_sellers: Optional[List[Dict[str, Any]]] = None
-    product_features: str = None
-    selected_product: Optional[Dict[str, Any]] = None
\ No newline at end of file
+    product_features: Optional[str] = None
+    selected_product: Optional[Dict[str, Any]] = None
+
+    # What the session store last read or wrote, used to save only the changes.
+    _stored_fields: Dict[str, bytes] = PrivateAttr(default_factory=dict)
+    _stored_history_len: int = PrivateAttr(default=0)
@@ -0,0 +1,214 @@
+import asyncio
+import difflib
+from dataclasses import dataclass
+from types import MappingProxyType
+from typing import Any, Dict, Iterable, List, Mapping, Optional, Tuple
+
+from app.core.config import settings
+from app.core.logger import logger
+from app.core.utils import normalize_persian_text
+from app.db import repository
+from app.db.session import AsyncSessionLocal
+
+
+@dataclass(frozen=True)
+class CategoryEntry:
+    id: int
+    title: str
+    parent_id: Optional[int]
+    features_example: Optional[Mapping[str, Any]]
+
+
+def trigrams(text: str) -> set:
+    """pg_trgm-style trigrams: every word padded with two leading spaces and one trailing space."""
+    result = set()
+    for word in normalize_persian_text(text).split():
+        padded = f"  {word} "
+        result.update(padded[i:i + 3] for i in range(len(padded) - 2))
+    return result
+
+
+@dataclass(frozen=True)
+class CategoryCandidate:
+    entry: CategoryEntry
+    score: float
+
+
+@dataclass(frozen=True)
+class CategoryShortlist:
+    """What the extract_category prompt needs: a clear winner, or the titles to choose from."""
+
+    winner: Optional[str]
+    titles_text: str
+    candidates: Tuple[CategoryCandidate, ...] = ()
+
+
+def normalize_title(title: str) -> str:
+    """Lookup form of a category title; also drops the quotes and backticks LLMs wrap answers in."""
+    return normalize_persian_text(title.strip().strip("\"'`«»“”")).strip()
+
+
+class CategoryIndex:
+    """
+    An immutable snapshot of the categories table.
+
+    Built once from all rows and never mutated; a reload builds a new index
+    and swaps the module reference, so readers always see one consistent
+    version. Lookups by title accept exact titles, normalized spellings
+    (Arabic letters, digits, ZWNJ, spacing) and, as a last resort, a close
+    fuzzy match.
+    """
+
+    FUZZY_CUTOFF = 0.85
+
+    def __init__(self, rows: Iterable[Tuple[int, str, Optional[int], Any]]):
+        by_id: Dict[int, CategoryEntry] = {}
+        children: Dict[int, List[int]] = {}
+        for category_id, title, parent_id, features_example in rows:
+            if not title:
+                continue
+            features = MappingProxyType(dict(features_example)) if isinstance(features_example, dict) else None
+            by_id[category_id] = CategoryEntry(category_id, title, parent_id, features)
+            if parent_id is not None:
+                children.setdefault(parent_id, []).append(category_id)
+
+        self.by_id: Mapping[int, CategoryEntry] = MappingProxyType(by_id)
+        self.id_by_title: Mapping[str, int] = MappingProxyType({entry.title: entry.id for entry in by_id.values()})
+        self.id_by_normalized_title: Mapping[str, int] = MappingProxyType(
+            {normalize_title(entry.title): entry.id for entry in by_id.values()}
+        )
+        self.children: Mapping[int, Tuple[int, ...]] = MappingProxyType({k: tuple(v) for k, v in children.items()})
+        # The newline-separated title list the category prompt expects.
+        self.titles_text = "\n".join(entry.title for entry in by_id.values())
+
+        # Inverted trigram indexes over titles and feature names for `shortlist`.
+        self._title_size: Dict[int, int] = {}
+        self._title_postings: Dict[str, List[int]] = {}
+        self._feature_size: Dict[Tuple[int, str], int] = {}
+        self._feature_postings: Dict[str, List[Tuple[int, str]]] = {}
+        for entry in by_id.values():
+            title_trigrams = trigrams(entry.title)
+            self._title_size[entry.id] = len(title_trigrams)
+            for trigram in title_trigrams:
+                self._title_postings.setdefault(trigram, []).append(entry.id)
+            for key in entry.features_example or {}:
+                key_trigrams = trigrams(str(key))
+                if not key_trigrams:
+                    continue
+                self._feature_size[(entry.id, key)] = len(key_trigrams)
+                for trigram in key_trigrams:
+                    self._feature_postings.setdefault(trigram, []).append((entry.id, key))
+
+    def __len__(self) -> int:
+        return len(self.by_id)
+
+    def resolve(self, title: Optional[str]) -> Optional[CategoryEntry]:
+        if not title:
+            return None
+        category_id = self.id_by_title.get(title)
+        if category_id is None:
+            normalized = normalize_title(title)
+            category_id = self.id_by_normalized_title.get(normalized)
+            if category_id is None:
+                close = difflib.get_close_matches(normalized, self.id_by_normalized_title.keys(), n=1, cutoff=self.FUZZY_CUTOFF)
+                if close:
+                    category_id = self.id_by_normalized_title[close[0]]
+        return self.by_id.get(category_id) if category_id is not None else None
+
+    def shortlist(self, message: str, k: int, feature_weight: float = 0.2) -> List[CategoryCandidate]:
+        """
+        Ranks categories against `message` and returns the best `k`.
+
+        The score mixes how much of the category title appears in the message
+        (share of the title's trigrams found in it) with the best such share
+        among the category's feature names, weighted by `feature_weight`.
+        Scores are in [0, 1]; a title fully present in the message alone
+        scores 1 - feature_weight.
+        """
+        message_trigrams = trigrams(message)
+        title_hits: Dict[int, int] = {}
+        for trigram in message_trigrams:
+            for category_id in self._title_postings.get(trigram, ()):
+                title_hits[category_id] = title_hits.get(category_id, 0) + 1
+        feature_hits: Dict[Tuple[int, str], int] = {}
+        for trigram in message_trigrams:
+            for pair in self._feature_postings.get(trigram, ()):
+                feature_hits[pair] = feature_hits.get(pair, 0) + 1
+
+        feature_scores: Dict[int, float] = {}
+        for (category_id, key), hits in feature_hits.items():
+            coverage = hits / self._feature_size[(category_id, key)]
+            feature_scores[category_id] = max(feature_scores.get(category_id, 0.0), coverage)
+
+        scores = {
+            category_id: (1 - feature_weight) * title_hits.get(category_id, 0) / self._title_size[category_id]
+            + feature_weight * feature_scores.get(category_id, 0.0)
+            for category_id in set(title_hits) | set(feature_scores)
+            if self._title_size.get(category_id)
+        }
+        ranked = sorted(scores.items(), key=lambda item: item[1], reverse=True)[:k]
+        return [CategoryCandidate(self.by_id[category_id], round(score, 4)) for category_id, score in ranked]
+
+    def shortlist_for_prompt(self, message: str) -> CategoryShortlist:
+        """
+        Shortlists categories for `message`. When the best candidate scores at
+        least CATEGORY_SKIP_LLM_MIN_SCORE and leads the next one by
+        CATEGORY_SKIP_LLM_MIN_MARGIN it is returned as the winner and no LLM
+        call is needed. With no candidate at all the full title list is used.
+        """
+        candidates = self.shortlist(
+            message, settings.CATEGORY_SHORTLIST_SIZE, settings.CATEGORY_SHORTLIST_FEATURE_WEIGHT
+        )
+        if not candidates:
+            return CategoryShortlist(None, self.titles_text)
+        best = candidates[0].score
+        runner_up = candidates[1].score if len(candidates) > 1 else 0.0
+        if best >= settings.CATEGORY_SKIP_LLM_MIN_SCORE and best - runner_up >= settings.CATEGORY_SKIP_LLM_MIN_MARGIN:
+            winner = candidates[0].entry.title
+        else:
+            winner = None
+        titles_text = "\n".join(candidate.entry.title for candidate in candidates)
+        return CategoryShortlist(winner, titles_text, tuple(candidates))
+
+    def schema(self, title: Optional[str]) -> Optional[Dict[str, Any]]:
+        """The features_example of a category as a plain dict, or None."""
+        entry = self.resolve(title)
+        if entry is None or entry.features_example is None:
+            return None
+        return dict(entry.features_example)
+
+    def ancestors(self, category_id: int) -> List[CategoryEntry]:
+        """Parent, grandparent, ... of a category (cycles in the data are cut)."""
+        result, seen = [], {category_id}
+        parent_id = self.by_id[category_id].parent_id if category_id in self.by_id else None
+        while parent_id is not None and parent_id in self.by_id and parent_id not in seen:
+            seen.add(parent_id)
+            entry = self.by_id[parent_id]
+            result.append(entry)
+            parent_id = entry.parent_id
+        return result
+
+
+_index: Optional[CategoryIndex] = None
+_load_lock = asyncio.Lock()
+
+
+async def load_category_index() -> CategoryIndex:
+    """Reads the categories table and atomically replaces the current index."""
+    global _index
+    async with AsyncSessionLocal() as db:
+        rows = await repository.get_category_rows(db)
+    index = CategoryIndex(rows)
+    _index = index
+    logger.info(f"✅ Loaded category index with {len(index)} categories.")
+    return index
+
+
+async def get_category_index() -> CategoryIndex:
+    """The current index, loading it on first use if startup did not."""
+    if _index is not None:
+        return _index
+    async with _load_lock:
+        if _index is None:
+            return await load_category_index()
+    return _index
@@ -0,0 +1,70 @@
+import hashlib
+import json
+from typing import Any, List, Optional, Tuple
+
+from app.core.cache import PersistentCache
+from app.core.config import settings
+from app.core.logger import logger
+from app.core.utils import normalize_persian_text
+
+classification_cache = PersistentCache(
+    "scenario_classification",
+    path=settings.CLASSIFICATION_CACHE_PATH,
+    ttl_seconds=settings.CLASSIFICATION_CACHE_TTL_SECONDS,
+    max_entries=settings.CLASSIFICATION_CACHE_MAX_ENTRIES,
+    memory_size=settings.CLASSIFICATION_CACHE_MEMORY_SIZE,
+)
+
+
+def prompt_version(system_prompt: str, model: str, tools: List[dict]) -> str:
+    """Fingerprint of everything besides the message that decides the classification."""
+    payload = json.dumps({"prompt": system_prompt, "model": model, "tools": tools}, ensure_ascii=False, sort_keys=True)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()[:16]
+
+
+def classification_key(message: str, system_prompt: str, model: str, tools: List[dict]) -> str:
+    """
+    Cache key for one classification. Editing the prompt, the tool
+    definitions (or response schema) or the model changes the version
+    prefix, so old entries are never read again and age out through the TTL.
+    """
+    digest = hashlib.sha256(normalize_persian_text(message).encode("utf-8")).hexdigest()
+    return f"{prompt_version(system_prompt, model, tools)}:{digest}"
+
+
+async def _cached_entry(key: str) -> Optional[dict]:
+    if not settings.CLASSIFICATION_CACHE_ENABLED:
+        return None
+    try:
+        return await classification_cache.aget(key)
+    except Exception as e:
+        logger.warning(f"⚠️ Classification cache read failed: {e}")
+        return None
+
+
+async def get_cached_classification(key: str) -> Optional[Tuple[str, Any]]:
+    cached = await _cached_entry(key)
+    if cached is None:
+        return None
+    return cached["scenario"], cached["product_name"]
+
+
+async def get_cached_selection(key: str) -> Optional[Tuple[str, Any, Optional[str]]]:
+    """A cached classification with the product id selected along with it, if any."""
+    cached = await _cached_entry(key)
+    if cached is None:
+        return None
+    return cached["scenario"], cached["product_name"], cached.get("product_id")
+
+
+async def store_classification(key: str, scenario: str, product_name: Any, product_id: Optional[str] = None):
+    """Stores a decisive classification; UNCATEGORIZED results are retried next time instead."""
+    if not settings.CLASSIFICATION_CACHE_ENABLED or scenario == "UNCATEGORIZED":
+        return
+    entry = {"scenario": scenario, "product_name": product_name}
+    if product_id is not None:
+        entry["product_id"] = product_id
+    try:
+        await classification_cache.aset(key, entry)
+    except Exception as e:
+        logger.warning(f"⚠️ Classification cache write failed: {e}")
@@ -0,0 +1,120 @@
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional
+
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.core import speculation
+from app.core.config import settings
+from app.core.logger import logger
+from app.core.tracing import set_attributes, traced
+from app.db import repository
+from app.llm.prompts import FIRST_AGENT_PROMPT, FIRST_STAGE_PROMPT
+from app.services.classification_cache import classification_key, get_cached_selection, store_classification
+from app.services.llm_payload import dumps_compact
+from app.services.openai_service import structured_openai_gpt_request
+from app.services.product_resolver import guess_product_name
+
+CLASSIFICATION_MODEL = "gpt-4.1-mini"
+SCENARIOS = [
+    "SCENARIO_1_DIRECT_SEARCH",
+    "SCENARIO_2_FEATURE_EXTRACTION",
+    "SCENARIO_3_SELLER_INFO",
+    "SCENARIO_4_CONVERSATIONAL_SEARCH",
+    "SCENARIO_5_COMPARISON",
+    "UNCATEGORIZED",
+]
+PRODUCT_SCENARIOS = {"SCENARIO_1_DIRECT_SEARCH", "SCENARIO_2_FEATURE_EXTRACTION", "SCENARIO_3_SELLER_INFO"}
+
+FIRST_STAGE_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "scenario": {"type": "string", "enum": SCENARIOS},
+        "product_name": {"type": "string"},
+        "product_id": {"type": ["string", "null"]},
+    },
+    "required": ["scenario", "product_name", "product_id"],
+    "additionalProperties": False,
+}
+
+
+@dataclass(frozen=True)
+class FirstStage:
+    """Scenario and product name of a message, and the product key when the same call could pick it."""
+
+    scenario: str
+    product_name: str
+    found_key: Optional[str] = None
+    source: str = "combined"  # "combined" (one LLM call) or "cache" (classification cache hit)
+
+
+def _classification_cache_key(message: str) -> str:
+    # The combined call has its own prompt and schema, so it gets its own prompt version: editing
+    # either invalidates its entries, and the tool-based path never reads them (or the other way round).
+    system_prompt = FIRST_AGENT_PROMPT.get("main_prompt", "") + FIRST_STAGE_PROMPT["selection_template"]
+    return classification_key(message, system_prompt, CLASSIFICATION_MODEL, [FIRST_STAGE_SCHEMA])
+
+
+async def _candidates(db: AsyncSession, message: str) -> List[Dict[str, Any]]:
+    guess = guess_product_name(message)
+    if not guess:
+        return []
+    prefetched = await speculation.take("product_candidates", key=guess)
+    if prefetched is not None:
+        return prefetched[:settings.FIRST_STAGE_CANDIDATES]
+    return await repository.find_similar_products_with_scores(db, guess, limit=settings.FIRST_STAGE_CANDIDATES)
+
+
+@traced("first_stage.classify_and_select")
+async def classify_and_select(message: str, db: AsyncSession) -> Optional[FirstStage]:
+    """
+    Classifies a message and, for the single-product scenarios, picks its
+    product in one structured-output call.
+
+    A cache hit returns the cached scenario, name and selected product (if
+    that product is still in the catalog) without candidates or an LLM
+    call. Otherwise candidates come from a trigram search on a product name
+    guessed locally from the message (prefetched while the request started,
+    if speculation is on), and go into the prompt. A product id the model returns is only kept if
+    it is one of the candidates. Returns None if the call fails, so the
+    caller can use the tool-based path.
+    """
+    cache_key = _classification_cache_key(message)
+    cached = await get_cached_selection(cache_key)
+    if cached:
+        logger.info(f"Classification cache hit: {cached}")
+        scenario, product_name, product_id = cached
+        found_key = None
+        if product_id and scenario in PRODUCT_SCENARIOS:
+            if await repository.get_product_by_random_key(db, product_id) is not None:
+                found_key = product_id
+            else:
+                logger.warning(f"⚠️ Cached product '{product_id}' is no longer in the catalog; resolving the product separately.")
+        return FirstStage(scenario, product_name, found_key, source="cache")
+
+    candidates = await _candidates(db, message)
+
+    system_prompt = FIRST_AGENT_PROMPT.get("main_prompt", "") + FIRST_STAGE_PROMPT["selection_template"].format(
+        search_results_str=dumps_compact([{"id": c["id"], "product_name": c["product_name"]} for c in candidates])
+    )
+    try:
+        result = await structured_openai_gpt_request(
+            message=message,
+            systemprompt=system_prompt,
+            schema=FIRST_STAGE_SCHEMA,
+            schema_name="first_stage",
+            model=CLASSIFICATION_MODEL,
+        )
+    except Exception as e:
+        logger.error(f"❌ Combined first-stage call failed, falling back to tool calls: {e}")
+        return None
+
+    scenario = result.get("scenario") or "UNCATEGORIZED"
+    product_name = result.get("product_name") or ""
+    product_id = result.get("product_id")
+    found_key = product_id if scenario in PRODUCT_SCENARIOS and product_id in {c["id"] for c in candidates} else None
+    if product_id and not found_key:
+        logger.warning(f"⚠️ First stage picked '{product_id}', which is not a candidate; resolving the product separately.")
+    set_attributes(scenario=scenario, candidates=len(candidates), selected=found_key is not None)
+
+    await store_classification(cache_key, scenario, product_name, found_key)
+    return FirstStage(scenario, product_name, found_key)
@@ -0,0 +1,181 @@
+import asyncio
+import hashlib
+import json
+import os
+import time
+from pathlib import Path
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Optional
+
+from openai.types import CreateEmbeddingResponse
+from openai.types.chat import ChatCompletion, ChatCompletionChunk
+
+from app.core.config import settings
+from app.core.logger import logger
+
+MODES = ("off", "record", "replay", "auto")
+# Request fields that change how a response is delivered, not what it is.
+TRANSPORT_FIELDS = ("stream", "stream_options")
+REPLAY_STREAM_CHUNKS = 8
+
+RESPONSE_TYPES = {"chat": ChatCompletion, "embeddings": CreateEmbeddingResponse}
+
+
+class CassetteMiss(LookupError):
+    """Replay mode found no recorded exchange for a request."""
+
+
+def request_key(kind: str, request: Dict[str, Any]) -> str:
+    """Content address of an API request: sha256 of its canonical JSON, transport fields left out."""
+    payload = {key: value for key, value in request.items() if key not in TRANSPORT_FIELDS}
+    canonical = json.dumps({"kind": kind, "request": payload}, ensure_ascii=False, sort_keys=True, default=str)
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+def _stream_pieces(text: str, count: int):
+    size = max(1, -(-len(text) // count))
+    return [text[start:start + size] for start in range(0, len(text), size)]
+
+
+class LLMCassette:
+    """
+    Record/replay store for OpenAI API exchanges.
+
+    Each exchange is one JSON file named by the request's content address
+    (`<dir>/<2 hex>/<sha256>.json`) holding the request, the full response
+    (tool calls and usage included) and the observed latency. A replayed
+    response is rebuilt as the same openai type the API returns, after the
+    recorded latency (scaled) or a fixed synthetic one. Streamed and plain
+    requests share entries, so a stream can be replayed as chunks from a
+    plain recording and the other way around.
+    """
+
+    def __init__(self, directory: str, mode: str = "off", latency: Optional[float] = None, latency_scale: float = 1.0):
+        if mode not in MODES:
+            raise ValueError(f"LLM cassette mode must be one of {MODES}, not {mode!r}.")
+        self.directory = Path(directory)
+        self.mode = mode
+        self.latency = latency
+        self.latency_scale = latency_scale
+        self.hits = 0
+        self.recorded = 0
+
+    @property
+    def active(self) -> bool:
+        return self.mode != "off"
+
+    def path(self, key: str) -> Path:
+        return self.directory / key[:2] / f"{key}.json"
+
+    def load(self, key: str) -> Optional[Dict[str, Any]]:
+        try:
+            with open(self.path(key), "r", encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    def save(self, key: str, entry: Dict[str, Any]):
+        path = self.path(key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        temporary = path.with_suffix(f".{os.getpid()}.tmp")
+        with open(temporary, "w", encoding="utf-8") as f:
+            json.dump(entry, f, ensure_ascii=False)
+        os.replace(temporary, path)
+
+    def delay(self, recorded: float) -> float:
+        return self.latency if self.latency is not None else recorded * self.latency_scale
+
+    async def call(self, kind: str, create: Callable[..., Awaitable[Any]], **request: Any) -> Any:
+        """
+        `create(**request)` through the cassette. Returns what the API call
+        would: a response object, or an async iterator of chunks for a
+        streamed chat request.
+        """
+        key = request_key(kind, request)
+        if self.mode in ("replay", "auto"):
+            entry = await asyncio.to_thread(self.load, key)
+            if entry is not None:
+                self.hits += 1
+                if request.get("stream"):
+                    return self._replay_stream(entry)
+                await asyncio.sleep(self.delay(entry["latency"]))
+                return RESPONSE_TYPES[kind].model_validate(entry["response"])
+            if self.mode == "replay":
+                raise CassetteMiss(f"No recorded {kind} exchange {key} in {self.directory}")
+
+        started_at = time.perf_counter()
+        response = await create(**request)
+        if request.get("stream"):
+            return self._record_stream(key, kind, request, response, started_at)
+        await self._store(key, kind, request, response.model_dump(mode="json"), time.perf_counter() - started_at)
+        return response
+
+    async def _store(self, key: str, kind: str, request: Dict[str, Any], response: Dict[str, Any], latency: float, first_token_latency: Optional[float] = None):
+        entry = {
+            "kind": kind,
+            "request": {name: value for name, value in request.items() if name not in TRANSPORT_FIELDS},
+            "response": response,
+            "latency": round(latency, 4),
+            "first_token_latency": round(first_token_latency, 4) if first_token_latency is not None else None,
+            "recorded_at": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        }
+        try:
+            await asyncio.to_thread(self.save, key, json.loads(json.dumps(entry, default=str)))
+            self.recorded += 1
+        except Exception as e:
+            logger.warning(f"⚠️ Failed to record LLM exchange {key}: {e}")
+
+    async def _record_stream(self, key: str, kind: str, request: Dict[str, Any], stream, started_at: float) -> AsyncIterator[ChatCompletionChunk]:
+        """Passes the chunks through and records the assembled completion once the stream ends."""
+        parts, usage, first_token_at, last = [], None, None, None
+        async for chunk in stream:
+            last = chunk
+            if chunk.usage:
+                usage = chunk.usage.model_dump(mode="json")
+            if chunk.choices and chunk.choices[0].delta.content:
+                if first_token_at is None:
+                    first_token_at = time.perf_counter()
+                parts.append(chunk.choices[0].delta.content)
+            yield chunk
+        if last is None:
+            return
+        response = {
+            "id": last.id,
+            "object": "chat.completion",
+            "created": last.created,
+            "model": last.model,
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": "".join(parts)}, "finish_reason": "stop"}],
+            "usage": usage,
+        }
+        first_token_latency = first_token_at - started_at if first_token_at is not None else None
+        await self._store(key, kind, request, response, time.perf_counter() - started_at, first_token_latency)
+
+    async def _replay_stream(self, entry: Dict[str, Any]) -> AsyncIterator[ChatCompletionChunk]:
+        """A recorded completion as chunks: the first after the time to first token, the rest spread over the remaining latency."""
+        response = entry["response"]
+        content = response["choices"][0]["message"].get("content") or ""
+        total = self.delay(entry["latency"])
+        first = self.delay(entry.get("first_token_latency") or entry["latency"])
+        pieces = _stream_pieces(content, REPLAY_STREAM_CHUNKS)
+        step = max(0.0, total - first) / max(1, len(pieces))
+        base = {"id": response["id"], "object": "chat.completion.chunk", "created": response["created"], "model": response["model"]}
+
+        await asyncio.sleep(first)
+        for number, piece in enumerate(pieces):
+            if number:
+                await asyncio.sleep(step)
+            yield ChatCompletionChunk.model_validate(
+                {**base, "choices": [{"index": 0, "delta": {"role": "assistant", "content": piece}, "finish_reason": None}]}
+            )
+        yield ChatCompletionChunk.model_validate({**base, "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}]})
+        if response.get("usage"):
+            yield ChatCompletionChunk.model_validate({**base, "choices": [], "usage": response["usage"]})
+
+
+cassette = LLMCassette(
+    settings.LLM_CASSETTE_DIR,
+    mode=settings.LLM_CASSETTE_MODE,
+    latency=settings.LLM_CASSETTE_LATENCY,
+    latency_scale=settings.LLM_CASSETTE_LATENCY_SCALE,
+)
+if cassette.active:
+    logger.info(f"📼 LLM cassette in '{cassette.mode}' mode at '{cassette.directory}'.")
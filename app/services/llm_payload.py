@@ -0,0 +1,149 @@
+import json
+import math
+from typing import Any, Dict, List, Optional
+
+from app.core.config import settings
+from app.core.logger import logger
+
+try:
+    import tiktoken
+
+    _encoding = tiktoken.get_encoding("o200k_base")
+except Exception:  # pragma: no cover - tiktoken is in requirements.txt, but the estimate keeps working without it
+    _encoding = None
+    logger.warning("⚠️ tiktoken is not available; prompt token stats are estimated at 4 UTF-8 bytes per token.")
+
+SELLER_COLUMNS = ["member_key", "price", "city", "shop_score", "has_warranty"]
+
+_prompt_token_stats: Dict[str, Dict[str, int]] = {}
+
+
+def dumps_compact(value: Any) -> str:
+    """JSON without ASCII escaping or padding; escaped Persian costs several tokens per letter."""
+    return json.dumps(value, ensure_ascii=False, separators=(",", ":"), default=str)
+
+
+def estimate_tokens(text: str) -> int:
+    """Token count of `text`: exact with tiktoken, otherwise about one token per 4 UTF-8 bytes."""
+    if _encoding is not None:
+        return len(_encoding.encode(text))
+    return math.ceil(len(text.encode("utf-8")) / 4)
+
+
+def record_prompt(state: str, *parts: str) -> int:
+    """Adds the estimated input size of one LLM call to the counters of `state`."""
+    tokens = sum(estimate_tokens(part) for part in parts if part)
+    stats = _prompt_token_stats.setdefault(state, {"calls": 0, "total_tokens": 0, "max_tokens": 0})
+    stats["calls"] += 1
+    stats["total_tokens"] += tokens
+    stats["max_tokens"] = max(stats["max_tokens"], tokens)
+    logger.info(f"Estimated prompt size for {state}: {tokens} tokens")
+    return tokens
+
+
+def get_prompt_token_stats() -> Dict[str, Dict[str, Any]]:
+    return {
+        state: {**stats, "avg_tokens": round(stats["total_tokens"] / stats["calls"], 1)}
+        for state, stats in _prompt_token_stats.items()
+    }
+
+
+def _as_dict(value: Any) -> Dict[str, Any]:
+    if isinstance(value, dict):
+        return value
+    if isinstance(value, str) and value:
+        try:
+            parsed = json.loads(value)
+        except json.JSONDecodeError:
+            return {}
+        return parsed if isinstance(parsed, dict) else {}
+    return {}
+
+
+def select_sellers(sellers: List[Dict[str, Any]], limit: int) -> List[Dict[str, Any]]:
+    """
+    The sellers worth showing: the cheapest half of `limit`, then the best
+    scored of the rest. Ties keep warranty sellers first.
+    """
+    if len(sellers) <= limit:
+        return list(sellers)
+    by_price = sorted(sellers, key=lambda s: (s.get("price") is None, s.get("price") or 0, not s.get("has_warranty")))
+    cheapest = by_price[: max(1, limit // 2)]
+    chosen = {id(s) for s in cheapest}
+    rest = sorted(
+        (s for s in sellers if id(s) not in chosen),
+        key=lambda s: (-(s.get("shop_score") or 0), not s.get("has_warranty"), s.get("price") or 0),
+    )
+    return cheapest + rest[: limit - len(cheapest)]
+
+
+def seller_table(sellers: List[Dict[str, Any]], limit: Optional[int] = None) -> Dict[str, Any]:
+    """Sellers as {"columns": [...], "rows": [[...], ...]} so keys are not repeated per seller."""
+    limit = settings.LLM_PAYLOAD_MAX_SELLERS if limit is None else limit
+    selected = select_sellers(sellers or [], limit)
+    table = {"columns": SELLER_COLUMNS, "rows": [[s.get(c) for c in SELLER_COLUMNS] for s in selected]}
+    if len(sellers or []) > len(selected):
+        table["total_sellers"] = len(sellers)
+    return table
+
+
+def project_features(features: Any, schema: Any = None, filters: Optional[Dict[str, Any]] = None, limit: Optional[int] = None) -> Dict[str, Any]:
+    """
+    Keeps the features named in the category schema or in the user's
+    feature filters; without a schema, the first `limit` features.
+    """
+    limit = settings.LLM_PAYLOAD_MAX_FEATURES if limit is None else limit
+    features = _as_dict(features)
+    wanted = set(_as_dict(schema)) | set(((filters or {}).get("structured_filters") or {}).get("features") or {})
+    if wanted:
+        projected = {key: value for key, value in features.items() if key in wanted}
+    else:
+        projected = features
+    return dict(list(projected.items())[:limit])
+
+
+def build_products_payload(
+    products: List[Dict[str, Any]],
+    schema: Any = None,
+    filters: Optional[Dict[str, Any]] = None,
+    include_sellers: bool = True,
+    token_budget: Optional[int] = None,
+) -> List[Dict[str, Any]]:
+    """
+    A compact view of scenario 4 search results for a prompt. Each product
+    keeps its name and key, the projected features, its seller count and
+    lowest price, and (optionally) a seller table. If the serialized payload
+    exceeds `token_budget`, sellers, then features, then trailing products
+    are cut until it fits.
+    """
+    token_budget = settings.LLM_PAYLOAD_TOKEN_BUDGET if token_budget is None else token_budget
+    max_sellers = settings.LLM_PAYLOAD_MAX_SELLERS if include_sellers else 0
+    max_features = settings.LLM_PAYLOAD_MAX_FEATURES
+    max_products = len(products or [])
+
+    while True:
+        payload = []
+        for product in (products or [])[:max_products]:
+            sellers = product.get("sellers") or []
+            prices = [s.get("price") for s in sellers if s.get("price") is not None]
+            item = {
+                "product_name": product.get("product_name"),
+                "base_product_key": product.get("base_product_key"),
+                "product_features": project_features(product.get("product_features"), schema, filters, max_features),
+                "seller_count": len(sellers),
+                "min_price": min(prices) if prices else None,
+            }
+            if include_sellers:
+                item["sellers"] = seller_table(sellers, max_sellers)
+            payload.append(item)
+
+        if estimate_tokens(dumps_compact(payload)) <= token_budget:
+            return payload
+        if include_sellers and max_sellers > 1:
+            max_sellers //= 2
+        elif max_features > 3:
+            max_features //= 2
+        elif max_products > 1:
+            max_products -= 1
+        else:
+            return payload
@@ -1,11 +1,15 @@
+import json
+import time
 from openai import AsyncOpenAI, OpenAI
-from typing import Optional, List, Dict, Any
+from typing import Optional, List, Dict, Any, Callable, Union
 
 from app.core.config import settings
 from app.core.logger import logger
+from app.core import cost_manager
+from app.core.streaming import StreamFilter, emit_token, streaming_enabled
+from app.core.tracing import set_attributes, traced
+from app.services.llm_cassette import cassette
 
-total_cost_per_session = 0.0
-current_request_cost = 0.0
 if settings.OPENAI_API_KEY:
     async_client = AsyncOpenAI(
         api_key=settings.OPENAI_API_KEY,
@@ -20,11 +24,26 @@ else:
     logger.warning("⚠️ OpenAI API key or base URL is not set. LLM service will be disabled.")
 
 
+async def _create_chat_completion(**request):
+    """`chat.completions.create`, through the record/replay cassette when LLM_CASSETTE_MODE is set."""
+    if cassette.active:
+        return await cassette.call("chat", lambda **r: async_client.chat.completions.create(**r), **request)
+    return await async_client.chat.completions.create(**request)
+
+
+async def _create_embeddings(**request):
+    if cassette.active:
+        return await cassette.call("embeddings", lambda **r: async_client.embeddings.create(**r), **request)
+    return await async_client.embeddings.create(**request)
+
+
+@traced("llm.chat")
 async def simple_openai_gpt_request(
     message: str,
     systemprompt: str,
     model: str = 'gpt-4.1-mini',
-    chat_history: Optional[List[dict]] = None
+    chat_history: Optional[List[dict]] = None,
+    stream: Union[bool, Callable[[], StreamFilter]] = False
 ) -> str:
     """
     Sends a chat completion request to OpenAI GPT model asynchronously.
@@ -34,6 +53,9 @@ async def simple_openai_gpt_request(
         systemprompt (str): The system prompt to guide the model's behavior.
         model (str, optional): The model name to use. Defaults to 'gpt-4o-mini'.
         chat_history (Optional[List[dict]], optional): Previous chat history messages. Defaults to None.
+        stream (optional): Marks the reply as user-facing text. During a streaming
+            chat request it is then forwarded token by token; a filter factory
+            (e.g. `after_code_block`) selects which part is forwarded.
 
     Returns:
         string: (response_content) where response_content is the model's reply.
@@ -50,13 +72,18 @@ async def simple_openai_gpt_request(
         if message:
             messages.append({"role": "user", "content": message})
 
-        response = await async_client.chat.completions.create(
+        if stream and streaming_enabled():
+            return await _streamed_gpt_request(messages, model, stream if callable(stream) else None)
+
+        started_at = time.perf_counter()
+        response = await _create_chat_completion(
             model=model,
             messages=messages,
         )
+        latency = time.perf_counter() - started_at
         input_tokens = response.usage.prompt_tokens
         output_tokens = response.usage.completion_tokens
-        cost = calculate_gpt_cost(input_tokens, output_tokens, model = model)
+        cost = calculate_gpt_cost(input_tokens, output_tokens, model = model, latency=latency)
         logger.info(f"--------------------------\nmodel: {model}\ncost:{cost}\n--------------------------")
         # input_tokens = response.usage.prompt_tokens
         # output_tokens = response.usage.completion_tokens
@@ -66,6 +93,38 @@ async def simple_openai_gpt_request(
         logger.error(e)
         raise
 
+async def _streamed_gpt_request(messages: List[dict], model: str, make_filter: Optional[Callable[[], StreamFilter]]) -> str:
+    """Streams a completion to the current token sink and returns the full text."""
+    accept = make_filter() if make_filter else None
+    started_at = time.perf_counter()
+    first_token_at = None
+    parts = []
+    usage = None
+    response = await _create_chat_completion(
+        model=model,
+        messages=messages,
+        stream=True,
+        stream_options={"include_usage": True},
+    )
+    async for chunk in response:
+        if chunk.usage:
+            usage = chunk.usage
+        if not chunk.choices or not chunk.choices[0].delta.content:
+            continue
+        delta = chunk.choices[0].delta.content
+        if first_token_at is None:
+            first_token_at = time.perf_counter()
+        parts.append(delta)
+        emit_token(accept(delta) if accept else delta)
+    latency = time.perf_counter() - started_at
+    if usage is not None:
+        cost = calculate_gpt_cost(usage.prompt_tokens, usage.completion_tokens, model=model, latency=latency)
+        logger.info(f"--------------------------\nmodel: {model} (streamed)\ncost:{cost}\n--------------------------")
+    if first_token_at is not None:
+        logger.info(f"First token from {model} after {(first_token_at - started_at) * 1000:.0f}ms")
+    return "".join(parts)
+
+@traced("llm.chat_with_tools")
 async def simple_openai_gpt_request_with_tools(
     message: str,
     systemprompt: str,
@@ -93,7 +152,7 @@ async def simple_openai_gpt_request_with_tools(
     Raises:
         Exception: If the request fails or an error occurs.
     """
-    if not async_client:
+    if not async_client and cassette.mode != "replay":
         raise Exception("OpenAI async_client is not initialized. Please check your API key and base URL.")
     
     try:
@@ -109,12 +168,14 @@ async def simple_openai_gpt_request_with_tools(
         
         logger.info(f"--> Sending payload to LLM: {messages}")
         
-        response = await async_client.chat.completions.create(
+        started_at = time.perf_counter()
+        response = await _create_chat_completion(
             model=model,
             messages=messages,
             tools=tools,
             tool_choice="auto"
         )
+        latency = time.perf_counter() - started_at
 
         logger.info(f"Token usage - Input: {response.usage.prompt_tokens}, Output: {response.usage.completion_tokens}")
                 
@@ -123,7 +184,7 @@ async def simple_openai_gpt_request_with_tools(
         tool_calls = response.choices[0].message.tool_calls
         input_tokens = response.usage.prompt_tokens
         output_tokens = response.usage.completion_tokens
-        cost = calculate_gpt_cost(input_tokens, output_tokens, model = model)
+        cost = calculate_gpt_cost(input_tokens, output_tokens, model = model, latency=latency)
         logger.info(f"--------------------------\nmodel: {model}\ncost:{cost}\n--------------------------")
         return result, tool_calls
         
@@ -131,6 +192,31 @@ async def simple_openai_gpt_request_with_tools(
         logger.error(f"Error in simple_openai_gpt_request_with_tools: {e}")
         raise
     
+@traced("llm.structured")
+async def structured_openai_gpt_request(
+    message: str,
+    systemprompt: str,
+    schema: Dict[str, Any],
+    schema_name: str,
+    model: str = 'gpt-4.1-mini'
+) -> Dict[str, Any]:
+    """
+    Sends a chat completion request whose reply must follow a JSON schema
+    (strict structured outputs) and returns the parsed object.
+    """
+    messages = [{"role": "system", "content": systemprompt}, {"role": "user", "content": message}]
+    started_at = time.perf_counter()
+    response = await _create_chat_completion(
+        model=model,
+        messages=messages,
+        response_format={"type": "json_schema", "json_schema": {"name": schema_name, "strict": True, "schema": schema}},
+    )
+    latency = time.perf_counter() - started_at
+    cost = calculate_gpt_cost(response.usage.prompt_tokens, response.usage.completion_tokens, model=model, latency=latency)
+    logger.info(f"--------------------------\nmodel: {model} ({schema_name})\ncost:{cost}\n--------------------------")
+    return json.loads(response.choices[0].message.content)
+
+@traced("llm.image")
 async def analyze_image(user_message, base64_image, prompt, model="gpt-4.1"):
     try:
 
@@ -152,14 +238,16 @@ async def analyze_image(user_message, base64_image, prompt, model="gpt-4.1"):
         # Combine history messages with the current message
         all_messages = [system_message] + current_message
         logger.info(str(all_messages))
-        response = await async_client.chat.completions.create(
+        started_at = time.perf_counter()
+        response = await _create_chat_completion(
             model=model,
             messages=all_messages
         )
+        latency = time.perf_counter() - started_at
         description = response.choices[0].message.content
         input_tokens = response.usage.prompt_tokens if hasattr(response, 'usage') else 0
         output_tokens = response.usage.completion_tokens if hasattr(response, 'usage') else 0
-        input_tokens, output_tokens, cost = calculate_gpt_cost(int(input_tokens), int(output_tokens), model)
+        input_tokens, output_tokens, cost = calculate_gpt_cost(int(input_tokens), int(output_tokens), model, latency=latency)
         logger.info(f"--------------------------\nmodel: {model}\ncost:{cost}\n--------------------------")
         return description
     
@@ -175,9 +263,20 @@ def get_embeddings(texts, model="text-embedding-3-small", dimensions=512):
     return [embedding.embedding for embedding in response.data]
 
 
-def calculate_gpt_cost(input_tokens, output_tokens, model = 'gpt-4o-mini'):
+@traced("llm.embeddings")
+async def get_embeddings_async(texts, model="text-embedding-3-small", dimensions=512):
+    start_time = time.perf_counter()
+    response = await _create_embeddings(
+        input=texts,
+        model=model,
+        dimensions=dimensions
+    )
+    calculate_gpt_cost(response.usage.prompt_tokens, 0, model=model, latency=time.perf_counter() - start_time)
+    return [embedding.embedding for embedding in response.data]
+
+
+def calculate_gpt_cost(input_tokens, output_tokens, model = 'gpt-4o-mini', latency = 0.0):
     try:
-        global total_cost_per_session, current_request_cost
         if model == 'gpt-4o':
             input_token_cost_per_million = 2.5
             output_token_cost_per_million = 10
@@ -202,6 +301,12 @@ def calculate_gpt_cost(input_tokens, output_tokens, model = 'gpt-4o-mini'):
         if model == 'gpt-5-nano':
             input_token_cost_per_million = 0.05
             output_token_cost_per_million = 0.40
+        if model == 'text-embedding-3-small':
+            input_token_cost_per_million = 0.02
+            output_token_cost_per_million = 0.0
+        if model == 'text-embedding-3-large':
+            input_token_cost_per_million = 0.13
+            output_token_cost_per_million = 0.0
             
         
         input_cost = (input_tokens / 1_000_000) * input_token_cost_per_million
@@ -209,8 +314,8 @@ def calculate_gpt_cost(input_tokens, output_tokens, model = 'gpt-4o-mini'):
         output_cost = (output_tokens / 1_000_000) * output_token_cost_per_million
         
         total_cost = input_cost + output_cost
-        total_cost_per_session += total_cost
-        current_request_cost += total_cost
+        cost_manager.record_usage(model, input_tokens, output_tokens, total_cost, latency)
+        set_attributes(model=model, input_tokens=input_tokens, output_tokens=output_tokens, cost=total_cost)
         
         return input_tokens, output_tokens, total_cost
     except Exception as e:
@@ -0,0 +1,54 @@
+from typing import Any, Dict, List, Optional
+
+from app.core import speculation
+from app.core.config import settings
+from app.core.logger import logger
+from app.db import repository
+from app.db.session import AsyncSessionLocal, get_pool_stats
+from app.services.category_index import CategoryShortlist, get_category_index
+from app.services.product_resolver import guess_product_name, resolve_candidates
+
+PRODUCT_SCENARIOS = {"SCENARIO_1_DIRECT_SEARCH", "SCENARIO_2_FEATURE_EXTRACTION", "SCENARIO_3_SELLER_INFO"}
+
+# Enough rows for both the first-stage prompt and the product resolver; each takes its own top N.
+CANDIDATE_LIMIT = max(settings.FIRST_STAGE_CANDIDATES, settings.PRODUCT_RESOLVER_CANDIDATES)
+
+
+async def _product_candidates(query: str) -> List[Dict[str, Any]]:
+    # Speculative work gets its own session: the request's session cannot run two queries at once.
+    async with AsyncSessionLocal() as db:
+        return await repository.find_similar_products_with_scores(db, query, limit=CANDIDATE_LIMIT)
+
+
+async def _category_shortlist(message: str) -> CategoryShortlist:
+    return (await get_category_index()).shortlist_for_prompt(message)
+
+
+async def _top_candidate_sellers(message: str, guess: str) -> Optional[speculation.Keyed]:
+    candidates = await speculation.peek("product_candidates")
+    if not candidates:
+        return None
+    key = resolve_candidates([guess, message], candidates).key or candidates[0]["id"]
+    async with AsyncSessionLocal() as db:
+        return speculation.Keyed(key, await repository.get_sellers_context(db, key))
+
+
+def start_prefetches(message: str):
+    """
+    Starts the scenario-independent lookups of a new message before it is
+    classified: the trigram candidates of the product name guessed from it,
+    the seller context of the most likely candidate (scenario 3) and the
+    category shortlist (scenario 4). DB lookups are skipped while the
+    connection pool is close to saturation.
+    """
+    if not speculation.active():
+        return
+    guess = guess_product_name(message)
+    saturation = get_pool_stats()["saturation"] or 0.0
+    if guess and saturation < settings.SPECULATION_MAX_POOL_SATURATION:
+        speculation.start("product_candidates", lambda: _product_candidates(guess), key=guess, scenarios=PRODUCT_SCENARIOS)
+        speculation.start("seller_context", lambda: _top_candidate_sellers(message, guess), scenarios={"SCENARIO_3_SELLER_INFO"})
+    elif guess:
+        logger.info(f"🔮 DB pool at {saturation:.0%}; no speculative DB lookups for this request.")
+    speculation.start("category_shortlist", lambda: _category_shortlist(message), key=message, scenarios={"SCENARIO_4_CONVERSATIONAL_SEARCH"})
+
@@ -0,0 +1,221 @@
+import asyncio
+import json
+import os
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.core.config import settings
+from app.core.logger import logger
+from app.core.tracing import traced
+from app.db import repository
+from app.services.openai_service import get_embeddings_async
+
+VECTORS_FILE = "vectors.npy"
+META_FILE = "meta.json"
+
+
+class ProductVectorIndex:
+    """
+    A flat inner-product index over L2-normalized product-name embeddings.
+
+    The vectors live in a .npy file that is memory-mapped read-only, so the
+    index costs no heap memory and pages are shared between worker processes.
+    Searches scan the matrix in row blocks to keep the score buffer bounded.
+    """
+
+    def __init__(self, vectors: np.ndarray, keys: List[str], names: List[str], model: str):
+        self.vectors = vectors
+        self.keys = keys
+        self.names = names
+        self.model = model
+        self.dimensions = vectors.shape[1]
+        self._row_by_key = {key: row for row, key in enumerate(keys)}
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+    @classmethod
+    def load(cls, directory: str) -> Optional["ProductVectorIndex"]:
+        path = Path(directory)
+        if not (path / VECTORS_FILE).exists() or not (path / META_FILE).exists():
+            return None
+        meta = json.loads((path / META_FILE).read_text(encoding="utf-8"))
+        vectors = np.load(path / VECTORS_FILE, mmap_mode="r")
+        if vectors.shape[0] != len(meta["keys"]):
+            logger.error(f"❌ Product index at '{directory}' is inconsistent: {vectors.shape[0]} vectors, {len(meta['keys'])} keys.")
+            return None
+        return cls(vectors, meta["keys"], meta["names"], meta["model"])
+
+    @staticmethod
+    def save(directory: str, keys: Sequence[str], names: Sequence[str], vectors: np.ndarray, model: str):
+        """Writes normalized float32 vectors and their metadata, replacing the files atomically."""
+        path = Path(directory)
+        path.mkdir(parents=True, exist_ok=True)
+        vectors = normalize_rows(np.asarray(vectors, dtype=np.float32))
+
+        tmp_vectors = path / f"{VECTORS_FILE}.tmp"
+        with open(tmp_vectors, "wb") as f:
+            np.save(f, vectors)
+        tmp_meta = path / f"{META_FILE}.tmp"
+        tmp_meta.write_text(json.dumps({"model": model, "keys": list(keys), "names": list(names)}, ensure_ascii=False), encoding="utf-8")
+        os.replace(tmp_vectors, path / VECTORS_FILE)
+        os.replace(tmp_meta, path / META_FILE)
+
+    def search(self, queries: np.ndarray, top_k: int = 10, block_rows: int = 65536) -> List[List[Tuple[str, str, float]]]:
+        """
+        Returns the `top_k` (random_key, persian_name, score) hits for every row
+        of `queries`, best first. All queries are scored in one matrix product
+        per block of index rows.
+        """
+        queries = normalize_rows(np.atleast_2d(np.asarray(queries, dtype=np.float32)))
+        n_queries = queries.shape[0]
+        top_k = min(top_k, len(self.keys))
+        if top_k == 0:
+            return [[] for _ in range(n_queries)]
+
+        best_scores = np.full((n_queries, 0), -np.inf, dtype=np.float32)
+        best_rows = np.empty((n_queries, 0), dtype=np.int64)
+        for start in range(0, len(self.keys), block_rows):
+            block = np.asarray(self.vectors[start:start + block_rows])
+            scores = queries @ block.T
+            k = min(top_k, scores.shape[1])
+            part = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+            best_scores = np.concatenate([best_scores, np.take_along_axis(scores, part, axis=1)], axis=1)
+            best_rows = np.concatenate([best_rows, part + start], axis=1)
+            if best_scores.shape[1] > top_k:
+                keep = np.argpartition(-best_scores, top_k - 1, axis=1)[:, :top_k]
+                best_scores = np.take_along_axis(best_scores, keep, axis=1)
+                best_rows = np.take_along_axis(best_rows, keep, axis=1)
+
+        order = np.argsort(-best_scores, axis=1)
+        sorted_rows = np.take_along_axis(best_rows, order, axis=1)
+        sorted_scores = np.take_along_axis(best_scores, order, axis=1)
+        return [
+            [(self.keys[row], self.names[row], float(score)) for row, score in zip(rows, scores)]
+            for rows, scores in zip(sorted_rows.tolist(), sorted_scores.tolist())
+        ]
+
+    def score_keys(self, query: np.ndarray, keys: Sequence[str]) -> Dict[str, float]:
+        """Cosine similarity between `query` and the given products (unknown keys are skipped)."""
+        rows = [(key, self._row_by_key[key]) for key in keys if key in self._row_by_key]
+        if not rows:
+            return {}
+        query = normalize_rows(np.atleast_2d(np.asarray(query, dtype=np.float32)))[0]
+        matrix = np.asarray(self.vectors[[row for _, row in rows]])
+        scores = matrix @ query
+        return {key: float(score) for (key, _), score in zip(rows, scores)}
+
+
+def normalize_rows(matrix: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+_index: Optional[ProductVectorIndex] = None
+_index_loaded = False
+
+
+def load_product_index(directory: Optional[str] = None) -> Optional[ProductVectorIndex]:
+    """(Re)loads the index from disk. Called at startup and after a catalog reload."""
+    global _index, _index_loaded
+    directory = directory or settings.PRODUCT_INDEX_DIR
+    try:
+        _index = ProductVectorIndex.load(directory)
+    except (OSError, ValueError, KeyError) as e:
+        logger.error(f"❌ Failed to load product index from '{directory}': {e}")
+        _index = None
+    _index_loaded = True
+    if _index is None:
+        logger.warning(f"⚠️ No product vector index at '{directory}'. Product search falls back to trigram similarity.")
+    else:
+        logger.info(f"✅ Loaded product vector index with {len(_index)} products ({_index.dimensions} dims).")
+    return _index
+
+
+def get_product_index() -> Optional[ProductVectorIndex]:
+    if not _index_loaded:
+        load_product_index()
+    return _index
+
+
+async def _embed_queries(index: ProductVectorIndex, queries: List[str]) -> Optional[np.ndarray]:
+    try:
+        vectors = await get_embeddings_async(queries, model=index.model, dimensions=index.dimensions)
+    except Exception as e:
+        logger.error(f"❌ Failed to embed product queries, using trigram scores only: {e}")
+        return None
+    return np.asarray(vectors, dtype=np.float32)
+
+
+def fuse_scores(vector_scores: Dict[str, float], trigram_scores: Dict[str, float], vector_weight: float) -> Dict[str, float]:
+    """Weighted sum of the two similarities; a missing score counts as 0."""
+    return {
+        key: vector_weight * vector_scores.get(key, 0.0) + (1 - vector_weight) * trigram_scores.get(key, 0.0)
+        for key in set(vector_scores) | set(trigram_scores)
+    }
+
+
+@traced("search.hybrid_products")
+async def hybrid_search_products(db: AsyncSession, product_names: List[str], top_k: int = 10) -> List[List[Dict[str, Any]]]:
+    """
+    Batched product search. For every name returns up to `top_k` candidates
+    as {'id', 'product_name', 'score'} ordered by the fused vector + trigram score.
+
+    The query embeddings are requested while the trigram candidates are read
+    from the database. Candidates found by only one side get their other score
+    filled in, so the fusion compares like with like. Without an index (or if
+    the embedding call fails) the trigram ranking is returned unchanged.
+    """
+    index = get_product_index()
+    embedding_task = asyncio.create_task(_embed_queries(index, product_names)) if index is not None else None
+    try:
+        trigram_hits = [
+            await repository.find_similar_products_with_scores(db, name, limit=top_k)
+            for name in product_names
+        ]
+    except BaseException:
+        if embedding_task is not None:
+            embedding_task.cancel()
+        raise
+    query_vectors = await embedding_task if embedding_task is not None else None
+
+    if query_vectors is None:
+        return [[{**hit, "score": round(hit["score"], 4)} for hit in hits] for hits in trigram_hits]
+
+    # A full scan of the memmapped catalog; NumPy releases the GIL, so other requests keep running.
+    vector_hits = await asyncio.to_thread(index.search, query_vectors, top_k=settings.PRODUCT_INDEX_CANDIDATES)
+    results = []
+    for name, query_vector, trigram, vector in zip(product_names, query_vectors, trigram_hits, vector_hits):
+        names = {hit["id"]: hit["product_name"] for hit in trigram}
+        names.update({key: product_name for key, product_name, _ in vector})
+        trigram_scores = {hit["id"]: hit["score"] for hit in trigram}
+        vector_scores = {key: score for key, _, score in vector}
+
+        missing_trigram = [key for key in vector_scores if key not in trigram_scores]
+        if missing_trigram:
+            trigram_scores.update(await repository.get_name_similarities(db, name, missing_trigram))
+        missing_vector = [key for key in trigram_scores if key not in vector_scores]
+        if missing_vector:
+            vector_scores.update(index.score_keys(query_vector, missing_vector))
+
+        fused = fuse_scores(vector_scores, trigram_scores, settings.PRODUCT_INDEX_VECTOR_WEIGHT)
+        ranked = sorted(fused.items(), key=lambda item: item[1], reverse=True)[:top_k]
+        results.append([{"id": key, "product_name": names[key], "score": round(score, 4)} for key, score in ranked])
+    return results
+
+
+async def search_products(db: AsyncSession, product_name: str, top_k: int = 10) -> List[Dict[str, str]]:
+    """Drop-in replacement for `repository.find_similar_products` backed by the hybrid search."""
+    hits = (await hybrid_search_products(db, [product_name], top_k=top_k))[0]
+    return [{"id": hit["id"], "product_name": hit["product_name"]} for hit in hits]
+
+
+def max_tool_rounds() -> int:
+    """LLM refinement rounds allowed when picking a product; fewer are needed with the vector index."""
+    if get_product_index() is not None:
+        return settings.PRODUCT_SEARCH_MAX_TOOL_ROUNDS_WITH_INDEX
+    return settings.PRODUCT_SEARCH_MAX_TOOL_ROUNDS
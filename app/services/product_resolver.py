@@ -0,0 +1,127 @@
+import re
+from collections import Counter
+from dataclasses import dataclass
+from typing import Any, Dict, Optional, Sequence
+
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.core import speculation
+from app.core.config import settings
+from app.core.logger import logger
+from app.core.tracing import set_attributes, traced
+from app.core.utils import normalize_persian_text
+from app.db import repository
+
+# Tokens that look like a model code: letters and digits mixed (a546, sm-a546),
+# or a number long enough not to be a size or a capacity (8101).
+_TOKEN_RE = re.compile(r"[0-9a-z]+(?:[-/][0-9a-z]+)*")
+_MODEL_CODE_MIN_DIGITS = 4
+
+# Request words around a product name ("please find ... for me", "what is the price of ...").
+_FILLER_WORDS = {
+    "لطفا", "لطفاً", "من", "برای", "به", "را", "رو", "از", "که", "این", "با", "در", "و", "یک", "یه",
+    "بیابید", "پیدا", "کنید", "کن", "کنم", "می", "میخواهم", "میخوام", "خواهم", "دنبال", "هستم", "میگردم", "گردم",
+    "چقدر", "چند", "است", "هست", "چیه", "چیست", "کجا", "کدام", "میتونید", "تهیه", "بدهید", "بده", "سلام",
+}
+
+PATHS = ("exact_name", "similarity_gap", "model_code", "llm")
+resolution_counts: Counter = Counter({path: 0 for path in PATHS})
+
+
+@dataclass(frozen=True)
+class Resolution:
+    """The product a query resolved to without the LLM, or why it needs the LLM (`path == "llm"`)."""
+
+    key: Optional[str]
+    path: str
+    confidence: float
+    candidates: Sequence[Dict[str, Any]] = ()
+
+
+def model_codes(text: str) -> set:
+    codes = set()
+    for token in _TOKEN_RE.findall(normalize_persian_text(text)):
+        digits = sum(char.isdigit() for char in token)
+        letters = sum(char.isalpha() for char in token)
+        if (digits and letters and len(token) >= 3) or digits >= _MODEL_CODE_MIN_DIGITS:
+            codes.add(token.replace("-", "").replace("/", ""))
+    return codes
+
+
+def guess_product_name(message: str) -> str:
+    """A product name guessed from a message without the LLM: the message minus request filler words."""
+    words = [word for word in normalize_persian_text(message).split() if word not in _FILLER_WORDS]
+    return " ".join(words)
+
+
+def resolve_candidates(queries: Sequence[str], candidates: Sequence[Dict[str, Any]]) -> Resolution:
+    """
+    Decides on trigram-scored candidates ({'id', 'product_name', 'score'}, best
+    first) alone. In order of confidence:
+
+    - exact_name: one candidate whose normalized name equals a normalized query;
+    - similarity_gap: the best score is at least PRODUCT_RESOLVER_MIN_SIMILARITY
+      and leads the runner-up by PRODUCT_RESOLVER_MIN_GAP;
+    - model_code: a model code of the query appears in exactly one candidate's
+      name, and that candidate scores at least PRODUCT_RESOLVER_MODEL_CODE_MIN_SIMILARITY.
+
+    Anything else, including duplicate names, is left to the LLM.
+    """
+    if not candidates:
+        return Resolution(None, "llm", 0.0, candidates)
+    normalized_queries = {normalize_persian_text(query) for query in queries if query}
+
+    exact = [c for c in candidates if normalize_persian_text(c["product_name"] or "") in normalized_queries]
+    if len(exact) == 1:
+        return Resolution(exact[0]["id"], "exact_name", 1.0, candidates)
+    if exact:
+        return Resolution(None, "llm", 0.0, candidates)
+
+    best = candidates[0]["score"]
+    runner_up = candidates[1]["score"] if len(candidates) > 1 else 0.0
+    if best >= settings.PRODUCT_RESOLVER_MIN_SIMILARITY and best - runner_up >= settings.PRODUCT_RESOLVER_MIN_GAP:
+        return Resolution(candidates[0]["id"], "similarity_gap", best, candidates)
+
+    codes = set().union(*(model_codes(query) for query in queries if query))
+    if codes:
+        matching = [c for c in candidates if codes & model_codes(c["product_name"] or "")]
+        if len(matching) == 1 and matching[0]["score"] >= settings.PRODUCT_RESOLVER_MODEL_CODE_MIN_SIMILARITY:
+            return Resolution(matching[0]["id"], "model_code", matching[0]["score"], candidates)
+
+    return Resolution(None, "llm", best, candidates)
+
+
+@traced("resolver.resolve_product")
+async def resolve_product(db: AsyncSession, user_message: str, product_name: Optional[str]) -> Resolution:
+    """
+    Tries to resolve the product a message asks for from the top trigram
+    matches of the extracted product name, before any LLM call. Counts and
+    logs which path decided.
+    """
+    if not settings.PRODUCT_RESOLVER_ENABLED or not product_name:
+        resolution = Resolution(None, "llm", 0.0)
+    else:
+        candidates = await speculation.take("product_candidates", key=product_name)
+        if candidates is None:
+            candidates = await repository.find_similar_products_with_scores(db, product_name, limit=settings.PRODUCT_RESOLVER_CANDIDATES)
+        candidates = candidates[:settings.PRODUCT_RESOLVER_CANDIDATES]
+        resolution = resolve_candidates([product_name, user_message], candidates)
+
+    resolution_counts[resolution.path] += 1
+    set_attributes(path=resolution.path, confidence=round(resolution.confidence, 4))
+    total = sum(resolution_counts.values())
+    fast = total - resolution_counts["llm"]
+    logger.info(
+        f"🎯 Product resolver: {resolution.path} (key={resolution.key}, confidence={resolution.confidence:.3f}); "
+        f"{fast}/{total} resolved without the LLM {dict(resolution_counts)}"
+    )
+    return resolution
+
+
+def render_metrics(metric: str = "product_resolver_resolutions_total") -> str:
+    lines = [
+        f"# HELP {metric} Product lookups by the path that resolved them (llm = needed the LLM).",
+        f"# TYPE {metric} counter",
+    ]
+    lines += [f'{metric}{{path="{path}"}} {count}' for path, count in sorted(resolution_counts.items())]
+    return "\n".join(lines) + "\n"
@@ -8,7 +8,13 @@ from app.core.logger import logger
 from app.services.openai_service import simple_openai_gpt_request_with_tools
 from app.llm.prompts import FIRST_AGENT_PROMPT, SELECT_BEST_MATCH_PROMPT
 from app.llm.tools.definitions import EMBED_FIRST_AGENT_TOOLS, EMBED_FIRST_SCENARIO_TOOLS
-from app.db import repository
+from app.services import product_index, product_resolver
+from app.services.classification_cache import classification_key, get_cached_classification, store_classification
+from app.core.tracing import traced
+from app.core import speculation
+from app.core.config import settings
+from app.services.first_stage import classify_and_select
+from app.services.prefetch import start_prefetches
 
 # Import scenario handlers from their new modules
 from .scenarios import (
@@ -30,6 +36,7 @@ SCENARIO_HANDLERS = {
     "SCENARIO_6_IMAGE_OBJECT_DETECTION": scenario_6_image.handle,
 }
 
+@traced("router.route_chat_request")
 async def route_chat_request(request: ChatRequest, db: AsyncSession, http_request: Request) -> ChatResponse:
     """
     Main router for incoming chat requests.
@@ -43,26 +50,35 @@ async def route_chat_request(request: ChatRequest, db: AsyncSession, http_reques
         http_request.state.scenario = "SCENARIO_6_IMAGE_OBJECT_DETECTION"
         return await SCENARIO_HANDLERS["SCENARIO_6_IMAGE_OBJECT_DETECTION"](request, db)
 
-    if scenario_4_conversational.is_active_session(request.chat_id):
+    if await scenario_4_conversational.is_active_session(request.chat_id):
         http_request.state.scenario = "SCENARIO_4_CONVERSATIONAL_SEARCH"
         return await SCENARIO_HANDLERS["SCENARIO_4_CONVERSATIONAL_SEARCH"](request, db)
 
     # --- Classify the scenario using the LLM ---
-    scenario, possible_product_name = await _classify_scenario_and_extract_product(request)
+    found_key = None
+    start_prefetches(last_message)
+    first = await classify_and_select(last_message, db) if settings.FIRST_STAGE_COMBINED else None
+    if first is not None:
+        scenario, possible_product_name, found_key = first.scenario, first.product_name, first.found_key
+    else:
+        scenario, possible_product_name = await _classify_scenario_and_extract_product(request)
+    speculation.settle(scenario)
     logger.info(f"CLASSIFIED SCENARIO: {scenario}, possible_product_name: {possible_product_name}")
     http_request.state.scenario = scenario
 
-    # --- Find the product if required by the scenario ---
-    found_key = None
+    # --- Find the product if required by the scenario (and not picked during classification) ---
     if scenario in ["SCENARIO_1_DIRECT_SEARCH", "SCENARIO_2_FEATURE_EXTRACTION", "SCENARIO_3_SELLER_INFO"]:
-        found_key = await _find_exact_product_key(last_message, possible_product_name, db)
+        if not found_key:
+            found_key = await _find_exact_product_key(last_message, possible_product_name, db)
         if not found_key:
             raise HTTPException(status_code=404, detail="No products found matching the keywords.")
 
     # --- Route to the appropriate handler ---
     handler = SCENARIO_HANDLERS.get(scenario)
     if handler:
-        if scenario in ["SCENARIO_1_DIRECT_SEARCH", "SCENARIO_2_FEATURE_EXTRACTION", "SCENARIO_3_SELLER_INFO"]:
+        if scenario == "SCENARIO_3_SELLER_INFO":
+            return await handler(request, db, found_key, possible_product_name)
+        elif scenario in ["SCENARIO_1_DIRECT_SEARCH", "SCENARIO_2_FEATURE_EXTRACTION"]:
             return await handler(request, db, found_key)
         else:
             return await handler(request, db)
@@ -71,6 +87,7 @@ async def route_chat_request(request: ChatRequest, db: AsyncSession, http_reques
         return ChatResponse(message="I'm sorry, I didn't understand your request. Could you please try again?")
 
 
+@traced("router.classify_scenario_and_extract_product")
 async def _classify_scenario_and_extract_product(request: ChatRequest) -> Tuple[str, str]:
     """
     Classifies the user's intent into a scenario and extracts the key product name.
@@ -78,6 +95,12 @@ async def _classify_scenario_and_extract_product(request: ChatRequest) -> Tuple[
     system_prompt = FIRST_AGENT_PROMPT.get("main_prompt", "")
     last_message = request.messages[-1].content.strip()
 
+    cache_key = classification_key(last_message, system_prompt, "gpt-4.1-mini", EMBED_FIRST_AGENT_TOOLS)
+    cached = await get_cached_classification(cache_key)
+    if cached:
+        logger.info(f"Classification cache hit: {cached}")
+        return cached
+
     try:
         _, tool_calls = await simple_openai_gpt_request_with_tools(
             message=last_message,
@@ -96,11 +119,13 @@ async def _classify_scenario_and_extract_product(request: ChatRequest) -> Tuple[
                 scenario = parsed_args.get("scenario", "UNCATEGORIZED")
             elif tool_call.function.name == "extract_search":
                 product_name = parsed_args.get("product_name", "")
+        await store_classification(cache_key, scenario, product_name)
         return scenario, product_name
     except Exception as e:
         logger.error(f"Error in scenario classification: {e}", exc_info=True)
         return "UNCATEGORIZED", ""
 
+@traced("router.find_exact_product_key")
 async def _find_exact_product_key(user_message: str, possible_product_name: str, db: AsyncSession) -> str | None:
     """
     Finds the single most accurate product key by first searching for candidates
@@ -109,9 +134,13 @@ async def _find_exact_product_key(user_message: str, possible_product_name: str,
     """
     logger.info(f"Initiating exact product search for: '{possible_product_name}'")
 
+    resolution = await product_resolver.resolve_product(db, user_message, possible_product_name)
+    if resolution.key:
+        return resolution.key
+
     # Initial candidate search
     if possible_product_name:
-        product_names = await repository.find_similar_products(
+        product_names = await product_index.search_products(
             db=db,
             product_name=possible_product_name,
         )
@@ -133,7 +162,7 @@ async def _find_exact_product_key(user_message: str, possible_product_name: str,
 
     # Iteratively handle tool calls if the LLM needs to refine the search
     tools_answer = []
-    for _ in range(5):  # Limit iterations to prevent infinite loops
+    for _ in range(product_index.max_tool_rounds()):  # Limit iterations to prevent infinite loops
         if not tool_calls:
             break
 
@@ -146,7 +175,7 @@ async def _find_exact_product_key(user_message: str, possible_product_name: str,
             
             # This logic assumes the tool is for searching, adjust if other tools are used
             new_possible_name = parsed_arguments.get("product_name")
-            new_product_names = await repository.find_similar_products(db, new_possible_name)
+            new_product_names = await product_index.search_products(db, new_possible_name)
             
             tools_answer.append({"role": "assistant", "tool_calls": [{"id": tool_call.id, "type": "function", "function": {"name": function_name, "arguments": function_arguments}}]})
             tools_answer.append({"role": "tool", "tool_call_id": tool_call.id, "content": str(new_product_names)})
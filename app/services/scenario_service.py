@@ -9,7 +9,7 @@ import json
 
 from app.schemas.state import Scenario4State
 from app.schemas.chat import ChatRequest, ChatResponse
-from app.services.openai_service import simple_openai_gpt_request, simple_openai_gpt_request_with_tools, analyze_image
+from app.services.openai_service import simple_openai_gpt_request, simple_openai_gpt_request_with_tools, analyze_image, get_embeddings_async
 from app.llm.prompts import (FIND_PRODUCT_PROMPTS, FIRST_AGENT_PROMPT, OLD_FIND_PRODUCT_PROMPTS,
     ROUTER_PROMPT, SCENARIO_FIVE_PROMPTS, SCENARIO_FOUR_PROMPTS, SCENARIO_THREE_PROMPTS, SCENARIO_SIX_PROMPTS,
     SCENARIO_TWO_PROMPTS, SELECT_BEST_MATCH_PROMPT)
@@ -21,10 +21,22 @@ from app.llm.tools.handler import ToolHandler
 from app.core.http_client import post_async_request
 from app.core.utils import parse_llm_response_to_number
 from app.db import repository
+from app.services import product_index, product_resolver
+from app.services.session_store import session_store
+from app.services.llm_payload import build_products_payload, dumps_compact, record_prompt, seller_table
+from app.services.seller_aggregation import SELLER_METRICS, SellerColumns, get_aggregation_spec
+from app.services.classification_cache import classification_key, get_cached_classification, store_classification
+from app.core.config import settings
 from app.core.logger import logger
-
-scenario_4_sessions: Dict[str, Scenario4State] = {}
-
+from app.core.dag import TaskGraph, timed_step, timed_steps
+from app.core.streaming import after_code_block
+from app.services.category_index import get_category_index
+from app.services.first_stage import classify_and_select
+from app.core.tracing import traced
+from app.core import speculation
+from app.services.prefetch import start_prefetches
+
+@traced("scenario.check_scenario_one")
 async def check_scenario_one(request: ChatRequest, db: AsyncSession, http_request: Request) -> ChatResponse:
     """
     Check if the request matches Scenario One and process it accordingly.
@@ -42,7 +54,7 @@ async def check_scenario_one(request: ChatRequest, db: AsyncSession, http_reques
             http_request.state.scenario = "SCENARIO_6_IMAGE_OBJECT_DETECTION"
             return await scenario_six(request)
         last_message = request.messages[-1].content.strip()
-        session = scenario_4_sessions.get(chat_id)
+        has_session = await session_store.exists(chat_id)
         # --- Scenario Zero: Sanity Checks ---
         if last_message == "ping":
             response = ChatResponse(message="pong")
@@ -55,17 +67,23 @@ async def check_scenario_one(request: ChatRequest, db: AsyncSession, http_reques
             key = last_message.replace("return member random key:", "").strip()
             response = ChatResponse(member_random_keys=[key])
         
-        elif session:
+        elif has_session:
             scenario = "SCENARIO_4_CONVERSATIONAL_SEARCH"
             response = await scenario_four_in_memory(request, db)
 
         else:
             found_key = None
+            start_prefetches(last_message)
             #with full text search
             # scenario, essential_keywords, descriptive_keywords = await classify_scenario(request)
-            scenario, product_name = await classify_scenario_for_embed(request)
+            first = await classify_and_select(last_message, db) if settings.FIRST_STAGE_COMBINED else None
+            if first is not None:
+                scenario, product_name, found_key = first.scenario, first.product_name, first.found_key
+            else:
+                scenario, product_name = await classify_scenario_for_embed(request)
+            speculation.settle(scenario)
             logger.info(f"CLASSIFIED SCENARIO: {scenario}, product_name: {product_name}")
-            if scenario not in  ["SCENARIO_5_COMPARISON","SCENARIO_4_CONVERSATIONAL_SEARCH"]:
+            if scenario not in  ["SCENARIO_5_COMPARISON","SCENARIO_4_CONVERSATIONAL_SEARCH"] and not found_key:
                 found_key = await find_exact_product_name_service(user_message = request.messages[-1].content.strip(), db=db, possible_product_name=product_name)
             if not found_key and scenario in ["SCENARIO_1_DIRECT_SEARCH", "SCENARIO_2_FEATURE_EXTRACTION", "SCENARIO_3_SELLER_INFO"]:
                 raise HTTPException(status_code=404, detail="No products found matching the keywords.")
@@ -101,7 +119,7 @@ async def check_scenario_one(request: ChatRequest, db: AsyncSession, http_reques
             elif scenario == "SCENARIO_2_FEATURE_EXTRACTION":
                 response = await scenario_two(request, db=db, found_key=found_key)
             elif scenario == "SCENARIO_3_SELLER_INFO":
-                response = await scenario_three(request, db=db, found_key=found_key)
+                response = await scenario_three(request, db=db, found_key=found_key, product_name=product_name)
             elif scenario == "SCENARIO_5_COMPARISON":
                 response = await scenario_five(request, db=db)
         return response
@@ -109,6 +127,7 @@ async def check_scenario_one(request: ChatRequest, db: AsyncSession, http_reques
         logger.error(e,exc_info=True)
 
 
+@traced("scenario.classify_scenario_for_embed")
 async def classify_scenario_for_embed(request: ChatRequest) -> Tuple[str, str]:
     """
     Classifies the user's request into a scenario and extracts keywords using tool calls.
@@ -117,6 +136,12 @@ async def classify_scenario_for_embed(request: ChatRequest) -> Tuple[str, str]:
         system_prompt = FIRST_AGENT_PROMPT.get("main_prompt", "")
         last_message = request.messages[-1].content.strip()
 
+        cache_key = classification_key(last_message, system_prompt, "gpt-4.1-mini", EMBED_FIRST_AGENT_TOOLS)
+        cached = await get_cached_classification(cache_key)
+        if cached:
+            logger.info(f"Classification cache hit: {cached}")
+            return cached
+
         scenario = "UNCATEGORIZED"
         for i in range(4):
             logger.info(f"{i}. try")
@@ -148,6 +173,7 @@ async def classify_scenario_for_embed(request: ChatRequest) -> Tuple[str, str]:
             if scenario != "UNCATEGORIZED":
                 break
 
+        await store_classification(cache_key, scenario, product_name)
         return scenario, product_name
         
     except Exception as e:
@@ -226,6 +252,7 @@ async def old_classify_scenario(request: ChatRequest) -> str:
 #     found_keys = await find_exact_product_name_service(user_message, db)
 #     return ChatResponse(base_random_keys=found_keys)
 
+@traced("scenario.scenario_two")
 async def scenario_two(request: ChatRequest, db: AsyncSession, found_key) -> ChatResponse:
     user_message = request.messages[-1].content.strip()
     logger.info(f"found_key in scenario two:{found_key}")
@@ -238,7 +265,7 @@ async def scenario_two(request: ChatRequest, db: AsyncSession, found_key) -> Cha
                 message=message,
                 systemprompt=system_prompt,
                 model="gpt-4.1",
-                        
+                stream=True,
             )
         
     logger.info(f"llm response:{llm_response}")
@@ -246,116 +273,32 @@ async def scenario_two(request: ChatRequest, db: AsyncSession, found_key) -> Cha
 
 
 async def get_sellers_context(db, random_key):
-    product = await repository.get_product_by_random_key(db, random_key)
+    sellers_context = await repository.get_sellers_context(db, random_key)
 
-    if not product or not product.members:
+    if not sellers_context:
         raise HTTPException(status_code=404, detail=f"No sellers found for product: {random_key}")
-
-    member_keys = product.members
-    member_objects = await repository.get_members_by_keys(db, member_keys)
-
-    if not member_objects:
-        raise HTTPException(status_code=404, detail=f"Seller details could not be found for product: {random_key}")
-
-    shop_ids = [member.shop_id for member in member_objects]
-    shops_with_details = await repository.get_shops_with_details_by_ids(db, list(set(shop_ids)))
-    shop_details_map = {shop.id: shop for shop in shops_with_details}
-
-    member_objects = await repository.get_members_by_keys(db, member_keys)
-
-    if not member_objects:
-        raise HTTPException(status_code=404, detail=f"Seller details could not be found for product: {random_key}")
-
-    shop_ids = [member.shop_id for member in member_objects]
-    shops_with_details = await repository.get_shops_with_details_by_ids(db, list(set(shop_ids)))
-    shop_details_map = {shop.id: shop for shop in shops_with_details}
-
-    sellers_context = []
-    for member in member_objects:
-        shop_info = shop_details_map.get(member.shop_id)
-        if shop_info and shop_info.city:
-            sellers_context.append({
-                "price": member.price,
-                "city": shop_info.city.name,
-                "shop_score": shop_info.score,
-                "has_warranty": shop_info.has_warranty
-            })
     return sellers_context
 
 
-async def scenario_three(request: ChatRequest, db: AsyncSession, found_key) -> ChatResponse:
+@traced("scenario.scenario_three")
+async def scenario_three(request: ChatRequest, db: AsyncSession, found_key, product_name: str = "") -> ChatResponse:
     user_message = request.messages[-1].content.strip()
 
-    product = await repository.get_product_by_random_key(db, found_key)
-
-    if not product or not product.members:
-        raise HTTPException(status_code=404, detail=f"No sellers found for product: {found_key}")
-
-    member_keys = product.members
-    member_objects = await repository.get_members_by_keys(db, member_keys)
-
-    if not member_objects:
-        raise HTTPException(status_code=404, detail=f"Seller details could not be found for product: {found_key}")
-
-    shop_ids = [member.shop_id for member in member_objects]
-    shops_with_details = await repository.get_shops_with_details_by_ids(db, list(set(shop_ids)))
-    shop_details_map = {shop.id: shop for shop in shops_with_details}
-
-    sellers_context = []
-    for member in member_objects:
-        shop_info = shop_details_map.get(member.shop_id)
-        if shop_info and shop_info.city:
-            sellers_context.append({
-                "price": member.price,
-                "city": shop_info.city.name,
-                "shop_score": shop_info.score,
-                "has_warranty": shop_info.has_warranty
-            })
-
-    if not sellers_context:
-         raise HTTPException(status_code=404, detail=f"Could not construct complete seller details for product: {found_key}")
-
-    context_str = json.dumps(sellers_context, ensure_ascii=False, indent=2)
-
-    prompt_template = SCENARIO_THREE_PROMPTS["calculate_prompt"]
-
-    code_generation_prompt = prompt_template.format(
-        user_message=user_message,
-        context_str=context_str
-    )
-    logger.info(f"-> context_str:\n{context_str}")
-
-    llm_response_code = await simple_openai_gpt_request(
-        message='',
-        systemprompt=code_generation_prompt,
-        model="gpt-4.1",
-    )
-
-    if "```python" in llm_response_code:
-        llm_response_code = llm_response_code.split("```python")[1].split("```")[0].strip()
-
-    logger.info(f"-> Generated Python code from LLM:\n{llm_response_code}")
+    # Fetched during classification if the product was the top candidate.
+    sellers_context = await speculation.take("seller_context", key=found_key) or await get_sellers_context(db, found_key)
 
     final_answer = ""
     try:
-
-        local_scope = {}
-        exec(llm_response_code, globals(), local_scope)
-
-        calculator_func = local_scope.get('calculate')
-
-        if callable(calculator_func):
-    
-            result = calculator_func(sellers_context)
-            final_answer = str(result)
-            logger.info(f"-> Calculated result from dynamic code: {final_answer}")
-        else:
-            logger.error("-> 'calculate' function not found or not callable in LLM response.")
-            final_answer = llm_response_code
-            raise HTTPException(status_code=500, detail="Internal error in processing the request.(calculate function error)")
-
+        spec = await get_aggregation_spec(
+            user_message,
+            SCENARIO_THREE_PROMPTS["aggregation_spec_prompt"],
+            product_name=product_name,
+            metrics=SELLER_METRICS,
+        )
+        final_answer = spec.format(spec.evaluate(SellerColumns(sellers_context)))
+        logger.info(f"-> Calculated result from aggregation spec {spec}: {final_answer}")
     except Exception as e:
-        logger.error(f"-> Error executing generated code: {e}", exc_info=True)
+        logger.error(f"-> Error evaluating aggregation spec: {e}", exc_info=True)
 
     return ChatResponse(message=final_answer)
 
@@ -421,21 +364,26 @@ async def scenario_three(request: ChatRequest, db: AsyncSession, found_key) -> C
     
     
     
+@traced("scenario.scenario_four_in_memory")
 async def scenario_four_in_memory(request: ChatRequest, db) -> ChatResponse:
     user_message = request.messages[-1].content.strip()
     chat_id = request.chat_id
 
     response =  "سلام اگه امکانش هست کامل توضیح بدید چی میخواید تا بتونم بهتر کمکتون کنم\nدرباره فروشنده گارانتی یا قیمت"
-    session = scenario_4_sessions.get(chat_id)
-    if not session:
+    session = await session_store.get(chat_id)
+    is_new = not session
+    if is_new:
         session = Scenario4State()
-        scenario_4_sessions[chat_id] = session
     
     session.chat_history.append({"role": "user", "content": user_message})
+    if is_new:
+        # Stored before the state handler runs, so the conversation survives a failing turn.
+        await session_store.save(chat_id, session)
 
     logger.info(f"len(session.chat_history): {len(session.chat_history)}")
     if len(session.chat_history) > 9:
         response, updated_session, is_ok = await scenario_4_emergancy_state(user_message, db, session)
+        await session_store.save(chat_id, session)
         return ChatResponse(member_random_keys=response)
     
     if session.state == 1 or not session.state:
@@ -450,32 +398,62 @@ async def scenario_four_in_memory(request: ChatRequest, db) -> ChatResponse:
         response, updated_session, is_done = await scenario_4_state_4(user_message, db, session)
         session = updated_session
         if is_done:
+            await session_store.save(chat_id, session)
             return ChatResponse(member_random_keys=response)
         
     session = updated_session 
         
     session.chat_history.append({"role": "assistant", "content": response})
-    scenario_4_sessions[chat_id] = session
+    await session_store.save(chat_id, session)
     
     
     return ChatResponse(message=response)
     
     
+@traced("scenario.scenario_4_state_1")
 async def scenario_4_state_1(user_message, db, session: Scenario4State):
     history = session.chat_history
-    assistant_message = await simple_openai_gpt_request(
-        message=user_message,
-        systemprompt=SCENARIO_FOUR_PROMPTS["system_prompt"],
-        model="gpt-4.1-mini",
-        chat_history=history
-    )
-    categories = await repository.get_all_categories(db)
-    chosen_category = await simple_openai_gpt_request(
-        message=user_message,
-        systemprompt=SCENARIO_FOUR_PROMPTS["extract_category"].format(categories=categories),
-        model="gpt-5-mini"
+
+    async def greeting():
+        return await simple_openai_gpt_request(
+            message=user_message,
+            systemprompt=SCENARIO_FOUR_PROMPTS["system_prompt"],
+            model="gpt-4.1-mini",
+            chat_history=history,
+            stream=True
+        )
+
+    async def categories():
+        return await get_category_index()
+
+    async def chosen_category(categories):
+        shortlist = await speculation.take("category_shortlist", key=user_message) or categories.shortlist_for_prompt(user_message)
+        if shortlist.winner:
+            logger.info(f"Category '{shortlist.winner}' chosen locally (score {shortlist.candidates[0].score}).")
+            return shortlist.winner
+        return await simple_openai_gpt_request(
+            message=user_message,
+            systemprompt=SCENARIO_FOUR_PROMPTS["extract_category"].format(categories=shortlist.titles_text),
+            model="gpt-5-mini"
+        )
+
+    async def categorie_sample(categories, chosen_category):
+        return categories.schema(chosen_category)
+
+    # The greeting runs alongside the category chain; categories come from the in-memory index
+    # and only a local shortlist of them is sent to the LLM.
+    graph = (
+        TaskGraph("scenario4_state_1")
+        .add("greeting", greeting)
+        .add("categories", categories)
+        .add("chosen_category", chosen_category, deps=["categories"])
+        .add("categorie_sample", categorie_sample, deps=["categories", "chosen_category"])
     )
-    categorie_sample = await repository.get_category_features_example(db, chosen_category)
+    results = await graph.run()
+    assistant_message = results["greeting"]
+    chosen_category = results["chosen_category"]
+    categorie_sample = results["categorie_sample"]
+
     if chosen_category:
         schema_as_string = json.dumps(categorie_sample, ensure_ascii=False)
         session.product_features = schema_as_string
@@ -486,6 +464,8 @@ async def scenario_4_state_1(user_message, db, session: Scenario4State):
     session.state = 2
     return assistant_message, session
 
+@traced("scenario.scenario_4_state_2")
+@timed_steps("scenario4_state_2")
 async def scenario_4_state_2(user_message, db, session: Scenario4State):
 
     history = session.chat_history
@@ -502,18 +482,19 @@ async def scenario_4_state_2(user_message, db, session: Scenario4State):
     )
     
     
-    llm_response_str = await simple_openai_gpt_request(
+    record_prompt("scenario4_state_2_extract", system_prompt_extract)
+    llm_response_str = await timed_step("extract_filters", simple_openai_gpt_request(
         message="",
         systemprompt=system_prompt_extract,
         model="gpt-4.1-mini",
-    )
+    ))
 
     logger.info(f"\n{llm_response_str}")
     try:
         
         filters_json = parse_llm_json_response(llm_response_str)
         
-        products_with_sellers = await repository.find_products_with_aggregated_sellers_with_features(db, filters_json)
+        products_with_sellers = await timed_step("search", repository.find_products_with_aggregated_sellers_with_features(db, filters_json))
         session.products_with_sellers = products_with_sellers
         logger.info(f"products_with_sellers:\n{str(products_with_sellers)}")
     except (json.JSONDecodeError, IndexError) as e:
@@ -529,7 +510,9 @@ async def scenario_4_state_2(user_message, db, session: Scenario4State):
     navigator_prompt = SCENARIO_FOUR_PROMPTS["state_2_path"]
     input_for_navigator_prompt = {}
     
-    summarized_results = summarize_products_for_llm(products_with_sellers)
+    summarized_results = build_products_payload(
+        products_with_sellers, schema=session.product_features, filters=filters_json, include_sellers=False
+    )
     # PATH A
     if 1 <= len(products_with_sellers) :
         logger.info("Path A: Success, 1-5 results found.")
@@ -557,11 +540,13 @@ async def scenario_4_state_2(user_message, db, session: Scenario4State):
             "chat_history": str(history)
         }
         
-        recovery_response_str = await simple_openai_gpt_request(
-            message=json.dumps(input_for_recovery_query),
+        recovery_message = dumps_compact(input_for_recovery_query)
+        record_prompt("scenario4_state_2_recovery", navigator_prompt, recovery_message)
+        recovery_response_str = await timed_step("recovery_query", simple_openai_gpt_request(
+            message=recovery_message,
             systemprompt=navigator_prompt,
             model="gpt-4.1-mini",
-        )
+        ))
         recovery_response_json = json.loads(recovery_response_str)
         
         new_search_query = recovery_response_json.get("new_search_query")
@@ -575,13 +560,15 @@ async def scenario_4_state_2(user_message, db, session: Scenario4State):
                 "structured_filters": filters_json.get("structured_filters", {})
             }
             
-            second_attempt_products = await repository.find_products_with_aggregated_sellers(db, updated_filters_for_db)
+            second_attempt_products = await timed_step("recovery_search", repository.find_products_with_aggregated_sellers(db, updated_filters_for_db))
             session.products_with_sellers = second_attempt_products
             if 1 <= len(second_attempt_products):
                 logger.info("Path B, Recovery Success: Found results on second attempt.")
                 input_for_navigator_prompt = {
                     "action_mode": "HANDLE_SUCCESSFUL_RESULTS",
-                    "search_results": second_attempt_products,
+                    "search_results": build_products_payload(
+                        second_attempt_products, schema=session.product_features, filters=updated_filters_for_db, include_sellers=False
+                    ),
                     "last_search_parameters": updated_filters_for_db,
                     "chat_history": str(history)
                 }
@@ -611,11 +598,13 @@ async def scenario_4_state_2(user_message, db, session: Scenario4State):
         
         return final_message, session
     logger.info("timer")
-    final_response_str = await simple_openai_gpt_request(
-        message=json.dumps(input_for_navigator_prompt),
+    navigator_message = dumps_compact(input_for_navigator_prompt)
+    record_prompt("scenario4_state_2", navigator_prompt, navigator_message)
+    final_response_str = await timed_step("navigator", simple_openai_gpt_request(
+        message=navigator_message,
         systemprompt=navigator_prompt,
         model="gpt-4.1-mini",
-    )
+    ))
     
     logger.info(f"final_response_str:\n{str(final_response_str)}")
     final_response_json = parse_llm_json_response(final_response_str)
@@ -625,16 +614,8 @@ async def scenario_4_state_2(user_message, db, session: Scenario4State):
     
     return final_message, session
     
-def summarize_products_for_llm(products):
-    summarized_products = []
-    for product in products:
-        summarized_product = {
-            "product_name": product.get("product_name"),
-            "product_features": product.get("product_features"),
-        }
-        summarized_products.append(summarized_product)
-    return summarized_products
-
+@traced("scenario.scenario_4_state_3")
+@timed_steps("scenario4_state_3")
 async def scenario_4_state_3(user_message, db, session: Scenario4State):
     history = session.chat_history
     products_with_sellers = session.products_with_sellers
@@ -643,20 +624,21 @@ async def scenario_4_state_3(user_message, db, session: Scenario4State):
     if not products_with_sellers:
         raise HTTPException(status_code=404, detail="No products found in previous steps.")
     
-    products_without_sellers = [
-    {key: value for key, value in product.items() if key != 'sellers'}
-    for product in products_with_sellers
-]
+    products_without_sellers = build_products_payload(
+        products_with_sellers, schema=session.product_features, filters=filters_json, include_sellers=False
+    )
     system_prompt = SCENARIO_FOUR_PROMPTS["final_recommendation"]
     input_for_selection = {
         "user_response": user_message,
-        "product_options": str(products_without_sellers)
+        "product_options": products_without_sellers
     }
-    llm_response = await simple_openai_gpt_request(
-        message=json.dumps(input_for_selection),
+    selection_message = dumps_compact(input_for_selection)
+    record_prompt("scenario4_state_3", system_prompt, selection_message)
+    llm_response = await timed_step("select_product", simple_openai_gpt_request(
+        message=selection_message,
         systemprompt=system_prompt,
         model="gpt-4.1",
-    )
+    ))
     logger.info(f"llm_response in state 3:\n{str(llm_response)}")
     
     json_from_llm = parse_llm_json_response(llm_response)
@@ -670,24 +652,28 @@ async def scenario_4_state_3(user_message, db, session: Scenario4State):
     selected_product = next((p for p in products_with_sellers if p['product_name'] == selected_product_name), None)
     
     if not selected_product:
-        rkey = await find_exact_product_name_service(user_message = selected_product_name, db=db, possible_product_name=None)
-        selected_product = await repository.get_product_with_sellers_by_base_random_key(db, rkey)
+        rkey = await timed_step("find_product", find_exact_product_name_service(user_message = selected_product_name, db=db, possible_product_name=None))
+        selected_product = await timed_step("product_sellers", repository.get_product_with_sellers_by_base_random_key(db, rkey))
     session.selected_product = selected_product
     session.state = 4
 
     present_sellers_prompt = SCENARIO_FOUR_PROMPTS["present_sellers"].format(
-        product_name=selected_product,
-        sellers_list=json.dumps(selected_product['sellers'], ensure_ascii=False)
+        product_name=selected_product['product_name'],
+        sellers_list=dumps_compact(seller_table(selected_product['sellers']))
     )
+    record_prompt("scenario4_state_3_sellers", present_sellers_prompt)
     
-    response_message = await simple_openai_gpt_request(
+    response_message = await timed_step("present_sellers", simple_openai_gpt_request(
         message="",
         systemprompt=present_sellers_prompt,
-        model="gpt-4.1"
-    )
+        model="gpt-4.1",
+        stream=True
+    ))
 
     return response_message, session
 
+@traced("scenario.scenario_4_state_4")
+@timed_steps("scenario4_state_4")
 async def scenario_4_state_4(user_message, db, session: Scenario4State):
     selected_product = session.selected_product
     if not selected_product:
@@ -696,14 +682,15 @@ async def scenario_4_state_4(user_message, db, session: Scenario4State):
 
     system_prompt = SCENARIO_FOUR_PROMPTS["select_seller"].format(
         user_response=user_message,
-        seller_options=str(selected_product['sellers'])
+        seller_options=dumps_compact(seller_table(selected_product['sellers']))
     )
+    record_prompt("scenario4_state_4", system_prompt)
 
-    llm_response = await simple_openai_gpt_request(
+    llm_response = await timed_step("select_seller", simple_openai_gpt_request(
         message="",
         systemprompt=system_prompt,
         model="gpt-4.1",
-    )
+    ))
     
     json_from_llm = parse_llm_json_response(llm_response)
     selected_member_key = json_from_llm.get("selected_member_key")
@@ -714,6 +701,8 @@ async def scenario_4_state_4(user_message, db, session: Scenario4State):
 
     return [selected_member_key], session, True
 
+@traced("scenario.scenario_4_emergancy_state")
+@timed_steps("scenario4_emergency")
 async def scenario_4_emergancy_state(user_message, db, session):
     history = session.chat_history
     products_with_sellers = session.products_with_sellers
@@ -725,14 +714,18 @@ async def scenario_4_emergancy_state(user_message, db, session):
     system_prompt = SCENARIO_FOUR_PROMPTS["emergancy_response"]
     input_for_selection = {
         "user_response": user_message,
-        "product_options": str(products_with_sellers), # Correct key and data
+        "product_options": build_products_payload(
+            products_with_sellers, schema=session.product_features, filters=filters_json
+        ),
         "chat_history": str(history)
     }
-    llm_response = await simple_openai_gpt_request(
-        message=json.dumps(input_for_selection),
+    selection_message = dumps_compact(input_for_selection)
+    record_prompt("scenario4_emergency", system_prompt, selection_message)
+    llm_response = await timed_step("select_best_seller", simple_openai_gpt_request(
+        message=selection_message,
         systemprompt=system_prompt,
         model="gpt-4.1",
-    )
+    ))
     logger.info(f"llm_response in state 3:\n{str(llm_response)}")
 
     json_from_llm = parse_llm_json_response(llm_response)
@@ -770,6 +763,7 @@ def parse_llm_json_response(response_str: str) -> dict:
         return {}
 
 
+@traced("scenario.scenario_five")
 async def scenario_five(request: ChatRequest, db: AsyncSession) -> ChatResponse:
     user_message = request.messages[-1].content.strip()
     logger.info("Initiating Scenario 5: Product Comparison.")
@@ -780,15 +774,15 @@ async def scenario_five(request: ChatRequest, db: AsyncSession) -> ChatResponse:
         logger.error("Failed to retrieve data for one or both products in comparison.")
         raise HTTPException(status_code=500, detail="Could not process the comparison due to an internal error.")
 
-    first_product, second_product, code_to_get_info = product_data
-    logger.info(f"code_to_get_info type: {type(code_to_get_info)}\ncode_to_get_info:\n{code_to_get_info}")
+    first_product, second_product, aggregation_spec = product_data
+    logger.info(f"aggregation_spec: {aggregation_spec}")
     
     logger.info(f"First product key: {first_product.random_key if first_product else 'None'}")
-    product_1_details = await get_product_detail(db, first_product, code_to_get_info)
+    product_1_details = await get_product_detail(db, first_product, aggregation_spec)
     logger.info(f"product_1_details: {product_1_details}")
     
     logger.info(f"Second product key: {second_product.random_key if second_product else 'None'}")
-    product_2_details = await get_product_detail(db, second_product, code_to_get_info)
+    product_2_details = await get_product_detail(db, second_product, aggregation_spec)
     logger.info(f"product_2_details: {product_2_details}")
 
     comparison_system_prompt = SCENARIO_FIVE_PROMPTS.get("comparison_prompt").format(
@@ -802,7 +796,8 @@ async def scenario_five(request: ChatRequest, db: AsyncSession) -> ChatResponse:
     final_response_text = await simple_openai_gpt_request(
         message="",
         systemprompt=comparison_system_prompt,
-        model="gpt-4.1-mini"
+        model="gpt-4.1-mini",
+        stream=after_code_block
     )
     
     try:
@@ -860,6 +855,7 @@ async def scenario_five(request: ChatRequest, db: AsyncSession) -> ChatResponse:
 #     return ChatResponse(message=object_name)
 
 
+@traced("scenario.scenario_six")
 async def scenario_six(request: ChatRequest) -> ChatResponse:
     """
     Handles Scenario Six: Image-based product search.
@@ -943,32 +939,17 @@ async def scenario_six(request: ChatRequest) -> ChatResponse:
 #     return ChatResponse(message=llm_response)
 
 
-async def get_product_detail(db, product, code_to_get_info):
+@traced("scenario.get_product_detail")
+async def get_product_detail(db, product, aggregation_spec):
     sellers_context = await get_sellers_context(db, product.random_key)
-    logger.info(f"product id:{product.random_key}\ncontext:{str(sellers_context)}\n\ncode_to_get_info:{code_to_get_info}")
+    logger.info(f"product id:{product.random_key}\ncontext:{str(sellers_context)}\n\naggregation_spec:{aggregation_spec}")
+    final_answer = None
     try:
-        logger.info(f"code_to_get_info type: {type(code_to_get_info)}\ncode_to_get_info:\n{code_to_get_info}")
-        local_scope = {}
-        exec(code_to_get_info, globals(), local_scope)
-
-        calculator_func = local_scope.get('calculate')
-        
-
-        if callable(calculator_func):
-    
-            result = calculator_func(sellers_context)
-            if result == None:
-                final_answer = None
-            else:
-                final_answer = str(result)
-            logger.info(f"-> Calculated result from dynamic code: {final_answer}")
-        else:
-            logger.error("-> 'calculate' function not found or not callable in LLM response.")
-            final_answer = code_to_get_info
-            raise HTTPException(status_code=500, detail="Internal error in processing the request.(calculate function error)")
-
+        if aggregation_spec is not None:
+            final_answer = aggregation_spec.describe(SellerColumns(sellers_context))
+            logger.info(f"-> Calculated result from aggregation spec: {final_answer}")
     except Exception as e:
-        logger.error(f"-> Error executing generated code: {e}", exc_info=True)
+        logger.error(f"-> Error evaluating aggregation spec: {e}", exc_info=True)
         
     if final_answer:
         product_details = json.dumps({
@@ -984,11 +965,10 @@ async def get_product_detail(db, product, code_to_get_info):
             "persian_name": product.persian_name,
             "features": product.extra_features or {}
         }, ensure_ascii=False, indent=2)
-        
-    logger
-    
+
     return product_details
 
+@traced("scenario.find_two_product")
 async def find_two_product(user_message, db_session_factory):
     try:
         async with asyncio.TaskGroup() as tg:
@@ -996,15 +976,15 @@ async def find_two_product(user_message, db_session_factory):
             task2 = tg.create_task(find_p_in_fifth_scenario(user_message, 2, db_session_factory))
             # task1 = tg.create_task(find_random_keys(user_message, db_session_factory))
             
-            task3 = tg.create_task(get_calculate_code(user_message))
+            task3 = tg.create_task(get_calculate_spec(user_message))
         
         first_product = task1.result()
         second_product = task2.result()
         # first_product, second_product = task1.result()
         
-        code_to_get_info = task3.result()
+        aggregation_spec = task3.result()
         
-        return (first_product, second_product, code_to_get_info)
+        return (first_product, second_product, aggregation_spec)
 
     except* Exception as eg:
         logger.error("An error occurred in one of the tasks. Details:")
@@ -1101,25 +1081,21 @@ async def find_random_keys(user_message, db_session_factory)->str:
         return product_1, product_2
 
 
-async def get_calculate_code(user_request):
-    system_prompt = SCENARIO_FIVE_PROMPTS.get("calculate_prompt", "").format(
-        user_query=user_request,
-    )
-    llm_response_code = await simple_openai_gpt_request(
-        message='',
-        systemprompt=system_prompt,
-        model="gpt-4.1",
-    )
-    if "```python" in llm_response_code:
-        llm_response_code = llm_response_code.split("```python")[1].split("```")[0].strip()
-
-    logger.info(f"-> Generated Python code from LLM:\n{llm_response_code}")
-    return llm_response_code
+async def get_calculate_spec(user_request):
+    try:
+        return await get_aggregation_spec(user_request, SCENARIO_FIVE_PROMPTS["aggregation_spec_prompt"])
+    except Exception as e:
+        logger.error(f"-> Could not build aggregation spec for comparison: {e}", exc_info=True)
+        return None
     
 
+@traced("scenario.find_exact_product_name_service")
 async def find_exact_product_name_service(user_message: str, db: AsyncSession, possible_product_name: str) -> Optional[str]:
+    resolution = await product_resolver.resolve_product(db, user_message, possible_product_name)
+    if resolution.key:
+        return resolution.key
     if possible_product_name:
-        product_names = await repository.find_similar_products(
+        product_names = await product_index.search_products(
             db=db,
             product_name=possible_product_name,
         )
@@ -1136,7 +1112,7 @@ async def find_exact_product_name_service(user_message: str, db: AsyncSession, p
         tools=EMBED_FIRST_SCENARIO_TOOLS
     )
     tools_answer = []
-    for _ in range(5):
+    for _ in range(product_index.max_tool_rounds()):
         if tool_calls: 
             for tool_call in tool_calls:
                 function_arguments = tool_call.function.arguments
@@ -1144,7 +1120,7 @@ async def find_exact_product_name_service(user_message: str, db: AsyncSession, p
                 parsed_arguments = json.loads(function_arguments)
                 logger.info(f"function_name = {function_name}\nfunction_arguments: {str(function_arguments)}")
                 possible_product_name = parsed_arguments.get("product_name")
-                product_names = await repository.find_similar_products(db, possible_product_name)
+                product_names = await product_index.search_products(db, possible_product_name)
                 tools_answer.append({"role": "assistant", "tool_calls": [{"id": tool_call.id, "type": "function", "function": {"name": function_name, "arguments": function_arguments}}]})
                 tools_answer.append({"role": "tool", "tool_call_id": tool_call.id, "content": str(product_names)})
             llm_response, tool_calls = await simple_openai_gpt_request_with_tools(
@@ -1253,6 +1229,7 @@ async def old_find_exact_product_name_service(user_message: str, db: AsyncSessio
     return found_keys[0] if found_keys else None
 
 
+@traced("scenario.find_exact_product_name_service_and_embed")
 async def find_exact_product_name_service_and_embed(user_message: str, possible_product_name) -> str:
     if possible_product_name:
         product_names = await semantic_search(possible_product_name)
@@ -1329,8 +1306,16 @@ async def search_embed(user_query, keywords):
     return json.dumps(results, ensure_ascii=False)
 
 
+@traced("scenario.semantic_search")
 async def semantic_search(user_query):
-    
+    index = product_index.get_product_index()
+    if index is not None:
+        query_vectors = await get_embeddings_async([user_query], model=index.model, dimensions=index.dimensions)
+        hits = (await asyncio.to_thread(index.search, query_vectors, top_k=10))[0]
+        results = [{"id": key, "product_name": name} for key, name, _ in hits]
+        logger.info(f"local semantic search: query:{user_query}\nresult:{json.dumps(results, ensure_ascii=False)}")
+        return json.dumps(results, ensure_ascii=False)
+
     url = "https://vector-search.darkube.app/semantic-search/"
     payload = {
         "query": user_query,
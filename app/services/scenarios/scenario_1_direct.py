@@ -1,7 +1,9 @@
 from sqlalchemy.ext.asyncio import AsyncSession
 from app.schemas.chat import ChatRequest, ChatResponse
 from app.core.logger import logger
+from app.core.tracing import traced
 
+@traced("scenario_1_direct.handle")
 async def handle(request: ChatRequest, db: AsyncSession, found_key: str) -> ChatResponse:
     """
     Handles Scenario 1: Direct Product Search.
@@ -6,7 +6,9 @@ from app.core.logger import logger
 from app.db import repository
 from app.services.openai_service import simple_openai_gpt_request
 from app.llm.prompts import SCENARIO_TWO_PROMPTS
+from app.core.tracing import traced
 
+@traced("scenario_2_feature.handle")
 async def handle(request: ChatRequest, db: AsyncSession, found_key: str) -> ChatResponse:
     """
     Handles Scenario 2: Feature Extraction.
@@ -49,6 +51,7 @@ async def handle(request: ChatRequest, db: AsyncSession, found_key: str) -> Chat
             message=message_for_llm,
             systemprompt=system_prompt,
             model="gpt-4.1",
+            stream=True,
         )
 
         logger.info(f"LLM response for feature extraction: {llm_response}")
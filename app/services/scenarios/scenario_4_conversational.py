@@ -1,31 +1,34 @@
 import json
 from sqlalchemy.ext.asyncio import AsyncSession
 from fastapi import HTTPException
-from typing import Dict, Tuple, List, Any, Optional
+from typing import Tuple, List, Any, Optional
 
 from app.schemas.chat import ChatResponse
 from app.schemas.state import Scenario4State
+from app.core import speculation
 from app.core.logger import logger
+from app.core.dag import TaskGraph, timed_step, timed_steps
+from app.services.category_index import get_category_index
 from app.db import repository
 from app.services.openai_service import simple_openai_gpt_request
+from app.services.session_store import session_store
+from app.services.llm_payload import build_products_payload, dumps_compact, record_prompt, seller_table
 from app.llm.prompts import SCENARIO_FOUR_PROMPTS
 from .utils import Utils
+from app.core.tracing import traced
 
-# In-memory storage for conversational sessions.
-# For a production application, this should be replaced with a proper cache like Redis.
-_sessions: Dict[str, Scenario4State] = {}
-
-def is_active_session(chat_id: str) -> bool:
+async def is_active_session(chat_id: str) -> bool:
     """Checks if a conversational session is currently active for the given chat_id."""
-    return chat_id in _sessions
+    return await session_store.exists(chat_id)
 
+@traced("scenario_4_conversational.handle")
 async def handle(request, db: AsyncSession) -> ChatResponse:
     """
     Handles Scenario 4: Conversational Search.
 
     This function manages a multi-turn conversation with the user to help them
-    find a product by progressively refining their search criteria. It uses an
-    in-memory state machine to track the conversation's progress.
+    find a product by progressively refining their search criteria. The state
+    machine's progress is kept in the shared session store between turns.
 
     Args:
         chat_id: The ID of the current chat session.
@@ -38,7 +41,7 @@ async def handle(request, db: AsyncSession) -> ChatResponse:
     """
     user_message = request.messages[-1].content.strip()
     chat_id = request.chat_id
-    session = _sessions.get(chat_id, Scenario4State())
+    session = await session_store.get(chat_id) or Scenario4State()
     session.chat_history.append({"role": "user", "content": user_message})
 
     response_message = None
@@ -66,40 +69,65 @@ async def handle(request, db: AsyncSession) -> ChatResponse:
 
         if final_response:
             logger.info(f"Conversational search for chat_id {chat_id} concluded. Cleaning up session.")
-            if chat_id in _sessions:
-                del _sessions[chat_id]
+            await session_store.delete(chat_id)
             return final_response
 
         session.chat_history.append({"role": "assistant", "content": response_message})
-        _sessions[chat_id] = session
+        await session_store.save(chat_id, session)
         return ChatResponse(message=response_message)
 
     except Exception as e:
         logger.error(f"An error occurred in Scenario 4 for chat_id {chat_id}: {e}", exc_info=True)
-        if chat_id in _sessions:
-            del _sessions[chat_id]
+        await session_store.delete(chat_id)
         raise HTTPException(status_code=500, detail="An unexpected error occurred during our conversation. Please start over.")
 
 
+@traced("scenario_4_conversational.state_1")
 async def _handle_state_1(user_message: str, db: AsyncSession, session: Scenario4State) -> Tuple[str, Scenario4State]:
     """State 1: Greet the user, ask clarifying questions, and identify product category."""
     logger.info(f"Scenario 4, State 1 for chat_id: {session.chat_history}")
-    assistant_message = await simple_openai_gpt_request(
-        message=user_message,
-        systemprompt=SCENARIO_FOUR_PROMPTS["system_prompt"],
-        model="gpt-4.1-mini",
-        chat_history=session.chat_history
-    )
 
-    categories = await repository.get_all_categories(db)
-    chosen_category = await simple_openai_gpt_request(
-        message=user_message,
-        systemprompt=SCENARIO_FOUR_PROMPTS["extract_category"].format(categories=categories),
-        model="gpt-5-mini"
+    async def greeting():
+        return await simple_openai_gpt_request(
+            message=user_message,
+            systemprompt=SCENARIO_FOUR_PROMPTS["system_prompt"],
+            model="gpt-4.1-mini",
+            chat_history=session.chat_history,
+            stream=True
+        )
+
+    async def categories():
+        return await get_category_index()
+
+    async def chosen_category(categories):
+        shortlist = await speculation.take("category_shortlist", key=user_message) or categories.shortlist_for_prompt(user_message)
+        if shortlist.winner:
+            logger.info(f"Category '{shortlist.winner}' chosen locally (score {shortlist.candidates[0].score}).")
+            return shortlist.winner
+        return await simple_openai_gpt_request(
+            message=user_message,
+            systemprompt=SCENARIO_FOUR_PROMPTS["extract_category"].format(categories=shortlist.titles_text),
+            model="gpt-5-mini"
+        )
+
+    async def category_sample(categories, chosen_category):
+        return categories.schema(chosen_category)
+
+    # The greeting runs alongside the category chain; categories come from the in-memory index
+    # and only a local shortlist of them is sent to the LLM.
+    graph = (
+        TaskGraph("scenario4_state_1")
+        .add("greeting", greeting)
+        .add("categories", categories)
+        .add("chosen_category", chosen_category, deps=["categories"])
+        .add("category_sample", category_sample, deps=["categories", "chosen_category"])
     )
+    results = await graph.run()
+    assistant_message = results["greeting"]
+    chosen_category = results["chosen_category"]
+    category_sample = results["category_sample"]
 
     if chosen_category:
-        category_sample = await repository.get_category_features_example(db, chosen_category)
         if category_sample:
             schema_as_string = json.dumps(category_sample, ensure_ascii=False)
             session.product_features = schema_as_string
@@ -114,6 +142,8 @@ async def _handle_state_1(user_message: str, db: AsyncSession, session: Scenario
     session.state = 2
     return assistant_message, session
 
+@traced("scenario_4_conversational.state_2")
+@timed_steps("scenario4_state_2")
 async def _handle_state_2(user_message: str, db: AsyncSession, session: Scenario4State) -> Tuple[str, Scenario4State]:
     """State 2: Extract filters, search for products, and handle results."""
     logger.info("Scenario 4, State 2")
@@ -124,10 +154,11 @@ async def _handle_state_2(user_message: str, db: AsyncSession, session: Scenario
         chat_history=history_str,
         feature_schema_json=session.product_features
     )
-    llm_response_str = await simple_openai_gpt_request(message="",
+    record_prompt("scenario4_state_2_extract", system_prompt_extract)
+    llm_response_str = await timed_step("extract_filters", simple_openai_gpt_request(message="",
         systemprompt=system_prompt_extract, 
         model="gpt-4.1"
-    )
+    ))
     
     
     logger.info(f"LLM filter extraction response:\n {llm_response_str}")
@@ -140,7 +171,7 @@ async def _handle_state_2(user_message: str, db: AsyncSession, session: Scenario
         return "I'm having a little trouble understanding the details. Could you please rephrase your requirements?", session
 
     # Find products based on the extracted filters
-    products = await repository.find_products_with_aggregated_sellers_with_features(db, filters_json)
+    products = await timed_step("search", repository.find_products_with_aggregated_sellers_with_features(db, filters_json))
     session.products_with_sellers = products
     logger.info(f"Found {len(products)} products matching the criteria.")
 
@@ -151,7 +182,9 @@ async def _handle_state_2(user_message: str, db: AsyncSession, session: Scenario
         logger.info("Path A: Success, 1-5 results found.")
         input_for_navigator_prompt = {
             "action_mode": "HANDLE_SUCCESSFUL_RESULTS",
-            "search_results": products,
+            "search_results": build_products_payload(
+                products, schema=session.product_features, filters=filters_json, include_sellers=False
+            ),
             "last_search_parameters": filters_json,
             "chat_history": str(history)
         }
@@ -172,11 +205,13 @@ async def _handle_state_2(user_message: str, db: AsyncSession, session: Scenario
             "chat_history": str(history)
         }
         
-        recovery_response_str = await simple_openai_gpt_request(
-            message=json.dumps(input_for_recovery_query),
+        recovery_message = dumps_compact(input_for_recovery_query)
+        record_prompt("scenario4_state_2_recovery", navigator_prompt, recovery_message)
+        recovery_response_str = await timed_step("recovery_query", simple_openai_gpt_request(
+            message=recovery_message,
             systemprompt=navigator_prompt,
             model="gpt-4.1-mini",
-        )
+        ))
         recovery_response_json = json.loads(recovery_response_str)
         
         new_search_query = recovery_response_json.get("new_search_query")
@@ -190,13 +225,15 @@ async def _handle_state_2(user_message: str, db: AsyncSession, session: Scenario
                 "structured_filters": filters_json.get("structured_filters", {})
             }
             
-            second_attempt_products = await repository.find_products_with_aggregated_sellers_with_features(db, updated_filters_for_db)
+            second_attempt_products = await timed_step("recovery_search", repository.find_products_with_aggregated_sellers_with_features(db, updated_filters_for_db))
             session.products_with_sellers = second_attempt_products
             if 1 <= len(second_attempt_products):
                 logger.info("Path B, Recovery Success: Found results on second attempt.")
                 input_for_navigator_prompt = {
                     "action_mode": "HANDLE_SUCCESSFUL_RESULTS",
-                    "search_results": second_attempt_products,
+                    "search_results": build_products_payload(
+                        second_attempt_products, schema=session.product_features, filters=updated_filters_for_db, include_sellers=False
+                    ),
                     "last_search_parameters": updated_filters_for_db,
                     "chat_history": str(history)
                 }
@@ -226,11 +263,13 @@ async def _handle_state_2(user_message: str, db: AsyncSession, session: Scenario
         
         return final_message, session
 
-    final_response_str = await simple_openai_gpt_request(
-        message=json.dumps(input_for_navigator_prompt),
+    navigator_message = dumps_compact(input_for_navigator_prompt)
+    record_prompt("scenario4_state_2", navigator_prompt, navigator_message)
+    final_response_str = await timed_step("navigator", simple_openai_gpt_request(
+        message=navigator_message,
         systemprompt=navigator_prompt,
         model="gpt-4.1-mini",
-    )
+    ))
     
     
     final_response_json = json.loads(final_response_str)
@@ -240,6 +279,8 @@ async def _handle_state_2(user_message: str, db: AsyncSession, session: Scenario
     
     return final_message, session
 
+@traced("scenario_4_conversational.state_3")
+@timed_steps("scenario4_state_3")
 async def _handle_state_3(user_message: str, db, session: Scenario4State) -> Tuple[str, Scenario4State]:
     """State 3: Present product options and ask the user to choose."""
     logger.info(f"Scenario 4, State 3 for chat_id: {session.chat_history}")
@@ -253,13 +294,17 @@ async def _handle_state_3(user_message: str, db, session: Scenario4State) -> Tup
     system_prompt = SCENARIO_FOUR_PROMPTS["final_recommendation"]
     input_for_selection = {
         "user_response": user_message,
-        "product_options": str(products_with_sellers)
+        "product_options": build_products_payload(
+            products_with_sellers, schema=session.product_features, filters=filters_json, include_sellers=False
+        )
     }
-    llm_response = await simple_openai_gpt_request(
-        message=json.dumps(input_for_selection),
+    selection_message = dumps_compact(input_for_selection)
+    record_prompt("scenario4_state_3", system_prompt, selection_message)
+    llm_response = await timed_step("select_product", simple_openai_gpt_request(
+        message=selection_message,
         systemprompt=system_prompt,
         model="gpt-4.1",
-    )
+    ))
     
     json_from_llm = Utils.parse_llm_json_response(llm_response)
     selected_product_name = json_from_llm.get("selected_product_name")
@@ -279,18 +324,22 @@ async def _handle_state_3(user_message: str, db, session: Scenario4State) -> Tup
 
     present_sellers_prompt = SCENARIO_FOUR_PROMPTS["present_sellers"].format(
         product_name=selected_product['product_name'],
-        sellers_list=json.dumps(selected_product['sellers'], ensure_ascii=False)
+        sellers_list=dumps_compact(seller_table(selected_product['sellers']))
     )
+    record_prompt("scenario4_state_3_sellers", present_sellers_prompt)
     
-    response_message = await simple_openai_gpt_request(
+    response_message = await timed_step("present_sellers", simple_openai_gpt_request(
         message="",
         systemprompt=present_sellers_prompt,
-        model="gpt-4.1-mini"
-    )
+        model="gpt-4.1-mini",
+        stream=True
+    ))
 
     return response_message, session
 
 
+@traced("scenario_4_conversational.state_4")
+@timed_steps("scenario4_state_4")
 async def _handle_state_4(user_message: str, session: Scenario4State) -> Tuple[Optional[List[str]], Scenario4State, bool]:
     """State 4: User has chosen a product, now present sellers for final selection."""
     logger.info(f"Scenario 4, State 4 for chat_id: {session.chat_history}")
@@ -301,14 +350,15 @@ async def _handle_state_4(user_message: str, session: Scenario4State) -> Tuple[O
 
     system_prompt = SCENARIO_FOUR_PROMPTS["select_seller"].format(
         user_response=user_message,
-        seller_options=str(selected_product['sellers'])
+        seller_options=dumps_compact(seller_table(selected_product['sellers']))
     )
+    record_prompt("scenario4_state_4", system_prompt)
 
-    llm_response = await simple_openai_gpt_request(
+    llm_response = await timed_step("select_seller", simple_openai_gpt_request(
         message="",
         systemprompt=system_prompt,
         model="gpt-4.1",
-    )
+    ))
     
     json_from_llm = Utils.parse_llm_json_response(llm_response)
     selected_member_key = json_from_llm.get("selected_member_key")
@@ -319,6 +369,8 @@ async def _handle_state_4(user_message: str, session: Scenario4State) -> Tuple[O
 
     return [selected_member_key], session, True
 
+@traced("scenario_4_conversational.emergency_state")
+@timed_steps("scenario4_emergency")
 async def _handle_emergency_state(user_message: str, db: AsyncSession, session: Scenario4State) -> Tuple[Optional[List[str]], Scenario4State]:
     """Emergency State: If conversation is too long, force a selection."""
     logger.warning(f"Handling emergency state for chat: {session.chat_history}")
@@ -332,14 +384,18 @@ async def _handle_emergency_state(user_message: str, db: AsyncSession, session:
     system_prompt = SCENARIO_FOUR_PROMPTS["emergancy_response"]
     input_for_selection = {
         "user_response": user_message,
-        "product_options": str(products_with_sellers), # Correct key and data
+        "product_options": build_products_payload(
+            products_with_sellers, schema=session.product_features, filters=filters_json
+        ),
         "chat_history": str(history)
     }
-    llm_response = await simple_openai_gpt_request(
-        message=json.dumps(input_for_selection),
+    selection_message = dumps_compact(input_for_selection)
+    record_prompt("scenario4_emergency", system_prompt, selection_message)
+    llm_response = await timed_step("select_best_seller", simple_openai_gpt_request(
+        message=selection_message,
         systemprompt=system_prompt,
         model="gpt-5",
-    )
+    ))
     logger.info(f"llm_response in state 3:\n{str(llm_response)}")
 
     json_from_llm = Utils.parse_llm_json_response(llm_response)
@@ -1,24 +1,29 @@
 import json
 import asyncio
+from typing import Optional
 from sqlalchemy.ext.asyncio import AsyncSession
 from fastapi import HTTPException
 
 from app.schemas.chat import ChatRequest, ChatResponse
 from app.core.logger import logger
+from app.core.streaming import after_code_block
 from app.services.openai_service import simple_openai_gpt_request
 from app.llm.prompts import SCENARIO_FIVE_PROMPTS
 from app.db import repository
 from app.db.session import AsyncSessionLocal
+from app.services.seller_aggregation import AggregationSpec, SellerColumns, get_aggregation_spec
 from .utils import Utils
+from app.core.tracing import traced
 
 
+@traced("scenario_5_comparison.handle")
 async def handle(request: ChatRequest, db: AsyncSession) -> ChatResponse:
     """
     Handles Scenario 5: Product Comparison.
 
     This function orchestrates a multi-step process to compare two products:
     1. Identifies the two products from the user's query.
-    2. Generates and executes code to analyze seller data for each.
+    2. Evaluates an LLM-built aggregation spec over the seller data of each.
     3. Uses an LLM to perform the final comparison and select a winner.
 
     Args:
@@ -32,17 +37,17 @@ async def handle(request: ChatRequest, db: AsyncSession) -> ChatResponse:
     user_message = request.messages[-1].content.strip()
 
     try:
-        # Step 1: Concurrently find both products and the analysis code
-        product_1, product_2, analysis_code = await _find_products_and_get_code(user_message, AsyncSessionLocal)
+        # Step 1: Concurrently find both products and the aggregation spec
+        product_1, product_2, aggregation_spec = await _find_products_and_get_spec(user_message, AsyncSessionLocal)
 
         if not product_1 or not product_2:
             raise HTTPException(status_code=404, detail="Could not identify one or both products for comparison.")
 
         logger.info(f"First product key: {product_1.random_key if product_1 else 'None'}")
-        product_1_details = await _get_product_details_for_comparison(db, product_1, analysis_code)
+        product_1_details = await _get_product_details_for_comparison(db, product_1, aggregation_spec)
         logger.info(f"product_1_details: {product_1_details}")
         logger.info(f"Second product key: {product_2.random_key if product_2 else 'None'}")
-        product_2_details = await _get_product_details_for_comparison(db, product_2, analysis_code)
+        product_2_details = await _get_product_details_for_comparison(db, product_2, aggregation_spec)
         logger.info(f"product_2_details: {product_2_details}")
 
         # Step 3: Use LLM for the final comparison
@@ -57,7 +62,8 @@ async def handle(request: ChatRequest, db: AsyncSession) -> ChatResponse:
         final_llm_response = await simple_openai_gpt_request(
             message="",
             systemprompt=comparison_prompt,
-            model="gpt-4.1-mini"
+            model="gpt-4.1-mini",
+            stream=after_code_block
         )
 
         return _parse_final_comparison_response(final_llm_response)
@@ -69,14 +75,14 @@ async def handle(request: ChatRequest, db: AsyncSession) -> ChatResponse:
         raise HTTPException(status_code=500, detail="An internal error occurred during the product comparison.")
 
 
-async def _find_products_and_get_code(user_message: str, db_session_factory):
-    """Concurrently finds two products and generates analysis code from the user's query."""
+async def _find_products_and_get_spec(user_message: str, db_session_factory):
+    """Concurrently finds two products and builds the aggregation spec from the user's query."""
     try:
         # Running tasks in parallel for efficiency
         async with asyncio.TaskGroup() as tg:
             task1 = tg.create_task(_find_single_product_for_comparison(user_message, db_session_factory, "اول"))
             task2 = tg.create_task(_find_single_product_for_comparison(user_message, db_session_factory, "دوم"))
-            task3 = tg.create_task(_get_analysis_code_from_llm(user_message))
+            task3 = tg.create_task(_get_aggregation_spec(user_message))
         
         return task1.result(), task2.result(), task3.result()
     except* Exception as eg:
@@ -98,26 +104,25 @@ async def _find_single_product_for_comparison(user_message: str, db_session_fact
             logger.warning(f"Could not find {index_str}")
         return product
 
-async def _get_analysis_code_from_llm(user_message: str) -> str:
-    """Generates Python code via LLM to analyze seller data based on user's query."""
-    prompt = SCENARIO_FIVE_PROMPTS.get("calculate_prompt", "").format(user_query=user_message)
-    code_response = await simple_openai_gpt_request(message='', systemprompt=prompt, model="gpt-4.1")
-
-    if "```python" in code_response:
-        return code_response.split("```python")[1].split("```")[0].strip()
-    return code_response.strip()
+async def _get_aggregation_spec(user_message: str) -> Optional[AggregationSpec]:
+    """Asks the LLM (or the spec cache) for the seller metric the user is comparing on."""
+    try:
+        return await get_aggregation_spec(user_message, SCENARIO_FIVE_PROMPTS.get("aggregation_spec_prompt", ""))
+    except Exception as e:
+        logger.warning(f"Failed to build aggregation spec for comparison: {e}")
+        return None
 
 
-async def _get_product_details_for_comparison(db: AsyncSession, product: repository.models.BaseProduct, code: str) -> str:
+async def _get_product_details_for_comparison(db: AsyncSession, product: repository.models.BaseProduct, spec: Optional[AggregationSpec]) -> str:
     """Compiles a detailed JSON string for a single product for the final comparison."""
     sellers_context = await Utils.get_sellers_context_by_key(db, product.random_key)
     
     calculated_info = None
-    if code and "return None" not in code:
+    if spec is not None:
         try:
-            calculated_info = Utils.execute_generated_code(code, sellers_context)
+            calculated_info = spec.describe(SellerColumns(sellers_context))
         except Exception as e:
-            logger.warning(f"Failed to execute generated code for product {product.random_key}: {e}")
+            logger.warning(f"Failed to evaluate aggregation spec for product {product.random_key}: {e}")
             calculated_info = "Error in analysis"
     
     details = {
@@ -6,10 +6,12 @@ from app.core.logger import logger
 from app.services.openai_service import analyze_image, simple_openai_gpt_request
 from app.llm.prompts import SCENARIO_SIX_PROMPTS
 from .utils import Utils
+from app.core.tracing import traced
 
 
 
 
+@traced("scenario_6_image.handle")
 async def handle(request: ChatRequest, db: AsyncSession) -> ChatResponse:
     """
     Handles Scenario 6: Image Object Detection.
@@ -5,17 +5,23 @@ from typing import List, Dict, Any, Optional
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from app.db import repository
+from app.services import product_index, product_resolver
 from app.core.logger import logger
+from app.core.http_client import http_client_pool
 from app.llm.prompts import SELECT_BEST_MATCH_PROMPT
 from app.services.openai_service import simple_openai_gpt_request_with_tools
 from app.llm.tools.definitions import EMBED_FIRST_AGENT_TOOLS, EMBED_FIRST_SCENARIO_TOOLS
 
 
 class Utils:
+    @staticmethod
     async def post_async_request(url: str, payload: dict) -> Any:
         """
         Makes an asynchronous POST request to the specified URL with the given payload.
 
+        The request goes through the shared, pooled HTTP client (keep-alive,
+        per-host limits, timeouts and retry with backoff).
+
         Args:
             url: The endpoint URL to send the POST request to.
             payload: The JSON-serializable dictionary to include in the request body.
@@ -28,19 +34,20 @@ class Utils:
         """
 
         try:
-            async with aiohttp.ClientSession() as session:
-                async with session.post(url, json=payload) as response:
-                    if response.status != 200:
-                        logger.error(f"Request to {url} failed with status {response.status}")
-                        raise HTTPException(status_code=response.status, detail="Failed to get a valid response from the server.")
-                    return await response.json()
+            return await http_client_pool.post_json(url, payload)
+        except aiohttp.ClientResponseError as e:
+            logger.error(f"Request to {url} failed with status {e.status}")
+            raise HTTPException(status_code=e.status, detail="Failed to get a valid response from the server.")
         except Exception as e:
             logger.error(f"Error during POST request to {url}: {e}", exc_info=True)
             raise HTTPException(status_code=500, detail="Internal server error during external request.")
     @staticmethod    
     async def find_exact_product_name_service(user_message: str, db: AsyncSession, possible_product_name: str) -> Optional[str]:
+        resolution = await product_resolver.resolve_product(db, user_message, possible_product_name)
+        if resolution.key:
+            return resolution.key
         if possible_product_name:
-            product_names = await repository.find_similar_products(
+            product_names = await product_index.search_products(
                 db=db,
                 product_name=possible_product_name,
             )
@@ -57,7 +64,7 @@ class Utils:
             tools=EMBED_FIRST_SCENARIO_TOOLS
         )
         tools_answer = []
-        for _ in range(5):
+        for _ in range(product_index.max_tool_rounds()):
             if tool_calls: 
                 for tool_call in tool_calls:
                     function_arguments = tool_call.function.arguments
@@ -65,7 +72,7 @@ class Utils:
                     parsed_arguments = json.loads(function_arguments)
                     logger.info(f"function_name = {function_name}\nfunction_arguments: {str(function_arguments)}")
                     possible_product_name = parsed_arguments.get("product_name")
-                    product_names = await repository.find_similar_products(db, possible_product_name)
+                    product_names = await product_index.search_products(db, possible_product_name)
                     tools_answer.append({"role": "assistant", "tool_calls": [{"id": tool_call.id, "type": "function", "function": {"name": function_name, "arguments": function_arguments}}]})
                     tools_answer.append({"role": "tool", "tool_call_id": tool_call.id, "content": str(product_names)})
                 llm_response, tool_calls = await simple_openai_gpt_request_with_tools(
@@ -89,9 +96,8 @@ class Utils:
         """
         Retrieves and compiles a list of seller details for a given product key.
 
-        This function fetches the product's members (listings), their associated shops,
-        and city information, then formats it into a structured list of dictionaries
-        for further processing (e.g., by an LLM).
+        The sellers come from the precomputed 'product_sellers' materialized view
+        (member, shop and city already joined), so this is a single indexed lookup.
 
         Args:
             db: The async database session.
@@ -102,69 +108,18 @@ class Utils:
             with keys like 'price', 'city', 'shop_score', and 'has_warranty'.
 
         Raises:
-            HTTPException: If the product, its members, or seller details cannot be found.
+            HTTPException: If no seller details can be found for the product.
         """
         logger.info(f"Fetching seller context for product_key: {product_key}")
 
-        # Step 1: Find the product to get its member keys
-        product = await repository.get_product_by_random_key(db, product_key)
-        if not product or not product.members:
-            logger.warning(f"No members (sellers) found for product_key: {product_key}")
-            raise HTTPException(status_code=404, detail=f"No sellers found for product: {product_key}")
-
-        # Step 2: Fetch the member objects from the keys
-        member_objects = await repository.get_members_by_keys(db, product.members)
-        if not member_objects:
-            logger.warning(f"Could not find member details for product_key: {product_key}")
-            raise HTTPException(status_code=404, detail=f"Seller details could not be found for product: {product_key}")
-
-        # Step 3: Fetch shop details in a single batch query to avoid N+1 problem
-        shop_ids = list(set(member.shop_id for member in member_objects))
-        shops_with_details = await repository.get_shops_with_details_by_ids(db, shop_ids)
-        shop_details_map = {shop.id: shop for shop in shops_with_details}
-
-        # Step 4: Compile the final context list
-        sellers_context = []
-        for member in member_objects:
-            shop_info = shop_details_map.get(member.shop_id)
-            if shop_info and shop_info.city:
-                sellers_context.append({
-                    "price": member.price,
-                    "city": shop_info.city.name,
-                    "shop_score": shop_info.score,
-                    "has_warranty": shop_info.has_warranty
-                })
-
+        sellers_context = await repository.get_sellers_context(db, product_key)
         if not sellers_context:
-            logger.error(f"Failed to construct complete seller details for product: {product_key}")
-            raise HTTPException(status_code=404, detail=f"Could not construct seller details for product: {product_key}")
+            logger.warning(f"No sellers found for product_key: {product_key}")
+            raise HTTPException(status_code=404, detail=f"No sellers found for product: {product_key}")
 
         logger.info(f"Successfully compiled seller context for {len(sellers_context)} sellers.")
         return sellers_context
 
-    @staticmethod
-    def execute_generated_code(code: str, data: list) -> Any:
-        """
-        Executes the LLM-generated Python code in a restricted scope.
-        """
-        try:
-            local_scope = {}
-            exec(code, globals(), local_scope)
-            
-            calculator_func = local_scope.get('calculate')
-
-            if not callable(calculator_func):
-                logger.error("'calculate' function not found or not callable in LLM-generated code.")
-                raise ValueError("Invalid code generated by the model.")
-
-            return calculator_func(data)
-
-        except Exception as e:
-            logger.error(f"Error executing generated code: {e}", exc_info=True)
-            # This error can be re-raised and caught by the main handler's try-except block
-            raise
-        
-
     @staticmethod
     def parse_llm_json_response(response_str: str) -> Dict[str, Any]:
         """
@@ -0,0 +1,204 @@
+import hashlib
+import json
+from dataclasses import dataclass
+from typing import Any, Collection, Dict, List, Optional
+
+import numpy as np
+
+from app.core.cache import TTLCache
+from app.core.config import settings
+from app.core.logger import logger
+from app.core.utils import normalize_persian_text
+from app.services.openai_service import simple_openai_gpt_request
+
+METRICS = {"count", "min", "max", "avg", "median", "sum", "none"}
+# Scenario 3 questions are always about the sellers; "none" would turn into a false NO_MATCH.
+SELLER_METRICS = METRICS - {"none"}
+FIELDS = {"price", "shop_score"}
+FILTERS = {"city", "has_warranty", "min_shop_score", "max_shop_score", "min_price", "max_price"}
+NO_MATCH = "فروشنده‌ای با این شرایط ندارد"
+
+spec_cache = TTLCache(
+    "aggregation_specs",
+    max_size=settings.AGGREGATION_SPEC_CACHE_SIZE,
+    ttl_seconds=settings.AGGREGATION_SPEC_CACHE_TTL_SECONDS,
+)
+
+
+def _numbers(records: List[Dict[str, Any]], name: str) -> np.ndarray:
+    return np.array([np.nan if r.get(name) is None else r[name] for r in records], dtype=np.float64)
+
+
+class SellerColumns:
+    """The seller context of one product as parallel NumPy columns; a missing price or score is NaN."""
+
+    def __init__(self, records: List[Dict[str, Any]]):
+        self.size = len(records)
+        self.price = _numbers(records, "price")
+        self.shop_score = _numbers(records, "shop_score")
+        self.has_warranty = np.array([bool(r.get("has_warranty")) for r in records], dtype=bool)
+        self.city = np.array([normalize_persian_text(r.get("city") or "") for r in records], dtype=object)
+
+    def column(self, name: str) -> np.ndarray:
+        return getattr(self, name)
+
+
+@dataclass(frozen=True)
+class AggregationSpec:
+    """
+    A validated aggregation over seller rows: filters combined with AND, then
+    one metric over one numeric field. `label` is a short description used
+    when the result is shown next to other data (scenario 5).
+    """
+
+    metric: str
+    field: str = "price"
+    city: Optional[str] = None
+    has_warranty: Optional[bool] = None
+    min_shop_score: Optional[float] = None
+    max_shop_score: Optional[float] = None
+    min_price: Optional[float] = None
+    max_price: Optional[float] = None
+    label: str = ""
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any], metrics: Collection[str] = METRICS) -> "AggregationSpec":
+        """Builds a spec from the LLM's JSON, raising ValueError on anything unknown or a metric outside `metrics`."""
+        if not isinstance(data, dict):
+            raise ValueError("Aggregation spec must be a JSON object.")
+        metric = data.get("metric")
+        if metric not in metrics:
+            raise ValueError(f"Unknown metric: {metric!r}")
+        field = data.get("field") or "price"
+        if field not in FIELDS:
+            raise ValueError(f"Unknown field: {field!r}")
+        filters = data.get("filters") or {}
+        unknown = set(filters) - FILTERS
+        if unknown:
+            raise ValueError(f"Unknown filters: {sorted(unknown)}")
+
+        def number(name):
+            value = filters.get(name)
+            return None if value is None else float(value)
+
+        has_warranty = filters.get("has_warranty")
+        if has_warranty is not None and not isinstance(has_warranty, bool):
+            raise ValueError("has_warranty must be true, false or null.")
+        city = filters.get("city")
+        return cls(
+            metric=metric,
+            field=field,
+            city=normalize_persian_text(city) if city else None,
+            has_warranty=has_warranty,
+            min_shop_score=number("min_shop_score"),
+            max_shop_score=number("max_shop_score"),
+            min_price=number("min_price"),
+            max_price=number("max_price"),
+            label=str(data.get("label") or ""),
+        )
+
+    def mask(self, columns: SellerColumns) -> np.ndarray:
+        mask = np.ones(columns.size, dtype=bool)
+        if self.city is not None:
+            mask &= columns.city == self.city
+        if self.has_warranty is not None:
+            mask &= columns.has_warranty == self.has_warranty
+        if self.min_shop_score is not None:
+            mask &= columns.shop_score >= self.min_shop_score
+        if self.max_shop_score is not None:
+            mask &= columns.shop_score <= self.max_shop_score
+        if self.min_price is not None:
+            mask &= columns.price >= self.min_price
+        if self.max_price is not None:
+            mask &= columns.price <= self.max_price
+        return mask
+
+    def evaluate(self, columns: SellerColumns) -> Optional[float]:
+        """
+        Returns the metric over the matching rows, or None if no row matches
+        (count gives 0). Rows without a value for the field are left out of
+        the other metrics; NaN never passes a numeric filter either.
+        """
+        if self.metric == "none":
+            return None
+        mask = self.mask(columns)
+        if self.metric == "count":
+            return int(mask.sum())
+        column = columns.column(self.field)
+        values = column[mask & ~np.isnan(column)]
+        if values.size == 0:
+            return None
+        if self.metric == "min":
+            return float(values.min())
+        if self.metric == "max":
+            return float(values.max())
+        if self.metric == "avg":
+            return float(values.mean())
+        if self.metric == "median":
+            return float(np.median(values))
+        return float(values.sum())
+
+    def format(self, value: Optional[float]) -> str:
+        """Integers for counts and whole prices, otherwise a float rounded to 2 places; NO_MATCH when no seller matched."""
+        if value is None:
+            return NO_MATCH
+        if float(value).is_integer():
+            return str(int(value))
+        return str(round(value, 2))
+
+    def describe(self, columns: SellerColumns) -> Optional[str]:
+        """The labelled result used in comparisons; None when the question is not about sellers."""
+        if self.metric == "none":
+            return None
+        value = self.evaluate(columns)
+        if value is None:
+            return f"{self.label}: {NO_MATCH}"
+        return f"{self.label}: {self.format(value)}"
+
+
+def question_template(user_message: str, product_name: Optional[str] = None) -> str:
+    """The normalized question with the product name removed, so one spec serves every product."""
+    template = normalize_persian_text(user_message)
+    if isinstance(product_name, str) and product_name:
+        template = template.replace(normalize_persian_text(product_name), "{product}")
+    return template
+
+
+def parse_spec_response(response: str) -> Dict[str, Any]:
+    text = response.strip()
+    if "```" in text:
+        text = text.split("```")[1]
+        if text.startswith("json"):
+            text = text[len("json"):]
+    return json.loads(text.strip())
+
+
+async def get_aggregation_spec(
+    user_message: str,
+    prompt_template: str,
+    product_name: Optional[str] = None,
+    model: str = "gpt-4.1-mini",
+    metrics: Collection[str] = METRICS,
+) -> AggregationSpec:
+    """
+    Asks the LLM to translate the question into an aggregation spec, reusing
+    a compiled spec when the same question template was seen before with
+    the same prompt. A spec whose metric is not in `metrics` raises ValueError.
+    """
+    template = question_template(user_message, product_name)
+    prompt_version = hashlib.sha256(f"{model}\n{prompt_template}".encode("utf-8")).hexdigest()[:16]
+    cache_key = (prompt_version, template)
+    spec = spec_cache.get(cache_key)
+    if spec is not None:
+        logger.info(f"-> Aggregation spec cache hit: {spec}")
+        return spec
+
+    llm_response = await simple_openai_gpt_request(
+        message="",
+        systemprompt=prompt_template.format(user_query=user_message),
+        model=model,
+    )
+    logger.info(f"-> Aggregation spec from LLM:\n{llm_response}")
+    spec = AggregationSpec.from_dict(parse_spec_response(llm_response), metrics=metrics)
+    spec_cache.set(cache_key, spec)
+    return spec
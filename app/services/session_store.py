@@ -0,0 +1,175 @@
+import json
+from abc import ABC, abstractmethod
+from typing import Any, Dict, List, Optional, Tuple
+
+from app.core.cache import TTLCache
+from app.core.config import settings
+from app.core.logger import logger
+from app.schemas.state import Scenario4State
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - orjson is optional
+    orjson = None
+
+# Fields stored one by one, so a turn only rewrites what it changed.
+# chat_history is kept separately as an append-only list.
+STATE_FIELDS = [name for name in Scenario4State.model_fields if name != "chat_history"]
+
+
+def dumps(value: Any) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(value, default=str)
+    return json.dumps(value, ensure_ascii=False, separators=(",", ":"), default=str).encode("utf-8")
+
+
+def loads(data: bytes) -> Any:
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+class SessionStore(ABC):
+    """
+    Persists Scenario4State between turns of a conversation.
+
+    A state is stored as one entry per field plus an append-only list for
+    chat_history. `get` remembers what was read on the state itself, and
+    `save` writes only the fields whose encoding changed and the messages
+    appended since, so the large `products_with_sellers` payload is written
+    once per search instead of on every turn. Backends implement the raw
+    read/write/delete; sessions expire `ttl_seconds` after their last save.
+    """
+
+    def __init__(self, ttl_seconds: int):
+        self.ttl_seconds = ttl_seconds
+
+    @abstractmethod
+    async def _read(self, chat_id: str) -> Optional[Tuple[Dict[str, bytes], List[bytes]]]:
+        """Returns (encoded fields, encoded history) or None if there is no session."""
+
+    @abstractmethod
+    async def _write(self, chat_id: str, fields: Dict[str, bytes], history: List[bytes], replace_history: bool):
+        """Stores `fields`, appends `history` (or replaces it) and refreshes the TTL."""
+
+    @abstractmethod
+    async def delete(self, chat_id: str):
+        ...
+
+    @abstractmethod
+    async def exists(self, chat_id: str) -> bool:
+        ...
+
+    async def get(self, chat_id: str) -> Optional[Scenario4State]:
+        stored = await self._read(chat_id)
+        if stored is None:
+            return None
+        fields, history = stored
+        state = Scenario4State(
+            chat_history=[loads(item) for item in history],
+            **{name: loads(data) for name, data in fields.items() if name in STATE_FIELDS},
+        )
+        state._stored_fields = dict(fields)
+        state._stored_history_len = len(history)
+        return state
+
+    async def save(self, chat_id: str, state: Scenario4State):
+        encoded = {name: dumps(getattr(state, name)) for name in STATE_FIELDS}
+        changed = {name: data for name, data in encoded.items() if state._stored_fields.get(name) != data}
+
+        history = state.chat_history
+        replace_history = len(history) < state._stored_history_len
+        new_messages = history if replace_history else history[state._stored_history_len:]
+
+        # Also called with nothing changed, to refresh the TTL.
+        await self._write(chat_id, changed, [dumps(message) for message in new_messages], replace_history)
+        state._stored_fields = encoded
+        state._stored_history_len = len(history)
+
+
+class InMemorySessionStore(SessionStore):
+    """Process-local backend with LRU eviction; suitable for a single worker."""
+
+    def __init__(self, ttl_seconds: int, max_sessions: int):
+        super().__init__(ttl_seconds)
+        self._cache = TTLCache("scenario4_sessions", max_size=max_sessions, ttl_seconds=ttl_seconds)
+
+    async def _read(self, chat_id: str):
+        entry = self._cache.get(chat_id)
+        if entry is None:
+            return None
+        return dict(entry["fields"]), list(entry["history"])
+
+    async def _write(self, chat_id: str, fields: Dict[str, bytes], history: List[bytes], replace_history: bool):
+        entry = self._cache.get(chat_id) or {"fields": {}, "history": []}
+        entry["fields"].update(fields)
+        entry["history"] = list(history) if replace_history else entry["history"] + history
+        self._cache.set(chat_id, entry)
+
+    async def delete(self, chat_id: str):
+        self._cache.invalidate(chat_id)
+
+    async def exists(self, chat_id: str) -> bool:
+        return chat_id in self._cache
+
+
+class RedisSessionStore(SessionStore):
+    """
+    Shared backend so every worker sees the same conversations. Fields live in
+    the hash `<prefix><chat_id>` and messages in the list `<prefix><chat_id>:history`.
+    `client` may be any object with the redis.asyncio interface; when omitted
+    one is created from `url`.
+    """
+
+    def __init__(self, ttl_seconds: int, url: Optional[str] = None, client: Any = None, prefix: str = "scenario4:"):
+        super().__init__(ttl_seconds)
+        if client is None:
+            import redis.asyncio as redis
+
+            client = redis.from_url(url)
+        self.client = client
+        self.prefix = prefix
+
+    def _keys(self, chat_id: str) -> Tuple[str, str]:
+        key = f"{self.prefix}{chat_id}"
+        return key, f"{key}:history"
+
+    async def _read(self, chat_id: str):
+        key, history_key = self._keys(chat_id)
+        async with self.client.pipeline(transaction=False) as pipe:
+            pipe.hgetall(key)
+            pipe.lrange(history_key, 0, -1)
+            fields, history = await pipe.execute()
+        if not fields:
+            return None
+        fields = {name.decode() if isinstance(name, bytes) else name: data for name, data in fields.items()}
+        return fields, list(history)
+
+    async def _write(self, chat_id: str, fields: Dict[str, bytes], history: List[bytes], replace_history: bool):
+        key, history_key = self._keys(chat_id)
+        async with self.client.pipeline(transaction=True) as pipe:
+            if fields:
+                pipe.hset(key, mapping=fields)
+            if replace_history:
+                pipe.delete(history_key)
+            if history:
+                pipe.rpush(history_key, *history)
+            pipe.expire(key, self.ttl_seconds)
+            pipe.expire(history_key, self.ttl_seconds)
+            await pipe.execute()
+
+    async def delete(self, chat_id: str):
+        await self.client.delete(*self._keys(chat_id))
+
+    async def exists(self, chat_id: str) -> bool:
+        return bool(await self.client.exists(self._keys(chat_id)[0]))
+
+
+def create_session_store() -> SessionStore:
+    if settings.SESSION_STORE_BACKEND == "redis":
+        logger.info(f"Using Redis session store at {settings.SESSION_STORE_REDIS_URL}")
+        return RedisSessionStore(settings.SESSION_TTL_SECONDS, url=settings.SESSION_STORE_REDIS_URL)
+    return InMemorySessionStore(settings.SESSION_TTL_SECONDS, settings.SESSION_STORE_MAX_SESSIONS)
+
+
+session_store = create_session_store()
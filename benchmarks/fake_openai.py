@@ -0,0 +1,295 @@
+"""
+A local OpenAI-compatible server for load tests.
+
+Answers /chat/completions (plain, tool calls and SSE streaming) and
+/embeddings with a configurable latency, so the app can be benchmarked
+without paying for or waiting on the real API. Point the app at it with
+OPENAI_API_BASE=http://127.0.0.1:8100/v1.
+
+The first-agent classification (tool calls or the combined structured
+first stage) is answered from the scenario labels of the replayed traffic
+files, so requests take the same code path they took when recorded.
+Anything else gets the first matching rule of an
+optional rules file (a JSON list of {"match": regex, "content": str,
+"tool_calls": [{"name": str, "arguments": {...}}]}) or the default content.
+
+    python -m benchmarks.fake_openai --port 8100 --latency 0.4 --jitter 0.1
+"""
+import argparse
+import asyncio
+import base64
+import hashlib
+import json
+import random
+import re
+import time
+import uuid
+from dataclasses import dataclass, field
+from typing import Any, Dict, Iterable, List, Optional
+
+import numpy as np
+from aiohttp import web
+
+DEFAULT_TRAFFIC = ["my_tests.json", "logs/request_logs.json"]
+DEFAULT_SCENARIO = "SCENARIO_1_DIRECT_SEARCH"
+CHARS_PER_TOKEN = 4
+STREAM_CHUNK_CHARS = 16
+
+
+@dataclass
+class Rule:
+    pattern: re.Pattern
+    content: Optional[str] = None
+    tool_calls: List[Dict[str, Any]] = field(default_factory=list)
+
+
+@dataclass
+class FakeLLMConfig:
+    latency: float = 0.3
+    jitter: float = 0.0
+    # Delay between streamed chunks.
+    chunk_delay: float = 0.01
+    # Fixed token counts for usage; None estimates them from the text.
+    prompt_tokens: Optional[int] = None
+    completion_tokens: Optional[int] = None
+    content: str = "{}"
+    scenarios: Dict[str, str] = field(default_factory=dict)
+    rules: List[Rule] = field(default_factory=list)
+    seed: int = 0
+
+
+def estimate_tokens(text: str) -> int:
+    return max(1, len(text) // CHARS_PER_TOKEN)
+
+
+def message_text(message: Dict[str, Any]) -> str:
+    content = message.get("content") or ""
+    if isinstance(content, list):
+        return " ".join(part.get("text", "") for part in content if isinstance(part, dict))
+    return str(content)
+
+
+def last_user_message(messages: List[Dict[str, Any]]) -> str:
+    for message in reversed(messages):
+        if message.get("role") == "user":
+            return message_text(message).strip()
+    return ""
+
+
+def load_scenarios(paths: Iterable[str]) -> Dict[str, str]:
+    """Last message -> recorded scenario, from JSON array traffic files (my_tests.json style)."""
+    scenarios = {}
+    for path in paths:
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                records = json.load(f)
+        except (OSError, json.JSONDecodeError):
+            continue
+        for record in records:
+            messages = (record.get("request") or {}).get("messages") or []
+            if record.get("scenario") and messages:
+                scenarios[str(messages[-1].get("content", "")).strip()] = record["scenario"]
+    return scenarios
+
+
+def load_rules(path: Optional[str]) -> List[Rule]:
+    if not path:
+        return []
+    with open(path, "r", encoding="utf-8") as f:
+        return [
+            Rule(re.compile(rule["match"]), rule.get("content"), rule.get("tool_calls") or [])
+            for rule in json.load(f)
+        ]
+
+
+class FakeLLM:
+    """Builds OpenAI-shaped responses for a request body; no I/O, so it can be tested directly."""
+
+    def __init__(self, config: FakeLLMConfig):
+        self.config = config
+        self._random = random.Random(config.seed)
+
+    def delay(self) -> float:
+        return max(0.0, self.config.latency + self._random.uniform(-self.config.jitter, self.config.jitter))
+
+    def _tool_call(self, name: str, arguments: Dict[str, Any]) -> Dict[str, Any]:
+        return {
+            "id": f"call_{uuid.uuid4().hex[:24]}",
+            "type": "function",
+            "function": {"name": name, "arguments": json.dumps(arguments, ensure_ascii=False)},
+        }
+
+    def answer(self, body: Dict[str, Any]):
+        """(content, tool_calls) for a chat completion request."""
+        messages = body.get("messages") or []
+        user_message = last_user_message(messages)
+        tools = {tool.get("function", {}).get("name") for tool in body.get("tools") or []}
+        # Only the first turn of a tool loop gets tool calls, so loops always end.
+        answered_tools = any(message.get("role") == "tool" for message in messages)
+
+        if "classify_user_request" in tools and not answered_tools:
+            calls = [self._tool_call(
+                "classify_user_request",
+                {"scenario": self.config.scenarios.get(user_message, DEFAULT_SCENARIO)},
+            )]
+            if "extract_search" in tools:
+                calls.append(self._tool_call("extract_search", {"product_name": user_message}))
+            return None, calls
+
+        schema = ((body.get("response_format") or {}).get("json_schema") or {}).get("schema") or {}
+        if "scenario" in schema.get("properties", {}):
+            # The combined first-stage call: classify, name the product and leave the pick to the app.
+            answer = {"scenario": self.config.scenarios.get(user_message, DEFAULT_SCENARIO), "product_name": user_message, "product_id": None}
+            return json.dumps(answer, ensure_ascii=False), []
+
+        prompt = "\n".join(message_text(message) for message in messages)
+        for rule in self.config.rules:
+            if rule.pattern.search(prompt):
+                calls = [] if answered_tools else [
+                    self._tool_call(call["name"], call.get("arguments") or {})
+                    for call in rule.tool_calls if call["name"] in tools
+                ]
+                if calls:
+                    return None, calls
+                return rule.content if rule.content is not None else self.config.content, []
+        return self.config.content, []
+
+    def usage(self, body: Dict[str, Any], content: Optional[str], tool_calls: List[Dict[str, Any]]) -> Dict[str, int]:
+        prompt = "\n".join(message_text(message) for message in body.get("messages") or [])
+        if body.get("tools"):
+            prompt += json.dumps(body["tools"], ensure_ascii=False)
+        completion = (content or "") + "".join(call["function"]["arguments"] for call in tool_calls)
+        prompt_tokens = self.config.prompt_tokens or estimate_tokens(prompt)
+        completion_tokens = self.config.completion_tokens or estimate_tokens(completion)
+        return {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens,
+        }
+
+    def completion(self, body: Dict[str, Any]) -> Dict[str, Any]:
+        content, tool_calls = self.answer(body)
+        message: Dict[str, Any] = {"role": "assistant", "content": content}
+        if tool_calls:
+            message["tool_calls"] = tool_calls
+        return {
+            "id": f"chatcmpl-{uuid.uuid4().hex}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": body.get("model", "fake"),
+            "choices": [{
+                "index": 0,
+                "message": message,
+                "finish_reason": "tool_calls" if tool_calls else "stop",
+            }],
+            "usage": self.usage(body, content, tool_calls),
+        }
+
+    def stream_chunks(self, body: Dict[str, Any]) -> List[Dict[str, Any]]:
+        """The chat.completion.chunk objects of a streamed answer (plain content only)."""
+        content, _ = self.answer(body)
+        content = content or ""
+        base = {
+            "id": f"chatcmpl-{uuid.uuid4().hex}",
+            "object": "chat.completion.chunk",
+            "created": int(time.time()),
+            "model": body.get("model", "fake"),
+        }
+        chunks = [{**base, "choices": [{"index": 0, "delta": {"role": "assistant", "content": ""}, "finish_reason": None}]}]
+        for start in range(0, len(content), STREAM_CHUNK_CHARS):
+            piece = content[start:start + STREAM_CHUNK_CHARS]
+            chunks.append({**base, "choices": [{"index": 0, "delta": {"content": piece}, "finish_reason": None}]})
+        chunks.append({**base, "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}]})
+        if (body.get("stream_options") or {}).get("include_usage"):
+            chunks.append({**base, "choices": [], "usage": self.usage(body, content, [])})
+        return chunks
+
+    def embeddings(self, body: Dict[str, Any]) -> Dict[str, Any]:
+        """Deterministic unit vectors seeded by each input's hash, so equal texts embed equally."""
+        inputs = body.get("input") or []
+        if isinstance(inputs, str):
+            inputs = [inputs]
+        dimensions = int(body.get("dimensions") or 512)
+        data = []
+        for i, text in enumerate(inputs):
+            seed = int.from_bytes(hashlib.sha256(str(text).encode("utf-8")).digest()[:8], "little")
+            vector = np.random.default_rng(seed).standard_normal(dimensions).astype(np.float32)
+            vector /= np.linalg.norm(vector)
+            if body.get("encoding_format") == "base64":
+                embedding: Any = base64.b64encode(vector.tobytes()).decode("ascii")
+            else:
+                embedding = vector.tolist()
+            data.append({"object": "embedding", "index": i, "embedding": embedding})
+        tokens = sum(estimate_tokens(str(text)) for text in inputs)
+        return {
+            "object": "list",
+            "data": data,
+            "model": body.get("model", "fake"),
+            "usage": {"prompt_tokens": tokens, "total_tokens": tokens},
+        }
+
+
+def create_app(llm: FakeLLM) -> web.Application:
+    stats = {"chat": 0, "embeddings": 0}
+
+    async def chat_completions(request: web.Request) -> web.StreamResponse:
+        body = await request.json()
+        stats["chat"] += 1
+        await asyncio.sleep(llm.delay())
+        if not body.get("stream"):
+            return web.json_response(llm.completion(body))
+
+        response = web.StreamResponse(headers={"Content-Type": "text/event-stream", "Cache-Control": "no-cache"})
+        await response.prepare(request)
+        for chunk in llm.stream_chunks(body):
+            await response.write(f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n".encode("utf-8"))
+            await asyncio.sleep(llm.config.chunk_delay)
+        await response.write(b"data: [DONE]\n\n")
+        await response.write_eof()
+        return response
+
+    async def embeddings(request: web.Request) -> web.Response:
+        body = await request.json()
+        stats["embeddings"] += 1
+        await asyncio.sleep(llm.delay())
+        return web.json_response(llm.embeddings(body))
+
+    async def get_stats(request: web.Request) -> web.Response:
+        return web.json_response(stats)
+
+    app = web.Application(client_max_size=32 * 1024 * 1024)
+    for prefix in ("", "/v1"):
+        app.router.add_post(f"{prefix}/chat/completions", chat_completions)
+        app.router.add_post(f"{prefix}/embeddings", embeddings)
+    app.router.add_get("/stats", get_stats)
+    return app
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve a fake OpenAI-compatible API for load tests.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8100)
+    parser.add_argument("--latency", type=float, default=0.3, help="Seconds before each response (time to first token).")
+    parser.add_argument("--jitter", type=float, default=0.0, help="Uniform +/- seconds added to the latency.")
+    parser.add_argument("--chunk-delay", type=float, default=0.01, help="Seconds between streamed chunks.")
+    parser.add_argument("--prompt-tokens", type=int, help="Report this many prompt tokens instead of an estimate.")
+    parser.add_argument("--completion-tokens", type=int, help="Report this many completion tokens instead of an estimate.")
+    parser.add_argument("--content", default="{}", help="Answer for requests no rule matches.")
+    parser.add_argument("--rules", help="JSON file of {match, content, tool_calls} rules.")
+    parser.add_argument("--traffic", nargs="*", default=DEFAULT_TRAFFIC, help="Files with the scenario labels of replayed messages.")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    config = FakeLLMConfig(
+        latency=args.latency,
+        jitter=args.jitter,
+        chunk_delay=args.chunk_delay,
+        prompt_tokens=args.prompt_tokens,
+        completion_tokens=args.completion_tokens,
+        content=args.content,
+        scenarios=load_scenarios(args.traffic),
+        rules=load_rules(args.rules),
+        seed=args.seed,
+    )
+    print(f"Fake OpenAI API on http://{args.host}:{args.port}/v1 ({len(config.scenarios)} labelled messages)")
+    web.run_app(create_app(FakeLLM(config)), host=args.host, port=args.port, print=None)
@@ -0,0 +1,237 @@
+"""
+Replays recorded chat traffic against a running app and reports latency.
+
+Conversations from the traffic files (my_tests.json, logs/request_logs.json
+or any JSONL request log) are replayed at a fixed concurrency. Each replay
+gets fresh chat ids, and the turns of one conversation are sent in order.
+The report has per-scenario throughput and latency percentiles. It also has
+DB query counts, LLM calls and prompt tokens, read from the records the app
+wrote to its request log for these chat ids. For reproducible numbers, run
+the app against benchmarks/fake_openai.py and a database seeded by
+benchmarks/seed_db.py.
+
+    python -m benchmarks.run_load --url http://127.0.0.1:8000 --concurrency 16 --repeat 5
+"""
+import argparse
+import asyncio
+import json
+import math
+import time
+import uuid
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional
+
+import aiohttp
+
+from app.core.config import settings
+from app.core.json_logger import read_log_records
+from benchmarks.fake_openai import DEFAULT_TRAFFIC
+
+UNLABELLED = "UNLABELLED"
+
+
+@dataclass
+class Turn:
+    scenario: str
+    messages: List[Dict[str, Any]]
+
+
+@dataclass
+class Result:
+    scenario: str
+    chat_id: str
+    status: int
+    latency: float
+    first_token: Optional[float] = None
+    error: Optional[str] = None
+    log: Dict[str, Any] = field(default_factory=dict)
+
+
+def load_conversations(paths: Iterable[str]) -> List[List[Turn]]:
+    """Recorded requests grouped by chat id, turns in recorded order."""
+    conversations: Dict[str, List[Turn]] = {}
+    for path in paths:
+        for record in read_log_records(Path(path)):
+            request = record.get("request") or {}
+            if not request.get("messages"):
+                continue
+            chat_id = request.get("chat_id") or uuid.uuid4().hex
+            conversations.setdefault(chat_id, []).append(Turn(record.get("scenario") or UNLABELLED, request["messages"]))
+    return list(conversations.values())
+
+
+def percentile(values: List[float], q: float) -> Optional[float]:
+    """The q-th percentile (0-100) with linear interpolation between ranks."""
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = (len(ordered) - 1) * q / 100
+    low, high = math.floor(rank), math.ceil(rank)
+    return ordered[low] + (ordered[high] - ordered[low]) * (rank - low)
+
+
+async def send_turn(session: aiohttp.ClientSession, url: str, chat_id: str, turn: Turn, stream: bool) -> Result:
+    payload = {"chat_id": chat_id, "messages": turn.messages}
+    started = time.perf_counter()
+    first_token = None
+    try:
+        async with session.post(f"{url}/chat/stream" if stream else f"{url}/chat", json=payload) as response:
+            if stream:
+                async for line in response.content:
+                    if first_token is None and b'"token"' in line:
+                        first_token = time.perf_counter() - started
+            else:
+                await response.read()
+            error = None if response.status == 200 else f"HTTP {response.status}"
+            status = response.status
+    except Exception as e:
+        status, error = 0, f"{type(e).__name__}: {e}"
+    return Result(turn.scenario, chat_id, status, time.perf_counter() - started, first_token, error)
+
+
+async def replay(url: str, conversations: List[List[Turn]], concurrency: int, repeat: int, stream: bool, timeout: float):
+    """Runs every conversation `repeat` times with `concurrency` workers; returns (results, wall seconds)."""
+    run_id = uuid.uuid4().hex[:8]
+    queue: asyncio.Queue = asyncio.Queue()
+    for round_number in range(repeat):
+        for number, conversation in enumerate(conversations):
+            queue.put_nowait((f"bench-{run_id}-{round_number}-{number}", conversation))
+    results: List[Result] = []
+
+    async def worker(session: aiohttp.ClientSession):
+        while not queue.empty():
+            chat_id, conversation = queue.get_nowait()
+            for turn in conversation:
+                results.append(await send_turn(session, url, chat_id, turn, stream))
+
+    connector = aiohttp.TCPConnector(limit=concurrency)
+    async with aiohttp.ClientSession(connector=connector, timeout=aiohttp.ClientTimeout(total=timeout)) as session:
+        started = time.perf_counter()
+        await asyncio.gather(*(worker(session) for _ in range(concurrency)))
+        return results, time.perf_counter() - started
+
+
+def attach_log_records(results: List[Result], log_path: Optional[str] = None):
+    """Matches each result to the request log record of its chat id (turns in order)."""
+    records: Dict[str, List[Dict[str, Any]]] = {}
+    wanted = {result.chat_id for result in results}
+    for record in read_log_records(Path(log_path) if log_path else None):
+        chat_id = (record.get("request") or {}).get("chat_id")
+        if chat_id in wanted:
+            records.setdefault(chat_id, []).append(record)
+    for result in results:
+        pending = records.get(result.chat_id)
+        if pending:
+            result.log = pending.pop(0)
+
+
+def _usage(result: Result) -> Dict[str, float]:
+    trace = result.log.get("trace") or {}
+    usage = result.log.get("openai_usage") or {}
+    return {
+        "db_queries": trace.get("db_queries"),
+        "llm_calls": trace.get("llm_calls", sum(model.get("calls", 0) for model in usage.values()) if usage else None),
+        "prompt_tokens": trace.get("prompt_tokens", sum(model.get("input_tokens", 0) for model in usage.values()) if usage else None),
+        "completion_tokens": trace.get("completion_tokens", sum(model.get("output_tokens", 0) for model in usage.values()) if usage else None),
+    }
+
+
+def _mean(values: List[float]) -> Optional[float]:
+    return round(sum(values) / len(values), 2) if values else None
+
+
+def summarize(results: List[Result], wall_seconds: float) -> Dict[str, Any]:
+    """Per-scenario (and overall) throughput, latency percentiles and per-request DB/LLM usage."""
+    groups: Dict[str, List[Result]] = {"ALL": list(results)}
+    for result in results:
+        groups.setdefault(result.scenario, []).append(result)
+
+    report = {}
+    for scenario, group in groups.items():
+        ok = [result for result in group if result.error is None]
+        latencies = [result.latency for result in ok]
+        first_tokens = [result.first_token for result in ok if result.first_token is not None]
+        usages = [_usage(result) for result in ok if result.log]
+        summary = {
+            "requests": len(group),
+            "errors": len(group) - len(ok),
+            "throughput_rps": round(len(ok) / wall_seconds, 2) if wall_seconds else None,
+            "latency_ms": {
+                name: round(value * 1000, 1) if value is not None else None
+                for name, value in (
+                    ("p50", percentile(latencies, 50)),
+                    ("p90", percentile(latencies, 90)),
+                    ("p99", percentile(latencies, 99)),
+                    ("max", max(latencies, default=None)),
+                )
+            },
+            "logged_requests": len(usages),
+        }
+        if first_tokens:
+            summary["first_token_ms_p50"] = round(percentile(first_tokens, 50) * 1000, 1)
+        for name in ("db_queries", "llm_calls", "prompt_tokens", "completion_tokens"):
+            values = [usage[name] for usage in usages if usage[name] is not None]
+            summary[f"{name}_per_request"] = _mean(values)
+        summary["prompt_tokens_total"] = sum(usage["prompt_tokens"] or 0 for usage in usages)
+        report[scenario] = summary
+    return report
+
+
+REPORT_COLUMNS = [
+    ("req", lambda s: s["requests"]),
+    ("err", lambda s: s["errors"]),
+    ("rps", lambda s: s["throughput_rps"]),
+    ("p50 ms", lambda s: s["latency_ms"]["p50"]),
+    ("p90 ms", lambda s: s["latency_ms"]["p90"]),
+    ("p99 ms", lambda s: s["latency_ms"]["p99"]),
+    ("db/req", lambda s: s["db_queries_per_request"]),
+    ("llm/req", lambda s: s["llm_calls_per_request"]),
+    ("ptok/req", lambda s: s["prompt_tokens_per_request"]),
+]
+
+
+def print_report(report: Dict[str, Any]):
+    print(f"{'scenario':<36}" + "".join(f"{name:>10}" for name, _ in REPORT_COLUMNS))
+    for scenario, summary in sorted(report.items(), key=lambda item: (item[0] != "ALL", item[0])):
+        values = [value(summary) for _, value in REPORT_COLUMNS]
+        print(f"{scenario:<36}" + "".join(f"{'-' if value is None else value:>10}" for value in values))
+
+
+async def main(args):
+    conversations = load_conversations(args.traffic)
+    if args.scenario:
+        conversations = [c for c in conversations if any(turn.scenario in args.scenario for turn in c)]
+    print(f"Replaying {len(conversations)} conversations x{args.repeat} at concurrency {args.concurrency} against {args.url}")
+    results, wall_seconds = await replay(args.url, conversations, args.concurrency, args.repeat, args.stream, args.timeout)
+
+    # The app's request log is written by a background thread; give it a flush interval.
+    await asyncio.sleep(settings.REQUEST_LOG_FLUSH_INTERVAL + 0.5)
+    attach_log_records(results, args.log)
+    report = {
+        "url": args.url,
+        "concurrency": args.concurrency,
+        "repeat": args.repeat,
+        "stream": args.stream,
+        "wall_seconds": round(wall_seconds, 2),
+        "scenarios": summarize(results, wall_seconds),
+    }
+    print_report(report["scenarios"])
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"Report written to {args.output}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Replay recorded chat traffic and report latency per scenario.")
+    parser.add_argument("--url", default="http://127.0.0.1:8000", help="Base URL of the running app.")
+    parser.add_argument("--traffic", nargs="*", default=DEFAULT_TRAFFIC, help="JSON array or JSONL request log files.")
+    parser.add_argument("--scenario", nargs="*", help="Only replay conversations with these scenario labels.")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--repeat", type=int, default=1, help="How many times the traffic is replayed.")
+    parser.add_argument("--stream", action="store_true", help="Use /chat/stream and also report time to first token.")
+    parser.add_argument("--timeout", type=float, default=60.0, help="Per-request timeout in seconds.")
+    parser.add_argument("--log", help="The app's request log, if it is not at REQUEST_LOG_FILE.")
+    parser.add_argument("--output", help="Write the JSON report here.")
+    asyncio.run(main(parser.parse_args()))
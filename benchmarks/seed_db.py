@@ -0,0 +1,171 @@
+"""
+Seeds a PostgreSQL database with a synthetic catalog for load tests.
+
+Products named after the messages in the replayed traffic (keyed by the
+random keys their recorded responses returned) are mixed with generated
+filler products, shops, members, categories, brands and cities. The same
+seed always produces the same catalog. Tables are written as parquet files
+and loaded with the regular COPY loader, so the fixture matches what
+scripts/data_loader.py would build. Destroys existing catalog data.
+
+    python -m benchmarks.seed_db --products 20000 --seed 7
+"""
+import argparse
+import json
+import os
+import random
+import string
+from typing import Any, Dict, Iterable, List
+
+import pandas as pd
+from sqlalchemy import text
+
+from app.core.logger import logger
+from app.db.models import Base
+from benchmarks.fake_openai import DEFAULT_TRAFFIC
+from scripts.data_loader import (
+    build_product_sellers_view,
+    build_product_vector_index,
+    bulk_load_model_tables,
+    create_schema,
+    drop_product_sellers_view,
+    get_db_engine,
+    notify_cache_invalidation,
+    orm_tables,
+)
+
+FIXTURE_DIR = "./benchmarks/fixture"
+
+CITIES = ["تهران", "مشهد", "اصفهان", "شیراز", "تبریز", "کرج", "اهواز", "قم"]
+CATEGORIES = ["فرش", "پکیج دیواری", "یخچال و فریزر", "گوشی موبایل", "لپ تاپ", "کفش ورزشی", "ساعت مچی", "قهوه ساز"]
+BRANDS = ["سامسونگ", "ال جی", "بوش", "ایرانی", "شیائومی", "اپل", "لورچ", "نایکی"]
+WORDS = ["مدل", "طرح", "سایز", "رنگ", "سفید", "مشکی", "آبی", "بزرگ", "کوچک", "پلاس", "پرو", "ضد آب", "دیجیتال"]
+
+
+def _random_key(rng: random.Random, length: int = 6) -> str:
+    return "".join(rng.choices(string.ascii_lowercase, k=length))
+
+
+def traffic_products(paths: Iterable[str]) -> Dict[str, str]:
+    """random_key -> name for every product a recorded response returned, named after its message."""
+    products = {}
+    for path in paths:
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                records = json.load(f)
+        except (OSError, json.JSONDecodeError):
+            continue
+        for record in records:
+            messages = (record.get("request") or {}).get("messages") or []
+            keys = (record.get("response") or {}).get("base_random_keys") or []
+            if messages and keys:
+                for key in keys:
+                    products.setdefault(key, str(messages[-1].get("content", "")).strip())
+    return products
+
+
+def generate_catalog(seeded_products: Dict[str, str], products: int, shops: int, members_per_product: int, seed: int) -> Dict[str, pd.DataFrame]:
+    """Data frames for every catalog table, deterministic for a given seed."""
+    rng = random.Random(seed)
+    cities = pd.DataFrame({"id": range(1, len(CITIES) + 1), "name": CITIES})
+    brands = pd.DataFrame({"id": range(1, len(BRANDS) + 1), "title": BRANDS})
+    categories = pd.DataFrame({
+        "id": range(1, len(CATEGORIES) + 1),
+        "title": CATEGORIES,
+        "parent_id": pd.array([None] * len(CATEGORIES), dtype="Int64"),
+        "features_example": [json.dumps({"رنگ": "سفید", "ابعاد": "۱۲۰×۸۰"}, ensure_ascii=False)] * len(CATEGORIES),
+    })
+    shop_rows = pd.DataFrame({
+        "id": range(1, shops + 1),
+        "city_id": [rng.randint(1, len(CITIES)) for _ in range(shops)],
+        "score": [round(rng.uniform(1, 5), 1) for _ in range(shops)],
+        "has_warranty": [rng.random() < 0.5 for _ in range(shops)],
+    })
+
+    names = dict(seeded_products)
+    while len(names) < max(products, len(seeded_products)):
+        key = _random_key(rng)
+        if key not in names:
+            category, brand = rng.choice(CATEGORIES), rng.choice(BRANDS)
+            names[key] = f"{category} {brand} {' '.join(rng.sample(WORDS, 3))} {rng.randint(100, 9999)}"
+
+    product_rows: List[Dict[str, Any]] = []
+    member_rows: List[Dict[str, Any]] = []
+    for key, name in names.items():
+        member_keys = []
+        for _ in range(rng.randint(1, members_per_product)):
+            member_key = _random_key(rng, 8)
+            member_keys.append(member_key)
+            member_rows.append({
+                "random_key": member_key,
+                "shop_id": rng.randint(1, shops),
+                "price": rng.randint(10, 5000) * 10000,
+                "base_random_key": key,
+            })
+        product_rows.append({
+            "image_url": None,
+            "random_key": key,
+            "category_id": rng.randint(1, len(CATEGORIES)),
+            "brand_id": rng.randint(1, len(BRANDS)),
+            "english_name": None,
+            "persian_name": name,
+            "extra_features": json.dumps({"رنگ": rng.choice(WORDS)}, ensure_ascii=False),
+            "members": json.dumps(member_keys),
+        })
+
+    return {
+        "cities": cities,
+        "brands": brands,
+        "categories": categories,
+        "shops": shop_rows,
+        "base_products": pd.DataFrame(product_rows),
+        "members": pd.DataFrame(member_rows).drop_duplicates("random_key"),
+    }
+
+
+def write_fixture(frames: Dict[str, pd.DataFrame], directory: str = FIXTURE_DIR) -> Dict[str, str]:
+    os.makedirs(directory, exist_ok=True)
+    files = {}
+    for name, frame in frames.items():
+        files[name] = os.path.join(directory, f"{name}.parquet")
+        frame.to_parquet(files[name], index=False)
+    return files
+
+
+def reset_catalog(engine):
+    """Drops the product_sellers view and every model table, then recreates the empty schema."""
+    drop_product_sellers_view(engine)
+    with engine.begin() as conn:
+        for name in reversed(list(orm_tables())):
+            conn.execute(text(f'DROP TABLE IF EXISTS "{name}" CASCADE'))
+    create_schema(engine)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Seed the database with a synthetic catalog for load tests.")
+    parser.add_argument("--products", type=int, default=10000, help="Total base products, traffic products included.")
+    parser.add_argument("--shops", type=int, default=500)
+    parser.add_argument("--members-per-product", type=int, default=5, help="Upper bound of listings per product.")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--traffic", nargs="*", default=DEFAULT_TRAFFIC)
+    parser.add_argument("--out", default=FIXTURE_DIR, help="Directory for the generated parquet files.")
+    parser.add_argument("--vectors", action="store_true", help="Also build the product vector index (calls the embeddings API).")
+    args = parser.parse_args()
+
+    frames = generate_catalog(traffic_products(args.traffic), args.products, args.shops, args.members_per_product, args.seed)
+    files = write_fixture(frames, args.out)
+    logger.info(f"Generated fixture in '{args.out}': {', '.join(f'{name}={len(frame)}' for name, frame in frames.items())}")
+
+    engine = get_db_engine()
+    if engine:
+        reset_catalog(engine)
+        loaded = bulk_load_model_tables(files)
+        build_product_sellers_view(engine)
+        if args.vectors:
+            build_product_vector_index(engine)
+        engine.dispose()
+        missing = set(Base.metadata.tables) & set(files) - set(loaded)
+        if missing:
+            logger.error(f"❌ Fixture tables failed to load: {sorted(missing)}")
+        notify_cache_invalidation()
+        logger.info(f"✅ Seeded {len(loaded)} tables.")
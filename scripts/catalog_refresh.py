@@ -0,0 +1,217 @@
+import json
+import multiprocessing
+import os
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from dataclasses import dataclass, field
+from typing import Dict, List, Set
+
+from sqlalchemy import Table, text
+
+from app.core.config import settings
+from app.core.logger import logger
+from app.db.models import Base
+from scripts.copy_loader import copy_to_shadow, load_levels, log_copy_stats, shadow_table_name
+
+# Tables whose changes affect the product_sellers view, and how to find the
+# base products (the view's cache key) touched by a changed row.
+SELLER_KEY_QUERIES = {
+    "members": 'SELECT DISTINCT base_random_key FROM "{table}" WHERE random_key = ANY(:keys)',
+    "shops": 'SELECT DISTINCT base_random_key FROM members WHERE shop_id = ANY(:keys)',
+}
+
+
+@dataclass
+class TableChanges:
+    table: str
+    inserted: List = field(default_factory=list)
+    updated: List = field(default_factory=list)
+    deleted: List = field(default_factory=list)
+
+    @property
+    def keys(self) -> List:
+        return self.inserted + self.updated + self.deleted
+
+    def __bool__(self) -> bool:
+        return bool(self.inserted or self.updated or self.deleted)
+
+
+def _quoted(names) -> List[str]:
+    return [f'"{name}"' for name in names]
+
+
+def diff_sql(table: Table, columns: List[str]) -> str:
+    """
+    Rows of the shadow that are new or differ from the live table (compared by
+    an md5 of the loaded columns), and live rows missing from the shadow.
+    """
+    primary_key = table.primary_key.columns[0].name
+    shadow = shadow_table_name(table.name)
+    new_row = ", ".join(f'new."{name}"' for name in columns)
+    old_row = ", ".join(f'old."{name}"' for name in columns)
+    return f"""
+        SELECT
+            COALESCE(new."{primary_key}", old."{primary_key}") AS key,
+            CASE WHEN old."{primary_key}" IS NULL THEN 'insert'
+                 WHEN new."{primary_key}" IS NULL THEN 'delete'
+                 ELSE 'update' END AS op
+        FROM "{shadow}" new
+        FULL JOIN "{table.name}" old ON new."{primary_key}" = old."{primary_key}"
+        WHERE new."{primary_key}" IS NULL
+           OR old."{primary_key}" IS NULL
+           OR md5(ROW({new_row})::text) IS DISTINCT FROM md5(ROW({old_row})::text)
+    """
+
+
+def upsert_sql(table: Table, columns: List[str]) -> str:
+    primary_key = table.primary_key.columns[0].name
+    shadow = shadow_table_name(table.name)
+    column_list = ", ".join(_quoted(columns))
+    updates = ", ".join(f'"{name}" = EXCLUDED."{name}"' for name in columns if name != primary_key)
+    conflict = f"DO UPDATE SET {updates}" if updates else "DO NOTHING"
+    return f"""
+        INSERT INTO "{table.name}" ({column_list})
+        SELECT {column_list} FROM "{shadow}" WHERE "{primary_key}" = ANY(:keys)
+        ON CONFLICT ("{primary_key}") {conflict}
+    """
+
+
+def delete_sql(table: Table) -> str:
+    primary_key = table.primary_key.columns[0].name
+    return f'DELETE FROM "{table.name}" WHERE "{primary_key}" = ANY(:keys)'
+
+
+def _seller_keys(conn, table_name: str, changes: TableChanges, source: str) -> Set:
+    query = SELLER_KEY_QUERIES.get(table_name)
+    if query is None or not changes:
+        return set()
+    rows = conn.execute(text(query.format(table=source)), {"keys": changes.keys}).scalars()
+    return {key for key in rows if key is not None}
+
+
+def apply_changes(engine, columns: Dict[str, List[str]]):
+    """
+    Diffs every shadow against its live table and applies the inserts,
+    updates and deletes in one transaction, parents first for upserts and
+    children first for deletes. Readers keep seeing the previous catalog
+    until the commit. Returns the changes per table and the base products
+    whose seller rows changed.
+    """
+    models = Base.metadata.tables
+    order = [name for level in load_levels(columns) for name in level]
+    changes: Dict[str, TableChanges] = {}
+    seller_keys: Set = set()
+
+    with engine.begin() as conn:
+        for name in order:
+            table_changes = TableChanges(name)
+            for key, op in conn.execute(text(diff_sql(models[name], columns[name]))):
+                getattr(table_changes, {"insert": "inserted", "update": "updated", "delete": "deleted"}[op]).append(key)
+            changes[name] = table_changes
+            # Old rows, before they are overwritten; members also by their new base product.
+            seller_keys |= _seller_keys(conn, name, table_changes, name)
+            if name == "members":
+                seller_keys |= _seller_keys(conn, name, table_changes, shadow_table_name(name))
+
+        for name in order:
+            upserts = changes[name].inserted + changes[name].updated
+            if upserts:
+                conn.execute(text(upsert_sql(models[name], columns[name])), {"keys": upserts})
+        for name in reversed(order):
+            if changes[name].deleted:
+                conn.execute(text(delete_sql(models[name])), {"keys": changes[name].deleted})
+
+        for name in order:
+            if name == "shops":
+                seller_keys |= _seller_keys(conn, name, changes[name], name)
+            if changes[name]:
+                conn.execute(text(f'ANALYZE "{name}"'))
+
+    return changes, seller_keys
+
+
+def write_change_feed(changes: Dict[str, TableChanges], seller_keys: Set, path: str = None) -> str:
+    """Appends one JSON line per changed row (and per affected seller context) to the change feed."""
+    path = path or settings.CATALOG_CHANGE_FEED_FILE
+    refresh_id = uuid.uuid4().hex
+    timestamp = time.strftime("%Y-%m-%dT%H:%M:%S%z")
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    with open(path, "a", encoding="utf-8") as feed:
+        for table_changes in changes.values():
+            for op, keys in (("insert", table_changes.inserted), ("update", table_changes.updated), ("delete", table_changes.deleted)):
+                for key in keys:
+                    feed.write(json.dumps({"refresh_id": refresh_id, "timestamp": timestamp, "table": table_changes.table, "op": op, "key": key}, ensure_ascii=False, default=str) + "\n")
+        for key in sorted(seller_keys):
+            feed.write(json.dumps({"refresh_id": refresh_id, "timestamp": timestamp, "table": "product_sellers", "op": "update", "key": key}, ensure_ascii=False, default=str) + "\n")
+    return refresh_id
+
+
+def invalidation_payload(changes: Dict[str, TableChanges], seller_keys: Set):
+    """
+    The /cache/invalidate request for a refresh: changed keys per table, or
+    the whole table when it has more than CATALOG_REFRESH_MAX_INVALIDATION_KEYS.
+    """
+    limit = settings.CATALOG_REFRESH_MAX_INVALIDATION_KEYS
+    tables, keys = [], {}
+    for name, table_changes in changes.items():
+        if not table_changes:
+            continue
+        if len(table_changes.keys) > limit:
+            tables.append(name)
+        else:
+            keys[name] = table_changes.keys
+    if seller_keys:
+        if len(seller_keys) > limit:
+            tables.append("product_sellers")
+        else:
+            keys["product_sellers"] = sorted(seller_keys)
+    return tables, keys
+
+
+def drop_shadow_tables(engine, table_names):
+    with engine.begin() as conn:
+        for name in table_names:
+            conn.execute(text(f'DROP TABLE IF EXISTS "{shadow_table_name(name)}"'))
+
+
+def refresh_catalog(engine, files: Dict[str, str]):
+    """
+    Incrementally refreshes model tables from parquet files: loads each file
+    into a shadow table in parallel, applies only the differences in one
+    transaction and returns (changes, seller_keys). Tables whose shadow failed
+    to load are left untouched.
+    """
+    models = Base.metadata.tables
+    files = {name: path for name, path in files.items() if name in models and not models[name].info.get("is_view")}
+    columns: Dict[str, List[str]] = {}
+    context = multiprocessing.get_context("spawn")
+    try:
+        with ProcessPoolExecutor(max_workers=settings.LOADER_WORKERS, mp_context=context) as pool:
+            futures = {
+                pool.submit(copy_to_shadow, settings.DATABASE_URL, name, path, settings.LOADER_BATCH_ROWS): name
+                for name, path in files.items()
+            }
+            for future in as_completed(futures):
+                name = futures[future]
+                try:
+                    stats = future.result()
+                    columns[name] = stats.pop("columns")
+                    log_copy_stats(stats)
+                except Exception as e:
+                    logger.error(f"❌ Failed to load shadow table for '{name}'. Error: {e}")
+
+        if not columns:
+            return {}, set()
+        changes, seller_keys = apply_changes(engine, columns)
+    finally:
+        drop_shadow_tables(engine, files)
+
+    for table_changes in changes.values():
+        logger.info(
+            f"🔄 {table_changes.table}: {len(table_changes.inserted)} inserted, "
+            f"{len(table_changes.updated)} updated, {len(table_changes.deleted)} deleted"
+        )
+    return changes, seller_keys
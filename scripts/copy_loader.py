@@ -0,0 +1,293 @@
+import io
+import json
+import time
+from typing import Dict, Iterable, Iterator, List, Optional, Set, Tuple
+
+import psycopg2
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.csv as pacsv
+import pyarrow.parquet as pq
+from sqlalchemy import Table
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.dialects.postgresql import JSONB
+from sqlalchemy.engine import make_url
+from sqlalchemy.schema import CreateIndex
+
+from app.core.logger import logger
+from app.db.models import Base
+
+# Characters JSON strings must escape that the vectorized path handles; any
+# other control character sends the column through json.dumps instead.
+JSON_ESCAPES = [("\\", "\\\\"), ('"', '\\"'), ("\n", "\\n"), ("\r", "\\r"), ("\t", "\\t")]
+OTHER_CONTROL_CHARS = r"[\x00-\x08\x0b\x0c\x0e-\x1f]"
+
+COPY_READ_SIZE = 1024 * 1024
+
+FOREIGN_KEYS_SQL = """
+SELECT conname, pg_get_constraintdef(oid), confrelid::regclass::text
+FROM pg_constraint
+WHERE conrelid = %s::regclass AND contype = 'f'
+"""
+
+
+def sync_database_url(url: str, driver: str = "postgresql+psycopg2") -> str:
+    """DATABASE_URL (asyncpg for the app) rewritten for a synchronous driver, password included."""
+    return make_url(url).set(drivername=driver).render_as_string(hide_password=False)
+
+
+def _json_strings(values: pa.Array) -> pa.Array:
+    for old, new in JSON_ESCAPES:
+        values = pc.replace_substring(values, old, new)
+    return pc.binary_join_element_wise('"', values, '"', "")
+
+
+def _json_elements(values: pa.Array) -> Optional[pa.Array]:
+    """JSON text of each list element, or None if the element type needs the per-row path."""
+    if pa.types.is_string(values.type) or pa.types.is_large_string(values.type):
+        if pc.any(pc.match_substring_regex(values, OTHER_CONTROL_CHARS)).as_py():
+            return None
+        text = _json_strings(values.cast(pa.string()))
+    elif pa.types.is_boolean(values.type):
+        text = pc.if_else(values, "true", "false")
+    elif pa.types.is_integer(values.type):
+        text = values.cast(pa.string())
+    elif pa.types.is_floating(values.type):
+        if pc.any(pc.invert(pc.is_finite(values))).as_py():
+            return None
+        text = values.cast(pa.string())
+    else:
+        return None
+    return pc.fill_null(text, "null")
+
+
+def _json_per_row(array: pa.Array) -> pa.Array:
+    return pa.array(
+        [None if value is None else json.dumps(value, ensure_ascii=False, default=str) for value in array.to_pylist()],
+        pa.string(),
+    )
+
+
+def _json_text_per_row(array: pa.Array) -> pa.Array:
+    """String cells that already hold JSON are kept; anything else becomes a JSON string."""
+    result = []
+    for value in array.to_pylist():
+        if value is None:
+            result.append(None)
+            continue
+        try:
+            json.loads(value)
+            result.append(value)
+        except ValueError:
+            result.append(json.dumps(value, ensure_ascii=False))
+    return pa.array(result, pa.string())
+
+
+def to_json_text(array: pa.Array) -> pa.Array:
+    """
+    A column as JSON text for a JSONB target. Lists of strings, numbers and
+    booleans are serialized with Arrow compute kernels over the flattened
+    values; structs, maps, nested lists and unusual strings fall back to
+    json.dumps per row.
+    """
+    if isinstance(array, pa.ChunkedArray):
+        return pa.chunked_array([to_json_text(chunk) for chunk in array.chunks], pa.string())
+    if pa.types.is_string(array.type) or pa.types.is_large_string(array.type):
+        return _json_text_per_row(array)
+    if not (pa.types.is_list(array.type) or pa.types.is_large_list(array.type)):
+        return _json_per_row(array)
+
+    elements = _json_elements(array.values)
+    if elements is None:
+        return _json_per_row(array)
+    list_type = pa.large_list(pa.string()) if pa.types.is_large_list(array.type) else pa.list_(pa.string())
+    rebuilt = type(array).from_arrays(array.offsets, elements, type=list_type)
+    text = pc.binary_join_element_wise("[", pc.binary_join(rebuilt, ","), "]", "")
+    return pc.if_else(array.is_null(), pa.scalar(None, pa.string()), text)
+
+
+def batch_to_csv(batch: pa.RecordBatch, json_columns: Set[str]) -> bytes:
+    """One record batch as headerless CSV for COPY (null is an empty field, '' is quoted)."""
+    arrays = [
+        to_json_text(column) if name in json_columns else column
+        for name, column in zip(batch.schema.names, batch.columns)
+    ]
+    sink = io.BytesIO()
+    pacsv.write_csv(pa.table(arrays, names=batch.schema.names), sink, pacsv.WriteOptions(include_header=False))
+    return sink.getvalue()
+
+
+class CsvStream(io.RawIOBase):
+    """A readable file over CSV chunks, so one COPY consumes batches as they are produced."""
+
+    def __init__(self, chunks: Iterable[bytes]):
+        self._chunks: Iterator[bytes] = iter(chunks)
+        self._chunk = b""
+        self._pos = 0
+
+    def readable(self) -> bool:
+        return True
+
+    def read(self, size: int = -1) -> bytes:
+        while self._pos >= len(self._chunk):
+            chunk = next(self._chunks, None)
+            if chunk is None:
+                return b""
+            self._chunk, self._pos = chunk, 0
+        end = len(self._chunk) if size is None or size < 0 else self._pos + size
+        data = self._chunk[self._pos:end]
+        self._pos += len(data)
+        return data
+
+
+def load_levels(table_names: Iterable[str]) -> List[List[str]]:
+    """
+    Groups tables so that each comes after the tables it references by
+    foreign key. Tables in one group are independent and can load in parallel.
+    """
+    names = set(table_names)
+    levels: Dict[str, int] = {}
+
+    def level(name: str, seen: frozenset = frozenset()) -> int:
+        if name not in levels:
+            deps = {fk.column.table.name for fk in Base.metadata.tables[name].foreign_keys} & names - {name} - seen
+            levels[name] = 1 + max((level(dep, seen | {name}) for dep in deps), default=-1)
+        return levels[name]
+
+    groups: Dict[int, List[str]] = {}
+    for name in sorted(names):
+        groups.setdefault(level(name), []).append(name)
+    return [groups[key] for key in sorted(groups)]
+
+
+def _parquet_columns(table: Table, parquet: pq.ParquetFile) -> List[str]:
+    """Parquet columns the model table has (generated columns excluded)."""
+    columns = {column.name for column in table.columns if column.computed is None}
+    ignored = [name for name in parquet.schema_arrow.names if name not in columns]
+    if ignored:
+        logger.warning(f"Ignoring columns not in the '{table.name}' model: {ignored}")
+    return [name for name in parquet.schema_arrow.names if name in columns]
+
+
+def copy_parquet(cursor, target: str, table: Table, parquet: pq.ParquetFile, names: List[str], batch_rows: int) -> Dict[str, int]:
+    """Streams the `names` columns of a parquet file into `target` with one COPY; returns rows and bytes sent."""
+    json_columns = {name for name in names if isinstance(table.columns[name].type, JSONB)}
+    stats = {"rows": 0, "bytes": 0}
+
+    def chunks():
+        for batch in parquet.iter_batches(batch_size=batch_rows, columns=names):
+            data = batch_to_csv(batch, json_columns)
+            stats["rows"] += batch.num_rows
+            stats["bytes"] += len(data)
+            yield data
+
+    column_list = ", ".join(f'"{name}"' for name in names)
+    cursor.copy_expert(f'COPY "{target}" ({column_list}) FROM STDIN WITH (FORMAT csv)', CsvStream(chunks()), size=COPY_READ_SIZE)
+    return stats
+
+
+def _throughput(table_name: str, stats: Dict[str, int], copy_seconds: float, index_seconds: float) -> Dict[str, float]:
+    return {
+        "table": table_name,
+        "rows": stats["rows"],
+        "megabytes": round(stats["bytes"] / 1e6, 2),
+        "copy_seconds": round(copy_seconds, 2),
+        "index_seconds": round(index_seconds, 2),
+        "rows_per_second": round(stats["rows"] / copy_seconds) if copy_seconds else None,
+        "megabytes_per_second": round(stats["bytes"] / 1e6 / copy_seconds, 2) if copy_seconds else None,
+    }
+
+
+def drop_foreign_keys(cursor, table_name: str) -> List[Tuple[str, str]]:
+    """
+    Drops the foreign keys of a table; returns their names and definitions,
+    ordered by referenced table so that workers re-adding them take the
+    referenced tables' locks in the same order.
+    """
+    cursor.execute(FOREIGN_KEYS_SQL, (table_name,))
+    foreign_keys = sorted(cursor.fetchall(), key=lambda row: (row[2], row[0]))
+    for name, _, _ in foreign_keys:
+        cursor.execute(f'ALTER TABLE "{table_name}" DROP CONSTRAINT "{name}"')
+    return [(name, definition.removesuffix(" NOT VALID")) for name, definition, _ in foreign_keys]
+
+
+def add_foreign_keys_not_valid(cursor, table_name: str, foreign_keys: List[Tuple[str, str]]):
+    """
+    Re-adds foreign keys without checking the rows already in the table; new
+    writes are checked. The loader validates them separately, so orphan rows
+    are reported instead of failing the COPY.
+    """
+    for name, definition in foreign_keys:
+        cursor.execute(f'ALTER TABLE "{table_name}" ADD CONSTRAINT "{name}" {definition} NOT VALID')
+
+
+def copy_table(database_url: str, table_name: str, file_path: str, batch_rows: int) -> Dict[str, float]:
+    """
+    Streams a parquet file into an empty model table with COPY. Secondary
+    indexes and foreign keys are dropped first; the indexes are rebuilt after
+    the data is in and the foreign keys re-added as NOT VALID, all in one
+    transaction. Runs in a worker process; returns throughput stats.
+    """
+    table: Table = Base.metadata.tables[table_name]
+    parquet = pq.ParquetFile(file_path)
+    names = _parquet_columns(table, parquet)
+    dialect = postgresql.dialect()
+    conn = psycopg2.connect(sync_database_url(database_url, "postgresql"))
+    try:
+        with conn, conn.cursor() as cursor:
+            for index in table.indexes:
+                cursor.execute(f'DROP INDEX IF EXISTS "{index.name}"')
+            foreign_keys = drop_foreign_keys(cursor, table_name)
+            started = time.perf_counter()
+            stats = copy_parquet(cursor, table_name, table, parquet, names, batch_rows)
+            copied = time.perf_counter()
+            for index in table.indexes:
+                cursor.execute(str(CreateIndex(index).compile(dialect=dialect)))
+            cursor.execute(f'ANALYZE "{table_name}"')
+            indexed = time.perf_counter()
+            # Last, so the locks it takes on the referenced tables are held only until the commit.
+            add_foreign_keys_not_valid(cursor, table_name, foreign_keys)
+    finally:
+        conn.close()
+    return _throughput(table_name, stats, copied - started, indexed - copied)
+
+
+def shadow_table_name(table_name: str) -> str:
+    return f"_refresh_{table_name}"
+
+
+def copy_to_shadow(database_url: str, table_name: str, file_path: str, batch_rows: int) -> Dict[str, float]:
+    """
+    Loads a parquet file into a fresh unlogged shadow of a model table (same
+    column types, only the columns the file has, keyed like the original) for
+    an incremental refresh. Runs in a worker process; returns throughput stats
+    plus the shadow's column list.
+    """
+    table: Table = Base.metadata.tables[table_name]
+    parquet = pq.ParquetFile(file_path)
+    names = _parquet_columns(table, parquet)
+    shadow = shadow_table_name(table_name)
+    primary_key = ", ".join(f'"{column.name}"' for column in table.primary_key.columns)
+    conn = psycopg2.connect(sync_database_url(database_url, "postgresql"))
+    try:
+        with conn, conn.cursor() as cursor:
+            cursor.execute(f'DROP TABLE IF EXISTS "{shadow}"')
+            column_list = ", ".join(f'"{name}"' for name in names)
+            cursor.execute(f'CREATE UNLOGGED TABLE "{shadow}" AS SELECT {column_list} FROM "{table_name}" WITH NO DATA')
+            started = time.perf_counter()
+            stats = copy_parquet(cursor, shadow, table, parquet, names, batch_rows)
+            copied = time.perf_counter()
+            cursor.execute(f'ALTER TABLE "{shadow}" ADD PRIMARY KEY ({primary_key})')
+            cursor.execute(f'ANALYZE "{shadow}"')
+            indexed = time.perf_counter()
+    finally:
+        conn.close()
+    return {**_throughput(table_name, stats, copied - started, indexed - copied), "columns": names}
+
+
+def log_copy_stats(stats: Dict[str, float]):
+    logger.info(
+        f"📊 {stats['table']}: {stats['rows']:,} rows, {stats['megabytes']} MB copied in {stats['copy_seconds']}s "
+        f"({stats['rows_per_second']} rows/s, {stats['megabytes_per_second']} MB/s), "
+        f"indexes built in {stats['index_seconds']}s"
+    )
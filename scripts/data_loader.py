@@ -1,17 +1,76 @@
+import argparse
 import os
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
 import pandas as pd
-from sqlalchemy import create_engine, inspect
+from sqlalchemy import create_engine, inspect, text
 import time
 import json
 import numpy as np
+import requests
 
 
 from app.core.logger import logger
 from app.core.config import settings
+from app.db.models import Base, BaseProduct
+from app.services.openai_service import get_embeddings
+from app.services.product_index import ProductVectorIndex
+from scripts.catalog_refresh import invalidation_payload, refresh_catalog, write_change_feed
+from scripts.copy_loader import copy_table, load_levels, log_copy_stats, sync_database_url
 
 
 DATA_DIR = "./data"
 
+# Tables the product_sellers materialized view is built from.
+PRODUCT_SELLERS_SOURCES = {"members", "shops", "cities"}
+
+PRODUCT_SELLERS_VIEW_SQL = [
+    """
+    CREATE MATERIALIZED VIEW IF NOT EXISTS product_sellers AS
+    SELECT
+        m.random_key AS member_key,
+        m.base_random_key,
+        m.price,
+        s.id AS shop_id,
+        s.score AS shop_score,
+        s.has_warranty,
+        c.name AS city
+    FROM members m
+    JOIN shops s ON m.shop_id = s.id
+    JOIN cities c ON s.city_id = c.id
+    """,
+    # The unique index is required by REFRESH ... CONCURRENTLY.
+    "CREATE UNIQUE INDEX IF NOT EXISTS ux_product_sellers_member_key ON product_sellers (member_key)",
+    """
+    CREATE INDEX IF NOT EXISTS ix_product_sellers_base_random_key
+    ON product_sellers (base_random_key) INCLUDE (price, shop_score, has_warranty, city)
+    """,
+]
+
+# EXPLAIN checks run after a load: each product search predicate and the index it must be able to use.
+SEARCH_INDEX_CHECKS = {
+    "ix_base_products_persian_name_trgm": "SELECT random_key FROM base_products WHERE persian_name % :q",
+    "ix_base_products_persian_name_tsv": (
+        "SELECT random_key FROM base_products WHERE persian_name_tsv @@ plainto_tsquery('simple', :q)"
+    ),
+}
+
+# NOT VALID foreign keys (as left by copy_table) of one table, with their column names in key order.
+UNVALIDATED_FOREIGN_KEYS_SQL = """
+SELECT c.conname AS name,
+       c.confrelid::regclass::text AS referenced,
+       array_agg(a.attname::text ORDER BY k.position) AS columns,
+       array_agg(ra.attname::text ORDER BY k.position) AS referenced_columns
+FROM pg_constraint c
+CROSS JOIN LATERAL unnest(c.conkey, c.confkey) WITH ORDINALITY AS k(attnum, ref_attnum, position)
+JOIN pg_attribute a ON a.attrelid = c.conrelid AND a.attnum = k.attnum
+JOIN pg_attribute ra ON ra.attrelid = c.confrelid AND ra.attnum = k.ref_attnum
+WHERE c.conrelid = CAST(:table AS regclass) AND c.contype = 'f' AND NOT c.convalidated
+GROUP BY c.conname, c.confrelid
+"""
+
+ORPHAN_SAMPLE_SIZE = 5
+
 def get_db_engine():
     """Establishes a connection to the database with a retry mechanism."""
     if not settings.DATABASE_URL:
@@ -20,7 +79,7 @@ def get_db_engine():
         
     for attempt in range(5):
         try:
-            engine = create_engine(settings.DATABASE_URL)
+            engine = create_engine(sync_database_url(settings.DATABASE_URL))
             with engine.connect():
                 logger.info("✅ Database connection successful.")
                 return engine
@@ -31,53 +90,360 @@ def get_db_engine():
     logger.critical("❌ Failed to connect to the database after multiple attempts.")
     return None
 
+def notify_cache_invalidation(tables=None, keys=None):
+    """Tells the running app to drop cached catalog entries for the reloaded tables."""
+    if not settings.CACHE_INVALIDATION_URL:
+        logger.info("CACHE_INVALIDATION_URL is not set. Skipping cache invalidation.")
+        return
+    try:
+        headers = {"X-Cache-Token": settings.CACHE_INVALIDATION_TOKEN} if settings.CACHE_INVALIDATION_TOKEN else {}
+        response = requests.post(settings.CACHE_INVALIDATION_URL, json={"tables": tables, "keys": keys}, headers=headers, timeout=10)
+        response.raise_for_status()
+        logger.info(f"✅ App caches invalidated for tables: {tables}")
+    except requests.RequestException as e:
+        logger.warning(f"⚠️ Failed to invalidate app caches at {settings.CACHE_INVALIDATION_URL}: {e}")
+
+def product_sellers_view_exists(engine) -> bool:
+    with engine.connect() as conn:
+        return conn.execute(text("SELECT to_regclass('product_sellers') IS NOT NULL")).scalar()
+
+def drop_product_sellers_view(engine):
+    """Drops the view so its source tables can be replaced."""
+    with engine.begin() as conn:
+        conn.execute(text("DROP MATERIALIZED VIEW IF EXISTS product_sellers"))
+    logger.info("Dropped materialized view 'product_sellers' before reloading its source tables.")
+
+def build_product_sellers_view(engine):
+    """
+    Creates the product_sellers materialized view (one row per member with its
+    shop and city joined) or, if it already exists, refreshes it concurrently so
+    readers are never blocked and only changed rows are rewritten.
+    """
+    existing_tables = set(inspect(engine).get_table_names())
+    if not PRODUCT_SELLERS_SOURCES.issubset(existing_tables):
+        logger.warning(f"⚠️ Cannot build 'product_sellers': missing tables {PRODUCT_SELLERS_SOURCES - existing_tables}.")
+        return
+
+    if product_sellers_view_exists(engine):
+        with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+            conn.execute(text("REFRESH MATERIALIZED VIEW CONCURRENTLY product_sellers"))
+        logger.info("✅ Refreshed materialized view 'product_sellers'.")
+        return
+
+    with engine.begin() as conn:
+        for statement in PRODUCT_SELLERS_VIEW_SQL:
+            conn.execute(text(statement))
+        conn.execute(text("ANALYZE product_sellers"))
+    logger.info("✅ Built materialized view 'product_sellers'.")
+
+def build_product_vector_index(engine, batch_size=1000):
+    """
+    Embeds every base_products.persian_name and writes the memory-mapped
+    vector index the app uses for product search (settings.PRODUCT_INDEX_DIR).
+    Names already embedded by the existing index with the same model are reused.
+    """
+    if "base_products" not in inspect(engine).get_table_names():
+        logger.warning("⚠️ Cannot build the product vector index: table 'base_products' is missing.")
+        return False
+
+    with engine.connect() as conn:
+        rows = conn.execute(text(
+            "SELECT random_key, persian_name FROM base_products WHERE persian_name IS NOT NULL ORDER BY random_key"
+        )).all()
+    keys = [row.random_key for row in rows]
+    names = [row.persian_name for row in rows]
+
+    vectors = np.empty((len(names), settings.PRODUCT_INDEX_DIMENSIONS), dtype=np.float32)
+    # Products whose name did not change keep the vector of the current index.
+    previous = ProductVectorIndex.load(settings.PRODUCT_INDEX_DIR)
+    if previous is not None and (previous.model, previous.dimensions) != (settings.PRODUCT_INDEX_EMBEDDING_MODEL, settings.PRODUCT_INDEX_DIMENSIONS):
+        previous = None
+    previous_rows = {key: (name, row) for row, (key, name) in enumerate(zip(previous.keys, previous.names))} if previous else {}
+    to_embed = []
+    for row, (key, name) in enumerate(zip(keys, names)):
+        old_name, old_row = previous_rows.get(key, (None, None))
+        if old_name == name:
+            vectors[row] = previous.vectors[old_row]
+        else:
+            to_embed.append(row)
+    logger.info(f"Reusing {len(names) - len(to_embed)} product vectors, embedding {len(to_embed)}.")
+
+    for start in range(0, len(to_embed), batch_size):
+        batch_rows = to_embed[start:start + batch_size]
+        vectors[batch_rows] = get_embeddings(
+            [names[row] for row in batch_rows],
+            model=settings.PRODUCT_INDEX_EMBEDDING_MODEL,
+            dimensions=settings.PRODUCT_INDEX_DIMENSIONS,
+        )
+        logger.info(f"Embedded {start + len(batch_rows)}/{len(to_embed)} product names.")
+
+    ProductVectorIndex.save(settings.PRODUCT_INDEX_DIR, keys, names, vectors, settings.PRODUCT_INDEX_EMBEDDING_MODEL)
+    logger.info(f"✅ Built product vector index with {len(keys)} products at '{settings.PRODUCT_INDEX_DIR}'.")
+    return True
+
+def product_vector_index_exists() -> bool:
+    return ProductVectorIndex.load(settings.PRODUCT_INDEX_DIR) is not None
+
+def orm_tables():
+    """Tables declared in app.db.models, in foreign-key order, without the views built above."""
+    return {table.name: table for table in Base.metadata.sorted_tables if not table.info.get("is_view")}
+
+def create_schema(engine):
+    """
+    Creates missing tables (with their constraints and indexes) from the ORM
+    models, then upgrades a base_products table left by older loaders. The
+    COPY load drops each table's foreign keys and re-adds them NOT VALID.
+    """
+    with engine.begin() as conn:
+        conn.execute(text("CREATE EXTENSION IF NOT EXISTS pg_trgm"))
+    Base.metadata.create_all(engine, tables=list(orm_tables().values()))
+    ensure_search_indexes(engine)
+
+def ensure_search_indexes(engine):
+    """
+    Makes base_products.persian_name_tsv a generated column and creates the
+    GIN indexes on it and on persian_name if they are missing. Tables written
+    by the old to_sql(if_exists='replace') loader had neither.
+    """
+    tsv_column = BaseProduct.__table__.c.persian_name_tsv
+    with engine.begin() as conn:
+        generated = conn.execute(text(
+            "SELECT attgenerated FROM pg_attribute "
+            "WHERE attrelid = 'base_products'::regclass AND attname = 'persian_name_tsv' AND NOT attisdropped"
+        )).scalar()
+        if generated != "s":
+            if generated is not None:
+                conn.execute(text("ALTER TABLE base_products DROP COLUMN persian_name_tsv"))
+            conn.execute(text(
+                f"ALTER TABLE base_products ADD COLUMN persian_name_tsv tsvector "
+                f"GENERATED ALWAYS AS ({tsv_column.computed.sqltext}) STORED"
+            ))
+            logger.info("Added generated column 'base_products.persian_name_tsv'.")
+        for index in BaseProduct.__table__.indexes:
+            index.create(conn, checkfirst=True)
+
+def _plan_index_names(plan):
+    names = set()
+    if isinstance(plan, list):
+        for item in plan:
+            names |= _plan_index_names(item)
+    elif isinstance(plan, dict):
+        if "Index Name" in plan:
+            names.add(plan["Index Name"])
+        for value in plan.values():
+            if isinstance(value, (list, dict)):
+                names |= _plan_index_names(value)
+    return names
+
+def validate_search_indexes(engine):
+    """
+    Runs EXPLAIN on the product search predicates and reports whether each
+    can use its index. Sequential scans are disabled for the check so the
+    answer does not depend on table size: a missing index or a wrong
+    operator class still shows up as a Seq Scan.
+    """
+    results = {}
+    with engine.begin() as conn:
+        sample = conn.execute(text(
+            "SELECT persian_name FROM base_products WHERE persian_name IS NOT NULL LIMIT 1"
+        )).scalar() or "test"
+        conn.execute(text("SET LOCAL enable_seqscan = off"))
+        for index_name, query in SEARCH_INDEX_CHECKS.items():
+            plan = conn.execute(text(f"EXPLAIN (FORMAT JSON) {query}"), {"q": sample}).scalar()
+            if isinstance(plan, str):
+                plan = json.loads(plan)
+            results[index_name] = index_name in _plan_index_names(plan)
+            if results[index_name]:
+                logger.info(f"✅ Product search uses index '{index_name}'.")
+            else:
+                logger.warning(f"⚠️ Product search does not use index '{index_name}'; plan: {json.dumps(plan)}")
+    return results
+
+def orphan_rows_sql(table_name, columns, referenced, referenced_columns):
+    """
+    Rows of a table whose foreign key points at no referenced row. Keys with
+    a NULL column are not checked, as with the default MATCH SIMPLE.
+    """
+    column_list = ", ".join(f't."{column}"' for column in columns)
+    not_null = " AND ".join(f't."{column}" IS NOT NULL' for column in columns)
+    matches = " AND ".join(f'r."{ref}" = t."{column}"' for column, ref in zip(columns, referenced_columns))
+    return (
+        f'SELECT {column_list} FROM "{table_name}" t WHERE {not_null} '
+        f'AND NOT EXISTS (SELECT 1 FROM {referenced} r WHERE {matches})'
+    )
+
+def validate_foreign_keys(engine, tables):
+    """
+    Validates the foreign keys the COPY load re-added as NOT VALID. A key
+    with orphan rows is logged with a sample of them and left NOT VALID, so
+    the table keeps its data and new writes are still checked.
+    Returns the orphan count per constraint.
+    """
+    orphans = {}
+    for table_name in tables:
+        with engine.connect() as conn:
+            foreign_keys = conn.execute(text(UNVALIDATED_FOREIGN_KEYS_SQL), {"table": table_name}).mappings().all()
+        for fk in foreign_keys:
+            query = orphan_rows_sql(table_name, fk["columns"], fk["referenced"], fk["referenced_columns"])
+            with engine.begin() as conn:
+                count = conn.execute(text(f"SELECT count(*) FROM ({query}) orphans")).scalar()
+                if count:
+                    sample = conn.execute(text(f"{query} LIMIT {ORPHAN_SAMPLE_SIZE}")).all()
+                    logger.warning(
+                        f"⚠️ {count} rows of '{table_name}' reference missing '{fk['referenced']}' rows "
+                        f"({', '.join(fk['columns'])}), e.g. {[tuple(row) for row in sample]}; "
+                        f"foreign key '{fk['name']}' stays NOT VALID."
+                    )
+                else:
+                    conn.execute(text(f'ALTER TABLE "{table_name}" VALIDATE CONSTRAINT "{fk["name"]}"'))
+                    logger.info(f"✅ Validated foreign key '{fk['name']}'.")
+            orphans[fk["name"]] = count
+    return orphans
+
+def table_has_rows(engine, table_name) -> bool:
+    with engine.connect() as conn:
+        return conn.execute(text(f'SELECT EXISTS (SELECT 1 FROM "{table_name}")')).scalar()
+
+def bulk_load_model_tables(files):
+    """
+    COPYs parquet files into their (empty) model tables. Tables are grouped by
+    foreign-key level; the tables of one level load in parallel worker
+    processes. Foreign keys come back NOT VALID (see validate_foreign_keys).
+    Returns the tables that loaded.
+    """
+    loaded = []
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=settings.LOADER_WORKERS, mp_context=context) as pool:
+        for level in load_levels(files):
+            logger.info(f"Loading tables in parallel: {level}")
+            futures = {
+                pool.submit(copy_table, settings.DATABASE_URL, name, files[name], settings.LOADER_BATCH_ROWS): name
+                for name in level
+            }
+            for future in as_completed(futures):
+                table_name = futures[future]
+                try:
+                    log_copy_stats(future.result())
+                    loaded.append(table_name)
+                except Exception as e:
+                    logger.error(f"❌ Failed to import data for table '{table_name}'. Error: {e}")
+    return loaded
+
+def parquet_files():
+    """Table name -> parquet path for every file in DATA_DIR."""
+    return {
+        os.path.splitext(filename)[0].lower(): os.path.join(DATA_DIR, filename)
+        for filename in os.listdir(DATA_DIR)
+        if filename.endswith(".parquet")
+    }
+
 def load_parquet_files(engine):
 
+    loaded_tables = []
     inspector = inspect(engine)
     existing_tables = inspector.get_table_names()
     logger.info(f"Tables already present in the database: {existing_tables}")
 
-    for filename in os.listdir(DATA_DIR):
-        if filename.endswith(".parquet"):
-            table_name = os.path.splitext(filename)[0].lower()
-
-            
-            if table_name in existing_tables:
-                logger.info(f"⏭️ Table '{table_name}' already exists. Skipping file.")
-                continue  
-
-            file_path = os.path.join(DATA_DIR, filename)
-            logger.info(f"Processing file: {filename}...")
-            
-            try:
-                df = pd.read_parquet(file_path)
-                
-                
-                for col in df.columns:
-                    
-                    if df[col].dtype == 'object':
-                        
-                        if any(isinstance(i, np.ndarray) for i in df[col].dropna()):
-                            logger.info(f"Converting numpy arrays in column '{col}' to JSON strings.")
-                            
-                            df[col] = df[col].apply(lambda x: json.dumps(x.tolist()) if isinstance(x, np.ndarray) else x)
-
-                logger.info(f"Importing data into table: '{table_name}'...")
-                df.to_sql(
-                    table_name,
-                    engine,
-                    if_exists='replace', 
-                    index=False,
-                    chunksize=10000
-                )
-                logger.info(f"✅ Successfully imported data into table: '{table_name}'.")
-            except Exception as e:
-                logger.error(f"❌ Failed to import data for table '{table_name}'. Error: {e}")
+    create_schema(engine)
+    models = orm_tables()
+    files = parquet_files()
+
+    model_files = {}
+    for table_name in sorted(name for name in files if name in models):
+        if table_has_rows(engine, table_name):
+            logger.info(f"⏭️ Table '{table_name}' already has data. Skipping file.")
+        else:
+            model_files[table_name] = files[table_name]
+    if model_files:
+        loaded_tables.extend(bulk_load_model_tables(model_files))
+        validate_foreign_keys(engine, loaded_tables)
+
+    # Parquet files without a model keep the plain to_sql import.
+    tables_to_load = {name for name in files if name not in models and name not in existing_tables}
+    if tables_to_load & PRODUCT_SELLERS_SOURCES:
+        # to_sql(if_exists='replace') cannot drop a table the view depends on.
+        drop_product_sellers_view(engine)
+
+    for table_name in sorted(name for name in files if name not in models):
+        if table_name in existing_tables:
+            logger.info(f"⏭️ Table '{table_name}' already exists. Skipping file.")
+            continue
+
+        logger.info(f"Processing file: {files[table_name]}...")
+        try:
+            df = pd.read_parquet(files[table_name])
+            for col in df.columns:
+                if df[col].dtype == 'object':
+                    if any(isinstance(i, np.ndarray) for i in df[col].dropna()):
+                        logger.info(f"Converting numpy arrays in column '{col}' to JSON strings.")
+                        df[col] = df[col].apply(lambda x: json.dumps(x.tolist()) if isinstance(x, np.ndarray) else x)
+
+            logger.info(f"Importing data into table: '{table_name}'...")
+            df.to_sql(table_name, engine, if_exists='replace', index=False, chunksize=10000)
+            logger.info(f"✅ Successfully imported data into table: '{table_name}'.")
+            loaded_tables.append(table_name)
+        except Exception as e:
+            logger.error(f"❌ Failed to import data for table '{table_name}'. Error: {e}")
+
+    if "base_products" in loaded_tables:
+        validate_search_indexes(engine)
+
+    if set(loaded_tables) & PRODUCT_SELLERS_SOURCES or not product_sellers_view_exists(engine):
+        build_product_sellers_view(engine)
+        loaded_tables.append("product_sellers")
+
+    if "base_products" in loaded_tables or not product_vector_index_exists():
+        try:
+            # Reporting base_products makes the app reload the index from disk.
+            if build_product_vector_index(engine) and "base_products" not in loaded_tables:
+                loaded_tables.append("base_products")
+        except Exception as e:
+            logger.error(f"❌ Failed to build the product vector index. Error: {e}")
+
+    if loaded_tables:
+        notify_cache_invalidation(tables=loaded_tables)
+
+def refresh_parquet_files(engine):
+    """
+    Applies a new catalog drop to tables that already hold data: only changed
+    rows are written, in one transaction, and app caches drop exactly the
+    changed keys (also recorded in the change feed).
+    """
+    create_schema(engine)
+    changes, seller_keys = refresh_catalog(engine, parquet_files())
+    changed_tables = {name for name, table_changes in changes.items() if table_changes}
+    if not changed_tables:
+        logger.info("✅ Catalog is up to date; nothing to refresh.")
+        return
+
+    refresh_id = write_change_feed(changes, seller_keys)
+    logger.info(f"Recorded refresh {refresh_id} in '{settings.CATALOG_CHANGE_FEED_FILE}'.")
+    if changed_tables & PRODUCT_SELLERS_SOURCES:
+        build_product_sellers_view(engine)
+    if "base_products" in changed_tables:
+        try:
+            build_product_vector_index(engine)
+        except Exception as e:
+            logger.error(f"❌ Failed to update the product vector index. Error: {e}")
+
+    tables, keys = invalidation_payload(changes, seller_keys)
+    notify_cache_invalidation(tables=tables, keys=keys)
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Load the catalog parquet files into the database.")
+    parser.add_argument(
+        "--refresh",
+        action="store_true",
+        help="Apply only the differences to tables that already hold data instead of skipping them.",
+    )
+    args = parser.parse_args()
+
     logger.info("--- Starting data loading script ---")
     db_engine = get_db_engine()
     if db_engine:
-        load_parquet_files(db_engine)
+        if args.refresh:
+            refresh_parquet_files(db_engine)
+        else:
+            load_parquet_files(db_engine)
         db_engine.dispose()
     logger.info("--- Data loading script finished ---")
\ No newline at end of file
@@ -0,0 +1,54 @@
+import json
+import re
+
+from benchmarks.fake_openai import FakeLLM, FakeLLMConfig, Rule
+from benchmarks.run_load import Result, percentile, summarize
+
+
+
+def test_fake_llm_classifies_from_recorded_labels_and_ends_tool_loops():
+    """Classification tools answer with the recorded scenario; later turns and other prompts get content."""
+    llm = FakeLLM(FakeLLMConfig(
+        scenarios={"قیمت پکیج": "SCENARIO_3_SELLER_INFO"},
+        rules=[Rule(re.compile("مقایسه"), content='{"winner": 1}')],
+    ))
+    tools = [{"type": "function", "function": {"name": name}} for name in ("classify_user_request", "extract_search")]
+    body = {"model": "gpt-4.1-mini", "tools": tools, "messages": [{"role": "user", "content": "قیمت پکیج"}]}
+
+    response = llm.completion(body)
+    calls = response["choices"][0]["message"]["tool_calls"]
+    assert [call["function"]["name"] for call in calls] == ["classify_user_request", "extract_search"]
+    assert json.loads(calls[0]["function"]["arguments"]) == {"scenario": "SCENARIO_3_SELLER_INFO"}
+    assert response["usage"]["prompt_tokens"] > 0
+
+    structured = {"response_format": {"type": "json_schema", "json_schema": {"schema": {"properties": {"scenario": {}}}}}, "messages": body["messages"]}
+    assert json.loads(llm.answer(structured)[0])["scenario"] == "SCENARIO_3_SELLER_INFO"
+
+    body["messages"].append({"role": "tool", "tool_call_id": calls[0]["id"], "content": "ok"})
+    assert llm.answer(body) == ("{}", [])
+    assert llm.answer({"messages": [{"role": "user", "content": "مقایسه دو گوشی"}]}) == ('{"winner": 1}', [])
+
+    chunks = llm.stream_chunks({"stream_options": {"include_usage": True}, "messages": [{"role": "user", "content": "مقایسه"}]})
+    assert "".join(c["choices"][0]["delta"].get("content", "") for c in chunks if c["choices"]) == '{"winner": 1}'
+    assert "usage" in chunks[-1]
+
+    vectors = llm.embeddings({"input": ["a", "a", "b"], "dimensions": 8})["data"]
+    assert vectors[0]["embedding"] == vectors[1]["embedding"] != vectors[2]["embedding"]
+
+
+def test_summary_reports_percentiles_and_logged_usage_per_scenario():
+    """Latency percentiles interpolate; DB and token figures come from the matched request log records."""
+    assert percentile([1, 2, 3, 4], 50) == 2.5
+    assert percentile([], 99) is None
+    results = [
+        Result("S1", "c1", 200, 0.1, log={"trace": {"db_queries": 2, "llm_calls": 1, "prompt_tokens": 100, "completion_tokens": 5}}),
+        Result("S1", "c2", 200, 0.3, log={"openai_usage": {"gpt-4.1": {"calls": 2, "input_tokens": 300, "output_tokens": 7}}}),
+        Result("S2", "c3", 0, 1.0, error="timeout"),
+    ]
+    report = summarize(results, wall_seconds=2.0)
+    assert report["ALL"]["requests"] == 3 and report["ALL"]["errors"] == 1
+    assert report["S1"]["throughput_rps"] == 1.0
+    assert report["S1"]["latency_ms"]["p50"] == 200.0
+    assert report["S1"]["db_queries_per_request"] == 2
+    assert report["S1"]["prompt_tokens_per_request"] == 200 and report["S1"]["prompt_tokens_total"] == 400
+    assert report["S2"]["latency_ms"]["p50"] is None
@@ -0,0 +1,91 @@
+import time
+
+from app.core.cache import PersistentCache, TTLCache, get_cache_stats
+
+
+def test_lru_eviction_and_counters():
+    """The least recently used entry is evicted first and lookups are counted."""
+    cache = TTLCache("test-lru", max_size=2, ttl_seconds=60)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    assert cache.get("a") == 1
+    cache.set("c", 3)
+
+    assert cache.get("b") is None
+    found, missing = cache.get_many(["a", "c", "d"])
+    assert found == {"a": 1, "c": 3}
+    assert missing == ["d"]
+
+    stats = get_cache_stats()["test-lru"]
+    assert stats["hits"] == 3
+    assert stats["misses"] == 2
+    assert stats["evictions"] == 1
+
+
+def test_entries_expire_and_can_be_invalidated():
+    """Expired entries count as misses; invalidation removes single keys."""
+    cache = TTLCache("test-ttl", max_size=10, ttl_seconds=0.01)
+    cache.set("a", 1)
+    cache.set("b", 2, ttl_seconds=60)
+    time.sleep(0.02)
+
+    assert cache.get("a") is None
+    assert "b" in cache
+    cache.invalidate("b")
+    assert "b" not in cache
+    assert len(cache) == 0
+
+
+def test_persistent_cache_survives_restart_and_evicts(tmp_path):
+    """Entries are read back from SQLite by a new instance; the least recently read are evicted."""
+    path = str(tmp_path / "cache.sqlite3")
+    cache = PersistentCache("test_persistent", path, ttl_seconds=60, max_entries=2, memory_size=10)
+    cache.set("a", {"scenario": "SCENARIO_1_DIRECT_SEARCH"})
+    cache.set("b", [1, 2])
+    cache.close()
+
+    reopened = PersistentCache("test_persistent", path, ttl_seconds=60, max_entries=2, memory_size=10)
+    assert reopened.get("a") == {"scenario": "SCENARIO_1_DIRECT_SEARCH"}
+    assert reopened.disk_hits == 1
+    reopened.set("c", "x")
+    assert reopened.stats()["size"] == 2
+    reopened.memory.clear()
+    assert reopened.get("b") is None
+    assert reopened.get("c") == "x"
+    reopened.close()
+
+
+def test_persistent_cache_async_methods_touch_memory_on_the_loop_thread(tmp_path, monkeypatch):
+    """Only SQLite work goes to a worker thread; the unlocked in-memory layer stays on the event loop."""
+    import asyncio
+    import threading
+
+    path = str(tmp_path / "cache.sqlite3")
+    PersistentCache("test_async", path, ttl_seconds=60, max_entries=10, memory_size=10).set("a", 1)
+    cache = PersistentCache("test_async", path, ttl_seconds=60, max_entries=10, memory_size=10)
+    threads = []
+    for name in ("get", "set"):
+        original = getattr(cache.memory, name)
+
+        def record(*args, _original=original, **kwargs):
+            threads.append(threading.current_thread())
+            return _original(*args, **kwargs)
+
+        monkeypatch.setattr(cache.memory, name, record)
+
+    async def run():
+        await cache.aset("b", 2)
+        return await cache.aget("a"), await cache.aget("a"), await cache.astats()
+
+    first, second, stats = asyncio.run(run())
+    assert (first, second, stats["size"], cache.disk_hits) == (1, 1, 2, 1)
+    assert threads and all(thread is threading.main_thread() for thread in threads)
+    cache.close()
+
+def test_classification_key_ignores_spelling_variants():
+    """Arabic letters, Persian digits and spacing do not change the key; the prompt does."""
+    from app.services.classification_cache import classification_key
+
+    key = classification_key("قيمت گوشي ۱۲۸ گيگ؟", "prompt v1", "gpt-4.1-mini", [])
+    assert key == classification_key("قیمت  گوشی 128 گیگ", "prompt v1", "gpt-4.1-mini", [])
+    assert key != classification_key("قیمت گوشی 128 گیگ", "prompt v2", "gpt-4.1-mini", [])
@@ -0,0 +1,53 @@
+import json
+
+from app.db import repository
+from app.db.models import Base
+from scripts.catalog_refresh import TableChanges, diff_sql, invalidation_payload, upsert_sql, write_change_feed
+
+
+def test_refresh_sql_diffs_by_key_and_content_hash():
+    """Only the loaded columns are hashed; upserts overwrite every non-key column."""
+    members = Base.metadata.tables["members"]
+    diff = diff_sql(members, ["random_key", "price"])
+    assert 'FULL JOIN "members" old ON new."random_key" = old."random_key"' in diff
+    assert 'md5(ROW(new."random_key", new."price")::text)' in diff
+    upsert = upsert_sql(members, ["random_key", "price"])
+    assert 'ON CONFLICT ("random_key") DO UPDATE SET "price" = EXCLUDED."price"' in upsert
+
+
+def test_change_feed_and_invalidation_name_exact_keys(tmp_path, monkeypatch):
+    """Small change sets are invalidated key by key; large ones clear the table."""
+    monkeypatch.setattr("app.core.config.settings.CATALOG_REFRESH_MAX_INVALIDATION_KEYS", 2)
+    changes = {
+        "members": TableChanges("members", inserted=["m1"], deleted=["m2"]),
+        "shops": TableChanges("shops", updated=[1, 2, 3]),
+        "cities": TableChanges("cities"),
+    }
+    tables, keys = invalidation_payload(changes, {"p1"})
+    assert tables == ["shops"]
+    assert keys == {"members": ["m1", "m2"], "product_sellers": ["p1"]}
+
+    feed = tmp_path / "changes.jsonl"
+    refresh_id = write_change_feed(changes, {"p1"}, str(feed))
+    lines = [json.loads(line) for line in feed.read_text(encoding="utf-8").splitlines()]
+    assert {line["refresh_id"] for line in lines} == {refresh_id}
+    assert [(line["table"], line["op"], line["key"]) for line in lines] == [
+        ("members", "insert", "m1"),
+        ("members", "delete", "m2"),
+        ("shops", "update", 1),
+        ("shops", "update", 2),
+        ("shops", "update", 3),
+        ("product_sellers", "update", "p1"),
+    ]
+
+
+def test_seller_contexts_are_dropped_by_key_when_keys_are_sent():
+    """Member keys alone clear all seller contexts; with product_sellers keys only those go."""
+    repository.seller_context_cache.set("p1", ["a"])
+    repository.seller_context_cache.set("p2", ["b"])
+    repository.invalidate_catalog_cache(tables=[], keys={"members": ["m1"], "product_sellers": ["p1"]})
+    assert repository.seller_context_cache.get("p1") is None
+    assert repository.seller_context_cache.get("p2") == ["b"]
+
+    repository.invalidate_catalog_cache(tables=[], keys={"members": ["m1"]})
+    assert repository.seller_context_cache.get("p2") is None
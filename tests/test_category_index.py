@@ -0,0 +1,47 @@
+import pytest
+
+from app.services.category_index import CategoryIndex
+
+ROWS = [
+    (1, "لوازم خانگی", None, None),
+    (2, "یخچال و فریزر", 1, {"حجم": "20 فوت", "رنگ": "سفید"}),
+    (3, "گوشی موبایل", 4, {"حافظه": "128"}),
+    (4, "کالای دیجیتال", None, {}),
+]
+
+
+def test_resolve_tolerates_llm_spelling_variants():
+    """Arabic letters, ZWNJ, quotes and small typos still find the category."""
+    index = CategoryIndex(ROWS)
+    assert index.resolve("یخچال و فریزر").id == 2
+    assert index.resolve('"گوشي‌موبايل"').id == 3
+    assert index.resolve("یخچال و فریزرر").id == 2
+    assert index.resolve("تلویزیون") is None
+    assert index.schema("گوشی موبایل") == {"حافظه": "128"}
+    assert [c.id for c in index.ancestors(2)] == [1]
+    assert index.children[1] == (2,)
+    assert index.titles_text.splitlines()[0] == "لوازم خانگی"
+
+
+def test_index_is_immutable():
+    """Readers cannot change the shared snapshot."""
+    index = CategoryIndex(ROWS)
+    with pytest.raises(TypeError):
+        index.by_id[5] = None
+    with pytest.raises(TypeError):
+        index.by_id[2].features_example["رنگ"] = "مشکی"
+
+
+def test_shortlist_skips_llm_only_for_a_clear_winner():
+    """A message naming a category picks it locally; a vague one yields candidates for the LLM."""
+    index = CategoryIndex(ROWS)
+    shortlist = index.shortlist_for_prompt("یه گوشي موبایل ارزون میخوام")
+    assert shortlist.winner == "گوشی موبایل"
+
+    vague = index.shortlist_for_prompt("یه چیزی با حافظه زیاد")
+    assert vague.winner is None
+    assert vague.titles_text.splitlines()[0] == "گوشی موبایل"
+
+    unknown = index.shortlist_for_prompt("سلام")
+    assert unknown.winner is None
+    assert unknown.titles_text == index.titles_text
@@ -0,0 +1,44 @@
+import asyncio
+
+from app.core import cost_manager
+
+
+def test_concurrent_requests_keep_separate_costs():
+    """Interleaved requests must not see each other's LLM costs."""
+
+    async def fake_request(model: str, calls: int):
+        token = cost_manager.start_request()
+        for _ in range(calls):
+            cost_manager.record_usage(model, input_tokens=100, output_tokens=10, cost=0.5, latency=0.01)
+            await asyncio.sleep(0)
+        return cost_manager.end_request(token)
+
+    async def main():
+        return await asyncio.gather(fake_request("model-a", 3), fake_request("model-b", 1))
+
+    before = cost_manager.get_session_usage()["total_cost"]
+    first, second = asyncio.run(main())
+
+    assert first.total_cost == 1.5
+    assert first.as_dict()["model-a"]["calls"] == 3
+    assert second.total_cost == 0.5
+    assert "model-a" not in second.as_dict()
+    assert cost_manager.get_session_usage()["total_cost"] == before + 2.0
+
+
+def test_child_tasks_record_into_parent_request():
+    """Tasks spawned inside a request (e.g. scenario 5's TaskGroup) share its accounting."""
+
+    async def main():
+        token = cost_manager.start_request()
+        async with asyncio.TaskGroup() as tg:
+            tg.create_task(_record("model-c"))
+            tg.create_task(_record("model-c"))
+        return cost_manager.end_request(token)
+
+    async def _record(model: str):
+        cost_manager.record_usage(model, 1, 1, 0.25)
+
+    request_cost = asyncio.run(main())
+    assert request_cost.total_calls == 2
+    assert request_cost.total_cost == 0.5
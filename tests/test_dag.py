@@ -0,0 +1,72 @@
+import asyncio
+
+import pytest
+
+from app.core import dag
+from app.core.dag import TaskGraph
+
+
+def test_independent_steps_overlap_and_critical_path():
+    """Steps without dependencies run together; the slow chain is the critical path."""
+
+    async def sleep_then(value, delay):
+        await asyncio.sleep(delay)
+        return value
+
+    async def main():
+        graph = (
+            TaskGraph("test")
+            .add("greeting", lambda: sleep_then("hi", 0.02))
+            .add("categories", lambda: sleep_then(["a", "b"], 0.03))
+            .add("category", lambda categories: sleep_then(categories[0], 0.05), deps=["categories"])
+        )
+        return graph, await graph.run()
+
+    graph, results = asyncio.run(main())
+    assert results == {"greeting": "hi", "categories": ["a", "b"], "category": "a"}
+    assert graph.timings["categories"].start < graph.timings["greeting"].end
+    assert graph.critical_path() == ["categories", "category"]
+
+
+def test_failure_cancels_running_steps():
+    """The original exception surfaces and sibling steps are cancelled."""
+    cancelled = []
+
+    async def slow():
+        try:
+            await asyncio.sleep(1)
+        except asyncio.CancelledError:
+            cancelled.append(True)
+            raise
+
+    async def broken():
+        raise ValueError("boom")
+
+    async def main():
+        await TaskGraph("test").add("slow", slow).add("broken", broken).run()
+
+    with pytest.raises(ValueError, match="boom"):
+        asyncio.run(main())
+    assert cancelled == [True]
+
+
+def test_timed_steps_records_linear_handlers(monkeypatch):
+    """Steps of a decorated handler are timed in order and form its critical path; outside one, timed_step just awaits."""
+    summaries = []
+    monkeypatch.setattr(dag.SequentialSteps, "finish", lambda self: summaries.append(self.summary()))
+
+    async def sleep_then(value, delay):
+        await asyncio.sleep(delay)
+        return value
+
+    @dag.timed_steps("state_2")
+    async def handler():
+        filters = await dag.timed_step("extract", sleep_then({"q": "میز"}, 0.01))
+        return await dag.timed_step("search", sleep_then([filters["q"]], 0.01))
+
+    assert asyncio.run(handler()) == ["میز"]
+    assert asyncio.run(dag.timed_step("alone", sleep_then(1, 0))) == 1
+    (summary,) = summaries
+    assert list(summary["steps"]) == ["extract", "search"]
+    assert summary["critical_path"] == ["extract", "search"]
+    assert summary["steps"]["search"]["start_ms"] >= summary["steps"]["extract"]["end_ms"]
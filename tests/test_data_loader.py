@@ -0,0 +1,78 @@
+import csv
+import io
+import json
+
+import pyarrow as pa
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.schema import CreateIndex, CreateTable
+
+from app.db.models import BaseProduct
+from scripts.copy_loader import CsvStream, batch_to_csv, drop_foreign_keys, load_levels, sync_database_url, to_json_text
+from scripts.data_loader import _plan_index_names, orm_tables, orphan_rows_sql
+
+
+def test_base_products_schema_has_generated_tsvector_and_trigram_index():
+    """The ORM schema the loader creates keeps the search columns in sync by itself."""
+    dialect = postgresql.dialect()
+    ddl = str(CreateTable(BaseProduct.__table__).compile(dialect=dialect))
+    assert "persian_name_tsv TSVECTOR GENERATED ALWAYS AS" in ddl
+    indexes = {str(CreateIndex(index).compile(dialect=dialect)) for index in BaseProduct.__table__.indexes}
+    assert any("USING gin (persian_name gin_trgm_ops)" in index for index in indexes)
+    assert "product_sellers" not in orm_tables()
+    assert list(orm_tables()).index("categories") < list(orm_tables()).index("base_products")
+
+
+def test_list_columns_become_json_text_without_per_row_python():
+    """Escaping, null elements, empty and null lists survive the vectorized conversion."""
+    lists = pa.array([['a"b\\', "c\nd"], None, [], ["x", None]])
+    text = to_json_text(lists).to_pylist()
+    assert [json.loads(value) if value is not None else None for value in text] == lists.to_pylist()
+    assert to_json_text(pa.array([[1, 2], [3]])).to_pylist() == ["[1,2]", "[3]"]
+    assert to_json_text(pa.array(['{"a": 1}', "plain"])).to_pylist() == ['{"a": 1}', '"plain"']
+
+    batch = pa.record_batch([pa.array(["k1", "k2"]), lists.slice(2)], names=["random_key", "members"])
+    rows = list(csv.reader(io.StringIO(b"".join(CsvStream([batch_to_csv(batch, {"members"})])).decode())))
+    assert rows == [["k1", "[]"], ["k2", '["x",null]']]
+
+
+def test_load_levels_follow_foreign_keys():
+    """Referenced tables load in an earlier group than the tables pointing at them."""
+    levels = load_levels(["members", "base_products", "shops", "cities", "categories", "brands"])
+    assert levels == [["brands", "categories", "cities"], ["base_products", "shops"], ["members"]]
+    assert sync_database_url("postgresql+asyncpg://u:p@db/x") == "postgresql+psycopg2://u:p@db/x"
+
+
+def test_plan_index_names_walks_nested_plans():
+    """Index scans nested under bitmap heap scans are found."""
+    plan = [{"Plan": {"Node Type": "Bitmap Heap Scan", "Plans": [
+        {"Node Type": "Bitmap Index Scan", "Index Name": "ix_base_products_persian_name_trgm"}
+    ]}}]
+    assert _plan_index_names(plan) == {"ix_base_products_persian_name_trgm"}
+
+
+class _RecordingCursor:
+    def __init__(self, rows):
+        self.rows, self.statements = rows, []
+
+    def execute(self, statement, params=None):
+        self.statements.append(statement)
+
+    def fetchall(self):
+        return self.rows
+
+
+def test_foreign_keys_are_dropped_for_copy_and_orphans_found_without_failing_it():
+    """Foreign keys come off before COPY in referenced-table order; orphans are found with a NOT EXISTS check."""
+    cursor = _RecordingCursor([
+        ("members_shop_id_fkey", "FOREIGN KEY (shop_id) REFERENCES shops(id)", "shops"),
+        ("members_base_random_key_fkey", "FOREIGN KEY (base_random_key) REFERENCES base_products(random_key) NOT VALID", "base_products"),
+    ])
+    assert drop_foreign_keys(cursor, "members") == [
+        ("members_base_random_key_fkey", "FOREIGN KEY (base_random_key) REFERENCES base_products(random_key)"),
+        ("members_shop_id_fkey", "FOREIGN KEY (shop_id) REFERENCES shops(id)"),
+    ]
+    assert cursor.statements[1] == 'ALTER TABLE "members" DROP CONSTRAINT "members_base_random_key_fkey"'
+
+    sql = orphan_rows_sql("members", ["base_random_key"], "base_products", ["random_key"])
+    assert 't."base_random_key" IS NOT NULL' in sql
+    assert 'NOT EXISTS (SELECT 1 FROM base_products r WHERE r."random_key" = t."base_random_key")' in sql
@@ -0,0 +1,98 @@
+import asyncio
+
+from app.services import first_stage
+
+
+def _patch(monkeypatch, answer):
+    searched, prompts = [], []
+
+    async def find_similar(db, name, limit=10):
+        searched.append(name)
+        return [{"id": "fbqlhy", "product_name": "فرش اتاق کودک طرح سه بعدی کد 8101", "score": 0.6}]
+
+    async def structured(message, systemprompt, schema, schema_name, model):
+        prompts.append(systemprompt)
+        if isinstance(answer, Exception):
+            raise answer
+        return answer
+
+    async def no_cache(key):
+        return None
+
+    async def store(key, scenario, product_name, product_id=None):
+        pass
+
+    monkeypatch.setattr(first_stage.repository, "find_similar_products_with_scores", find_similar)
+    monkeypatch.setattr(first_stage, "structured_openai_gpt_request", structured)
+    monkeypatch.setattr(first_stage, "get_cached_selection", no_cache)
+    monkeypatch.setattr(first_stage, "store_classification", store)
+    return searched, prompts
+
+
+def test_one_call_classifies_and_picks_a_candidate(monkeypatch):
+    """Candidates from the local name guess go into the prompt; only a listed id is accepted as the product."""
+    message = "لطفاً فرش اتاق کودک طرح ۳ بعدی با کد ۸۱۰۱ را برای من بیابید."
+    searched, prompts = _patch(monkeypatch, {"scenario": "SCENARIO_1_DIRECT_SEARCH", "product_name": "فرش کودک 8101", "product_id": "fbqlhy"})
+    result = asyncio.run(first_stage.classify_and_select(message, db=None))
+    assert (result.scenario, result.found_key, result.source) == ("SCENARIO_1_DIRECT_SEARCH", "fbqlhy", "combined")
+    assert searched == ["فرش اتاق کودک طرح 3 بعدی کد 8101"]
+    assert '"id":"fbqlhy"' in prompts[0]
+
+    _patch(monkeypatch, {"scenario": "SCENARIO_3_SELLER_INFO", "product_name": "x", "product_id": "made-up"})
+    assert asyncio.run(first_stage.classify_and_select(message, db=None)).found_key is None
+
+    _patch(monkeypatch, {"scenario": "SCENARIO_4_CONVERSATIONAL_SEARCH", "product_name": "فرش", "product_id": "fbqlhy"})
+    assert asyncio.run(first_stage.classify_and_select(message, db=None)).found_key is None
+
+    _patch(monkeypatch, RuntimeError("json_schema not supported"))
+    assert asyncio.run(first_stage.classify_and_select(message, db=None)) is None
+
+
+def test_cache_hit_skips_the_candidate_search(monkeypatch):
+    """A cached classification needs no candidates, so no trigram query runs."""
+    searched, prompts = _patch(monkeypatch, {})
+
+    async def cached(key):
+        return "SCENARIO_4_CONVERSATIONAL_SEARCH", "فرش", None
+
+    monkeypatch.setattr(first_stage, "get_cached_selection", cached)
+    result = asyncio.run(first_stage.classify_and_select("یک فرش می‌خواهم", db=None))
+    assert (result.scenario, result.source) == ("SCENARIO_4_CONVERSATIONAL_SEARCH", "cache")
+    assert searched == [] and prompts == []
+
+
+def test_cache_hit_returns_the_selected_product_while_it_exists(monkeypatch):
+    """The cached product id is returned only after checking the catalog, so no resolver call follows a hit."""
+    _, prompts = _patch(monkeypatch, {})
+    catalog = {"fbqlhy"}
+
+    async def cached(key):
+        return "SCENARIO_3_SELLER_INFO", "فرش کودک 8101", "fbqlhy"
+
+    async def get_product(db, random_key):
+        return object() if random_key in catalog else None
+
+    monkeypatch.setattr(first_stage, "get_cached_selection", cached)
+    monkeypatch.setattr(first_stage.repository, "get_product_by_random_key", get_product)
+    result = asyncio.run(first_stage.classify_and_select("قیمت فرش کودک ۸۱۰۱", db=None))
+    assert (result.found_key, result.source) == ("fbqlhy", "cache") and prompts == []
+
+    catalog.clear()
+    assert asyncio.run(first_stage.classify_and_select("قیمت فرش کودک ۸۱۰۱", db=None)).found_key is None
+
+
+def test_cache_key_is_versioned_by_the_first_stage_prompt(monkeypatch):
+    """Editing the selection prompt invalidates cached entries; the tool-based path uses other keys."""
+    from app.llm.tools.definitions import EMBED_FIRST_AGENT_TOOLS
+    from app.services.classification_cache import classification_key
+
+    message = "قیمت فرش کد ۸۱۰۱"
+    key = first_stage._classification_cache_key(message)
+    tool_key = classification_key(
+        message, first_stage.FIRST_AGENT_PROMPT.get("main_prompt", ""), first_stage.CLASSIFICATION_MODEL, EMBED_FIRST_AGENT_TOOLS
+    )
+    assert key != tool_key
+
+    template = first_stage.FIRST_STAGE_PROMPT["selection_template"]
+    monkeypatch.setitem(first_stage.FIRST_STAGE_PROMPT, "selection_template", template + "\nBe brief.")
+    assert first_stage._classification_cache_key(message) != key
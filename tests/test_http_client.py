@@ -0,0 +1,80 @@
+import asyncio
+
+from aiohttp import web
+
+from app.core.http_client import HttpClientPool, post_async_request
+
+
+def test_post_json_retries_and_reuses_connection():
+    """A 503 is retried and both attempts share one pooled connection."""
+    calls = []
+
+    async def handler(request):
+        calls.append(request.transport.get_extra_info("peername"))
+        if len(calls) == 1:
+            return web.json_response({"error": "busy"}, status=503)
+        return web.json_response({"echo": await request.json()})
+
+    async def main():
+        app = web.Application()
+        app.router.add_post("/search/", handler)
+        runner = web.AppRunner(app)
+        await runner.setup()
+        site = web.TCPSite(runner, "127.0.0.1", 0)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+
+        pool = HttpClientPool()
+        try:
+            result = await pool.post_json(f"http://127.0.0.1:{port}/search/", {"q": "میز"})
+        finally:
+            await pool.close()
+            await runner.cleanup()
+        return result
+
+    result = asyncio.run(main())
+    assert result == {"echo": {"q": "میز"}}
+    assert len(calls) == 2
+    assert calls[0] == calls[1]
+
+
+def test_post_async_request_returns_none_on_failure():
+    """The legacy helper keeps returning None when the server is unreachable."""
+    assert asyncio.run(post_async_request("http://127.0.0.1:9/unreachable", {})) is None
+
+
+def test_post_json_retries_stop_at_the_deadline(monkeypatch):
+    """Attempts are cut to the retry deadline instead of each getting the full per-attempt timeout."""
+    from app.core import http_client
+
+    monkeypatch.setattr(http_client.settings, "HTTP_RETRY_DEADLINE", 0.3)
+    monkeypatch.setattr(http_client.settings, "HTTP_TOTAL_TIMEOUT", 10.0)
+    calls = []
+
+    async def handler(request):
+        calls.append(1)
+        await asyncio.sleep(1)
+        return web.json_response({})
+
+    async def main():
+        app = web.Application()
+        app.router.add_post("/slow/", handler)
+        runner = web.AppRunner(app)
+        await runner.setup()
+        site = web.TCPSite(runner, "127.0.0.1", 0)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+
+        pool = HttpClientPool()
+        started = asyncio.get_running_loop().time()
+        try:
+            await pool.post_json(f"http://127.0.0.1:{port}/slow/", {})
+        except asyncio.TimeoutError:
+            return asyncio.get_running_loop().time() - started
+        finally:
+            await pool.close()
+            await runner.cleanup()
+
+    elapsed = asyncio.run(main())
+    assert elapsed is not None and elapsed < 0.9
+    assert len(calls) == 1
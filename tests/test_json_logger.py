@@ -0,0 +1,50 @@
+import json
+
+from app.core.json_logger import RequestLogWriter, _rotated_files, read_log_records
+
+
+def test_ids_continue_from_file_tail(tmp_path):
+    """A new writer resumes ids after the last record already on disk."""
+    log_file = tmp_path / "request_logs.jsonl"
+    log_file.write_text(
+        json.dumps({"request": {}, "id": 1}) + "\n" + json.dumps({"request": {}, "id": 7}) + "\n",
+        encoding="utf-8",
+    )
+
+    writer = RequestLogWriter(log_file, max_bytes=0, max_age_seconds=0, flush_interval=0.05)
+    assert writer.log({"request": {"chat_id": "a"}}) == 8
+    assert writer.log({"request": {"chat_id": "b"}}) == 9
+    writer.close()
+
+    ids = [record["id"] for record in read_log_records(log_file)]
+    assert ids == [1, 7, 8, 9]
+
+
+def test_rotation_keeps_records_readable(tmp_path):
+    """Rotated files are picked up again when the counter is recovered."""
+    log_file = tmp_path / "request_logs.jsonl"
+    writer = RequestLogWriter(log_file, max_bytes=1, max_age_seconds=0, flush_interval=0.05)
+    writer.log({"scenario": "SCENARIO_1_DIRECT_SEARCH"})
+    writer.close()
+
+    assert not log_file.exists()
+    rotated = list(tmp_path.glob("request_logs.*.jsonl"))
+    assert len(rotated) == 1
+
+    writer = RequestLogWriter(log_file, max_bytes=0, max_age_seconds=0, flush_interval=0.05)
+    assert writer.log({"scenario": "SCENARIO_2_FEATURE_EXTRACTION"}) == 2
+    writer.close()
+
+
+def test_same_second_rotations_keep_their_order(tmp_path):
+    """Counter-suffixed files from the same second sort after the first one, so ids resume after the newest."""
+    log_file = tmp_path / "request_logs.jsonl"
+    log_file.write_text("", encoding="utf-8")
+    names = [f"request_logs.20250101-120000{counter}.jsonl" for counter in ("", "-1", "-2", "-10")]
+    for record_id, name in enumerate(names, start=1):
+        (tmp_path / name).write_text(json.dumps({"id": record_id}) + "\n", encoding="utf-8")
+
+    assert [path.name for path in _rotated_files(log_file)] == names
+    writer = RequestLogWriter(log_file, max_bytes=0, max_age_seconds=0, flush_interval=0.05)
+    assert writer.log({"scenario": "SCENARIO_1_DIRECT_SEARCH"}) == 5
+    writer.close()
@@ -0,0 +1,74 @@
+import asyncio
+
+import pytest
+from openai.types.chat import ChatCompletion, ChatCompletionChunk
+
+from app.services.llm_cassette import CassetteMiss, LLMCassette, request_key
+
+COMPLETION = {
+    "id": "chatcmpl-1",
+    "object": "chat.completion",
+    "created": 1,
+    "model": "gpt-4.1-mini",
+    "choices": [{
+        "index": 0,
+        "finish_reason": "tool_calls",
+        "message": {
+            "role": "assistant",
+            "content": None,
+            "tool_calls": [{"id": "call_1", "type": "function", "function": {"name": "classify_user_request", "arguments": '{"scenario": "SCENARIO_1_DIRECT_SEARCH"}'}}],
+        },
+    }],
+    "usage": {"prompt_tokens": 120, "completion_tokens": 9, "total_tokens": 129},
+}
+
+
+def test_recorded_exchange_replays_tool_calls_and_usage_without_the_api(tmp_path):
+    """A recorded completion is served from disk by content address; unknown requests miss in replay mode."""
+    calls = []
+
+    async def create(**request):
+        calls.append(request)
+        return ChatCompletion.model_validate(COMPLETION)
+
+    request = {"model": "gpt-4.1-mini", "messages": [{"role": "user", "content": "سلام"}], "tools": [], "tool_choice": "auto"}
+
+    async def run():
+        await LLMCassette(str(tmp_path), mode="record").call("chat", create, **request)
+        replay = LLMCassette(str(tmp_path), mode="replay", latency=0)
+        response = await replay.call("chat", create, **request)
+        with pytest.raises(CassetteMiss):
+            await replay.call("chat", create, **{**request, "model": "gpt-4.1"})
+        return response
+
+    response = asyncio.run(run())
+    assert len(calls) == 1
+    assert response.choices[0].message.tool_calls[0].function.name == "classify_user_request"
+    assert response.usage.prompt_tokens == 120
+    assert request_key("chat", request) == request_key("chat", {**request, "stream": True})
+
+
+def test_streams_are_recorded_whole_and_replayed_as_chunks(tmp_path):
+    """A streamed answer is stored as one completion and replayed as content chunks plus a usage chunk."""
+    base = {"id": "c", "object": "chat.completion.chunk", "created": 1, "model": "m"}
+
+    async def create(**request):
+        async def chunks():
+            for piece in ("سلام، ", "چطور ", "کمک کنم؟"):
+                yield ChatCompletionChunk.model_validate({**base, "choices": [{"index": 0, "delta": {"content": piece}}]})
+            yield ChatCompletionChunk.model_validate({**base, "choices": [], "usage": {"prompt_tokens": 5, "completion_tokens": 3, "total_tokens": 8}})
+        return chunks()
+
+    request = {"model": "m", "messages": [{"role": "user", "content": "hi"}], "stream": True}
+
+    async def collect(cassette):
+        return [chunk async for chunk in await cassette.call("chat", create, **request)]
+
+    recorded = asyncio.run(collect(LLMCassette(str(tmp_path), mode="auto")))
+    replayed = asyncio.run(collect(LLMCassette(str(tmp_path), mode="replay", latency=0)))
+    text = lambda chunks: "".join(c.choices[0].delta.content or "" for c in chunks if c.choices)
+    assert text(recorded) == text(replayed) == "سلام، چطور کمک کنم؟"
+    assert replayed[-1].usage.completion_tokens == 3
+
+    plain = asyncio.run(LLMCassette(str(tmp_path), mode="replay", latency=0).call("chat", create, **{**request, "stream": False}))
+    assert plain.choices[0].message.content == "سلام، چطور کمک کنم؟"
@@ -0,0 +1,35 @@
+from app.services.llm_payload import build_products_payload, dumps_compact, estimate_tokens, seller_table
+
+
+def _product(index, sellers):
+    return {
+        "product_name": f"یخچال مدل {index}",
+        "base_product_key": f"p{index}",
+        "product_features": {"رنگ": "سفید", "حجم": "20 فوت", "وزن": "70", "کشور سازنده": "ایران"},
+        "sellers": [
+            {"member_key": f"m{index}-{i}", "price": 1000 + i, "city": "تهران", "shop_score": i % 5, "has_warranty": i % 2 == 0, "shop_id": i}
+            for i in range(sellers)
+        ],
+    }
+
+
+def test_payload_stays_within_budget_for_many_sellers():
+    """Prompt size is bounded no matter how many sellers a product has."""
+    small = build_products_payload([_product(i, 3) for i in range(5)], token_budget=1500)
+    large = build_products_payload([_product(i, 500) for i in range(5)], token_budget=1500)
+    assert estimate_tokens(dumps_compact(large)) <= 1500
+    assert large[0]["seller_count"] == 500
+    assert large[0]["min_price"] == 1000
+    assert len(small) == len(large) == 5
+
+
+def test_features_projected_and_sellers_columnar():
+    """Only schema features are kept and seller keys appear once per table."""
+    payload = build_products_payload([_product(1, 20)], schema='{"رنگ": "", "حجم": ""}', include_sellers=False)
+    assert payload[0]["product_features"] == {"رنگ": "سفید", "حجم": "20 فوت"}
+    assert "sellers" not in payload[0]
+
+    table = seller_table(_product(1, 20)["sellers"], limit=4)
+    assert table["columns"][0] == "member_key"
+    assert len(table["rows"]) == 4 and table["total_sellers"] == 20
+    assert table["rows"][0][1] == 1000  # the cheapest seller is always kept
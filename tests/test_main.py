@@ -1,3 +1,4 @@
+import json
 from fastapi.testclient import TestClient
 from app.main import app
 
@@ -44,4 +45,31 @@ def test_sanity_check_member_key():
     assert response.status_code == 200
     data = response.json()
     assert data["member_random_keys"] == [test_key]
-    assert data["message"] is None
\ No newline at end of file
+    assert data["message"] is None
+
+
+def test_sanity_check_ping_streamed():
+    """The streaming endpoint ends with the same structured response as /chat."""
+    payload = {
+        "chat_id": "sanity-check-ping-stream",
+        "messages": [{"type": "user", "content": "ping"}]
+    }
+    response = client.post("/chat/stream", json=payload)
+
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("application/x-ndjson")
+    events = [json.loads(line) for line in response.text.splitlines()]
+    assert events[-1] == {
+        "type": "final",
+        "response": {"message": "pong", "base_random_keys": None, "member_random_keys": None},
+    }
+
+
+def test_cache_invalidation_requires_the_token(monkeypatch):
+    """Without the configured token, or from a non-loopback client without one, the caches are left alone."""
+    payload = {"tables": [], "keys": {}}
+    assert client.post("/cache/invalidate", json=payload).status_code == 403
+
+    monkeypatch.setattr("app.main.settings.CACHE_INVALIDATION_TOKEN", "s3cret")
+    assert client.post("/cache/invalidate", json=payload, headers={"X-Cache-Token": "wrong"}).status_code == 403
+    assert client.post("/cache/invalidate", json=payload, headers={"X-Cache-Token": "s3cret"}).status_code == 200
@@ -0,0 +1,27 @@
+import numpy as np
+
+from app.services.product_index import ProductVectorIndex, fuse_scores
+
+
+def test_batched_search_over_memory_mapped_index(tmp_path):
+    """Each query gets its own top-k, best first, even when results span several scan blocks."""
+    rng = np.random.default_rng(0)
+    vectors = rng.normal(size=(50, 8)).astype(np.float32)
+    keys = [f"p{i}" for i in range(50)]
+    ProductVectorIndex.save(str(tmp_path), keys, [f"name {i}" for i in range(50)], vectors, "test-model")
+
+    index = ProductVectorIndex.load(str(tmp_path))
+    assert isinstance(index.vectors, np.memmap)
+
+    results = index.search(vectors[[3, 41]] * 2.0, top_k=3, block_rows=16)
+    assert [hits[0][0] for hits in results] == ["p3", "p41"]
+    assert all(len(hits) == 3 for hits in results)
+    assert results[0][0][2] > results[0][1][2] >= results[0][2][2]
+    assert abs(index.score_keys(vectors[3], ["p3", "missing"])["p3"] - 1.0) < 1e-5
+
+
+def test_fuse_scores_combines_both_rankings():
+    """A product strong on both signals beats one that only matches lexically."""
+    fused = fuse_scores({"a": 0.9, "b": 0.2}, {"a": 0.5, "b": 0.8, "c": 0.6}, vector_weight=0.6)
+    assert max(fused, key=fused.get) == "a"
+    assert fused["c"] == 0.4 * 0.6
@@ -0,0 +1,29 @@
+from app.services.product_resolver import model_codes, resolve_candidates
+
+
+def candidates(*rows):
+    return [{"id": key, "product_name": name, "score": score} for key, name, score in rows]
+
+
+def test_unambiguous_matches_skip_the_llm_and_close_calls_do_not():
+    """Exact names, clear similarity leads and unique model codes resolve; ties and near misses go to the LLM."""
+    hits = candidates(("a", "گوشی سامسونگ Galaxy A54", 0.7), ("b", "گوشی سامسونگ Galaxy A34", 0.65))
+    exact = resolve_candidates(["گوشي سامسونگ galaxy a54"], hits)
+    assert (exact.key, exact.path) == ("a", "exact_name")
+
+    assert resolve_candidates(["x"], candidates(("a", "فرش", 0.92), ("b", "فرش ماشینی", 0.6))).path == "similarity_gap"
+    assert resolve_candidates(["x"], candidates(("a", "فرش", 0.92), ("b", "فرش ماشینی", 0.85))).path == "llm"
+
+    rugs = candidates(("r1", "فرش کودک طرح ۳ بعدی کد 8101", 0.55), ("r2", "فرش کودک طرح ۳ بعدی کد 8102", 0.55))
+    by_code = resolve_candidates(["فرش اتاق کودک و نوجوان طرح ۳ بعدی با کد ۸۱۰۱"], rugs)
+    assert (by_code.key, by_code.path) == ("r1", "model_code")
+
+    duplicates = candidates(("a", "فرش", 0.9), ("b", "فرش", 0.9))
+    assert resolve_candidates(["فرش"], duplicates).path == "llm"
+    assert resolve_candidates(["فرش"], []).key is None
+
+
+def test_model_codes_ignore_sizes_and_capacities():
+    """Mixed letter/digit tokens and long numbers are codes; short numbers like ۳۲ are not."""
+    assert model_codes("پکیج لورچ ظرفیت ۳۲ هزار مدل SM-A546") == {"sma546"}
+    assert model_codes("کد ۸۱۰۱ سایز 120") == {"8101"}
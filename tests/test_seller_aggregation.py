@@ -0,0 +1,56 @@
+import pytest
+
+from app.services.seller_aggregation import NO_MATCH, SELLER_METRICS, AggregationSpec, SellerColumns, question_template
+
+SELLERS = [
+    {"price": 1000, "city": "تهران", "shop_score": 4.5, "has_warranty": True},
+    {"price": 1500, "city": "تهران", "shop_score": 3.0, "has_warranty": False},
+    {"price": 1250, "city": "اصفهان", "shop_score": 5.0, "has_warranty": True},
+]
+
+
+def test_spec_filters_and_metrics():
+    """Filters are ANDed and metrics are computed over the matching rows only."""
+    columns = SellerColumns(SELLERS)
+
+    def run(spec):
+        parsed = AggregationSpec.from_dict(spec)
+        return parsed.format(parsed.evaluate(columns))
+
+    assert run({"filters": {"city": "تهران"}, "metric": "count"}) == "2"
+    assert run({"filters": {"has_warranty": True}, "metric": "min", "field": "price"}) == "1000"
+    assert run({"filters": {}, "metric": "avg", "field": "shop_score"}) == "4.17"
+    assert run({"filters": {"city": "شیراز"}, "metric": "min"}) == NO_MATCH
+    assert AggregationSpec.from_dict({"metric": "none", "label": "x"}).describe(columns) is None
+
+
+def test_missing_values_are_left_out_of_metrics():
+    """A seller without a price or score is counted but does not pull min/avg/median towards 0."""
+    columns = SellerColumns(SELLERS + [{"price": None, "city": "تهران", "shop_score": None, "has_warranty": True}])
+
+    def run(spec):
+        parsed = AggregationSpec.from_dict(spec)
+        return parsed.format(parsed.evaluate(columns))
+
+    assert run({"filters": {"city": "تهران"}, "metric": "count"}) == "3"
+    assert run({"filters": {"city": "تهران"}, "metric": "min"}) == "1000"
+    assert run({"filters": {}, "metric": "median"}) == "1250"
+    assert run({"filters": {"max_price": 900}, "metric": "count"}) == "0"
+
+
+def test_spec_rejects_unknown_fields():
+    """Anything outside the spec grammar is refused instead of executed."""
+    with pytest.raises(ValueError):
+        AggregationSpec.from_dict({"metric": "__import__('os')"})
+    with pytest.raises(ValueError):
+        # Scenario 3 would answer NO_MATCH to a question that matched nothing.
+        AggregationSpec.from_dict({"metric": "none"}, metrics=SELLER_METRICS)
+    with pytest.raises(ValueError):
+        AggregationSpec.from_dict({"metric": "min", "filters": {"shop_id": 3}})
+
+
+def test_question_template_strips_product_name():
+    """Questions about different products share one cache entry."""
+    assert question_template("ارزانترین قیمت گوشي A10 چنده؟", "گوشی A10") == question_template(
+        "ارزانترین قیمت گوشی b20 چنده", "گوشی B20"
+    )
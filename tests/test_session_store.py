@@ -0,0 +1,124 @@
+import asyncio
+
+import pytest
+
+from app.schemas.state import Scenario4State
+from app.services.session_store import InMemorySessionStore, RedisSessionStore
+
+
+class LocalRedis:
+    """Stand-in for redis.asyncio with the hash/list commands the store uses."""
+
+    def __init__(self):
+        self.data = {}
+        self.commands = []
+
+    def pipeline(self, transaction=True):
+        return _Pipeline(self)
+
+    async def delete(self, *keys):
+        for key in keys:
+            self.data.pop(key, None)
+
+    async def exists(self, key):
+        return int(key in self.data)
+
+
+class _Pipeline:
+    def __init__(self, client):
+        self.client = client
+        self.queued = []
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+    def __getattr__(self, name):
+        return lambda *args, **kwargs: self.queued.append((name, args, kwargs))
+
+    async def execute(self):
+        data, results = self.client.data, []
+        for name, args, kwargs in self.queued:
+            self.client.commands.append((name, args, kwargs))
+            if name == "hset":
+                data.setdefault(args[0], {}).update({k.encode(): v for k, v in kwargs["mapping"].items()})
+            elif name == "rpush":
+                data.setdefault(args[0], []).extend(args[1:])
+            elif name == "hgetall":
+                results.append(dict(data.get(args[0], {})))
+            elif name == "lrange":
+                results.append(list(data.get(args[0], [])))
+            elif name == "delete":
+                data.pop(args[0], None)
+        return results
+
+
+def _products():
+    return [{"product_name": "گوشی", "base_product_key": "p1", "sellers": [{"member_key": "m1", "price": 100}]}]
+
+
+def test_redis_store_writes_only_deltas():
+    """The second turn appends messages and the changed field, not the product payload."""
+    client = LocalRedis()
+    store = RedisSessionStore(ttl_seconds=60, client=client)
+
+    async def main():
+        state = Scenario4State(state=3, products_with_sellers=_products())
+        state.chat_history.append({"role": "user", "content": "سلام"})
+        await store.save("chat-1", state)
+        client.commands.clear()
+
+        loaded = await store.get("chat-1")
+        loaded.chat_history.append({"role": "assistant", "content": "کدام؟"})
+        loaded.state = 4
+        await store.save("chat-1", loaded)
+        return await store.get("chat-1")
+
+    final = asyncio.run(main())
+    writes = [(name, args, kwargs) for name, args, kwargs in client.commands if name in ("hset", "rpush")]
+    assert [name for name, _, _ in writes] == ["hset", "rpush"]
+    assert set(writes[0][2]["mapping"]) == {"state"}
+    assert len(writes[1][1]) == 2  # key + one new message
+    assert final.state == 4
+    assert final.products_with_sellers == _products()
+    assert [m["content"] for m in final.chat_history] == ["سلام", "کدام؟"]
+
+
+def test_in_memory_store_evicts_and_deletes():
+    """The in-memory backend is bounded and supports explicit cleanup."""
+    store = InMemorySessionStore(ttl_seconds=60, max_sessions=1)
+
+    async def main():
+        await store.save("a", Scenario4State())
+        await store.save("b", Scenario4State(state=2))
+        evicted = not await store.exists("a")
+        state_b = (await store.get("b")).state
+        await store.delete("b")
+        return evicted, state_b, await store.exists("b")
+
+    assert asyncio.run(main()) == (True, 2, False)
+
+
+def test_new_scenario_four_session_survives_a_failing_turn(monkeypatch):
+    """The first turn's session is stored before the state handler runs, as it was with the in-process dict."""
+    from app.schemas.chat import ChatRequest
+    from app.services import scenario_service
+
+    store = InMemorySessionStore(ttl_seconds=60, max_sessions=10)
+
+    async def failing_state_1(user_message, db, session):
+        raise RuntimeError("LLM down")
+
+    monkeypatch.setattr(scenario_service, "session_store", store)
+    monkeypatch.setattr(scenario_service, "scenario_4_state_1", failing_state_1)
+    request = ChatRequest(chat_id="s4-failing", messages=[{"type": "text", "content": "یک میز می‌خواهم"}])
+
+    async def run():
+        with pytest.raises(RuntimeError):
+            await scenario_service.scenario_four_in_memory(request, db=None)
+        return await store.get("s4-failing")
+
+    session = asyncio.run(run())
+    assert session is not None and session.chat_history[-1]["content"] == "یک میز می‌خواهم"
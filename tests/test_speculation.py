@@ -0,0 +1,83 @@
+import asyncio
+
+from app.core import speculation
+from app.services import first_stage
+
+
+async def _value(value, delay=0.0):
+    await asyncio.sleep(delay)
+    return value
+
+
+def test_settle_keeps_matching_work_and_cancels_the_rest(monkeypatch):
+    """Prefetches for other scenarios are cancelled on classification; claimed ones count as hits, unclaimed as waste."""
+    monkeypatch.setattr(speculation, "stats", speculation.SpeculationStats())
+
+    async def run():
+        async with speculation.Speculation(max_tasks=3, timeout=1.0) as spec:
+            spec.start("candidates", lambda: _value(["p1"]), key="فرش", scenarios={"SCENARIO_1_DIRECT_SEARCH"})
+            spec.start("shortlist", lambda: _value("rugs", delay=10), scenarios={"SCENARIO_4_CONVERSATIONAL_SEARCH"})
+            spec.start("unused", lambda: _value("x"))
+            speculation.settle("SCENARIO_1_DIRECT_SEARCH")
+            assert await speculation.take("candidates", key="فرش") == ["p1"]
+            await asyncio.sleep(0)
+        return await spec.close()
+
+    asyncio.run(run())
+    stats = speculation.stats.as_dict()
+    assert (stats["candidates"]["hit"], stats["shortlist"]["cancelled"], stats["unused"]["wasted"]) == (1, 1, 1)
+    assert stats["candidates"]["hit_rate"] == 1.0 and stats["shortlist"]["hit_rate"] == 0.0
+    assert speculation.stats.in_flight == 0
+    assert 'speculation_tasks_total{task="shortlist",outcome="cancelled"} 1' in speculation.render_metrics()
+
+
+def test_take_only_returns_results_made_for_the_key():
+    """A result computed for another key, including a key only known once the task ran, is not handed out."""
+
+    async def run():
+        async with speculation.Speculation() as spec:
+            spec.start("candidates", lambda: _value(["p1"]), key="guess")
+            spec.start("sellers", lambda: _value(speculation.Keyed("p1", [{"shop": 1}])))
+            return (
+                await spec.take("candidates", key="other"),
+                await spec.take("sellers", key="p2"),
+                await spec.take("sellers", key="p1"),
+                await speculation.take("missing"),
+            )
+
+    assert asyncio.run(run()) == (None, None, [{"shop": 1}], None)
+
+
+def test_budgets_skip_and_time_out(monkeypatch):
+    """Tasks over the per-request budget are not started; a task over the timeout ends as an error and yields None."""
+    monkeypatch.setattr(speculation, "stats", speculation.SpeculationStats())
+
+    async def run():
+        async with speculation.Speculation(max_tasks=1, timeout=0.01) as spec:
+            assert spec.start("slow", lambda: _value("late", delay=1))
+            assert not spec.start("second", lambda: _value("x"))
+            return await spec.take("slow")
+
+    assert asyncio.run(run()) is None
+    stats = speculation.stats.as_dict()
+    assert stats["slow"]["error"] == 1 and stats["second"]["skipped"] == 1
+    assert stats["second"]["started"] == 0 and speculation.stats.in_flight == 0
+
+
+def test_first_stage_uses_prefetched_candidates(monkeypatch):
+    """With candidates prefetched for the guessed name, the first stage does not search again."""
+    message = "لطفاً فرش اتاق کودک کد ۸۱۰۱ را برای من بیابید."
+    guess = first_stage.guess_product_name(message)
+    candidate = {"id": "fbqlhy", "product_name": "فرش اتاق کودک کد 8101", "score": 0.9}
+
+    async def no_search(db, name, limit=10):
+        raise AssertionError("searched again")
+
+    monkeypatch.setattr(first_stage.repository, "find_similar_products_with_scores", no_search)
+
+    async def run():
+        async with speculation.Speculation() as spec:
+            spec.start("product_candidates", lambda: _value([candidate]), key=guess)
+            return await first_stage._candidates(None, message)
+
+    assert asyncio.run(run()) == [candidate]
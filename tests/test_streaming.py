@@ -0,0 +1,32 @@
+import asyncio
+import json
+
+from app.core.streaming import after_code_block, emit_token, stream_events
+from app.schemas.chat import ChatResponse
+
+
+def test_tokens_stream_before_the_final_event():
+    """Tokens emitted while the pipeline runs arrive first; the ChatResponse is the terminal event."""
+
+    async def run():
+        emit_token("سلام")
+        await asyncio.sleep(0)
+        emit_token(" دنیا")
+        return ChatResponse(message="سلام دنیا", base_random_keys=["k1"])
+
+    async def collect():
+        return [json.loads(line) async for line in stream_events(run)]
+
+    events = asyncio.run(collect())
+    assert events[:2] == [{"type": "token", "text": "سلام"}, {"type": "token", "text": " دنیا"}]
+    assert events[2]["type"] == "final"
+    assert events[2]["response"]["base_random_keys"] == ["k1"]
+    # Outside a streaming request nothing is collected.
+    emit_token("ignored")
+
+
+def test_after_code_block_hides_the_json_part():
+    """Only the prose after a leading fenced JSON block is forwarded."""
+    accept = after_code_block()
+    deltas = ["```js", 'on\n{"random_key": "a"}\n`', "``\nمحصول اول", " بهتر است"]
+    assert "".join(accept(delta) for delta in deltas) == "محصول اول بهتر است"
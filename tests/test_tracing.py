@@ -0,0 +1,60 @@
+import asyncio
+
+from app.core.tracing import LatencyHistograms, current_span, Span, span, stage_latency, to_otlp, traced
+
+
+def test_spans_nest_and_feed_stage_histograms():
+    """Spans opened inside others (also across tasks) share the trace and point at their parent."""
+    seen = {}
+
+    @traced("test.query")
+    async def query():
+        await asyncio.sleep(0)
+        seen["child"] = current_span.get()
+        return [1, 2, 3]
+
+    async def run():
+        with span("test.request", chat_id="c1") as root:
+            async with asyncio.TaskGroup() as tg:
+                tg.create_task(query())
+        return root
+
+    root = asyncio.run(run())
+    assert root.end_ns is not None and root.attributes == {"chat_id": "c1"}
+    child = seen["child"]
+    assert (child.trace_id, child.parent_id) == (root.trace_id, root.span_id)
+    assert child.attributes["rows"] == 3
+    metrics = stage_latency.render()
+    assert 'chat_stage_duration_seconds_count{stage="test.query"}' in metrics
+    assert 'chat_stage_duration_seconds_bucket{stage="test.request",le="+Inf"}' in metrics
+
+
+def test_histogram_buckets_are_cumulative_and_otlp_payload_is_well_formed():
+    """Prometheus buckets count every observation at or below their bound."""
+    histograms = LatencyHistograms([0.1, 1])
+    for seconds in (0.05, 0.5, 5):
+        histograms.observe("llm.chat", seconds)
+    text = histograms.render("m")
+    assert 'm_bucket{stage="llm.chat",le="0.1"} 1' in text
+    assert 'm_bucket{stage="llm.chat",le="1"} 2' in text
+    assert 'm_bucket{stage="llm.chat",le="+Inf"} 3' in text
+    assert 'm_count{stage="llm.chat"} 3' in text
+
+    parent = Span("chat", None, {})
+    child = Span("llm.chat", parent, {"model": "gpt-4.1", "input_tokens": 12})
+    parent.end_ns = child.end_ns = parent.start_ns + 1
+    exported = to_otlp([parent, child], "svc")["resourceSpans"][0]["scopeSpans"][0]["spans"]
+    assert exported[1]["traceId"] == exported[0]["traceId"] and exported[1]["parentSpanId"] == parent.span_id
+    assert {"key": "input_tokens", "value": {"intValue": "12"}} in exported[1]["attributes"]
+
+
+def test_root_span_counts_db_queries_and_llm_tokens():
+    """Finished db.* and llm.* spans add to the counters of the request's root span."""
+    with span("chat") as root:
+        with span("db.get_product"):
+            pass
+        with span("llm.chat") as call:
+            call.set(input_tokens=120, output_tokens=8)
+            with span("db.nested"):
+                pass
+    assert root.counters == {"db_queries": 2, "llm_calls": 1, "prompt_tokens": 120, "completion_tokens": 8}